@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 from enum import StrEnum
 from backend.database.engine import create_db_and_tables, engine
@@ -9,12 +10,17 @@ from backend.database import db_sessionmaker
 from sqlmodel import select
 
 from backend.tasks.media_preparation import prepare_song
+from backend.tasks.media_preparation.batch_ingestion import SongIngestionStatus, ingest_song_manifest, write_song_ingestion_report
+from backend.tasks.preprocessing.batch_preprocessing import ProjectPreprocessingStatus, create_missing_projects, preprocess_projects
+from backend.utils.time import get_timestamp
 
 
 class ConsoleMenu(StrEnum):
     CreateUser = "Create user"
     ListUser = "Show users"
     AddSong = "Add song"
+    AddSongsFromManifest = "Add songs from manifest file"
+    PreprocessProjects = "Preprocess all projects"
     Exit = "Exit"
 
 validate_non_null_str = lambda s: "Required." if s is None or len(s) == 0 else True
@@ -93,6 +99,49 @@ async def _add_song():
             print("====Successfully created the song.")
 
 
+async def _add_songs_from_manifest(manifest_path: str, workers: int, force: bool, report_path: str | None):
+    report = await ingest_song_manifest(manifest_path, workers=workers, force=force)
+
+    report_path = report_path or f"song_ingestion_report_{get_timestamp()}.json"
+    write_song_ingestion_report(report, report_path)
+
+    print(f"====Ingested {len(report.items)} songs in {report.elapsed_seconds} sec.: {report.count(SongIngestionStatus.Created)} created, {report.count(SongIngestionStatus.Exists)} already exist, {report.count(SongIngestionStatus.Failed)} failed.")
+    for item in report.items:
+        if item.status == SongIngestionStatus.Failed:
+            print(f" - Failed: \"{item.title}\" by {item.artist} - {item.error}")
+    print(f"Saved report at {report_path}")
+
+async def _add_songs_from_manifest_interactive():
+    manifest_path = await questionary.path(message="Enter manifest file path (.csv or .json):", validate=validate_non_null_str).ask_async()
+    workers = await questionary.text(message="Number of songs to ingest concurrently:", default="2", validate=lambda s: True if s.isdigit() and int(s) > 0 else "Enter a positive number.").ask_async()
+    force = await questionary.confirm("Ingest songs again even if they already exist?", default=False).ask_async()
+    await _add_songs_from_manifest(manifest_path, int(workers), force, None)
+
+
+async def _preprocess_projects(project_ids: list[str] | None, all_users_songs: bool, concurrency: int, force: bool, report_path: str | None):
+    if all_users_songs:
+        new_project_ids = await create_missing_projects()
+        if project_ids is not None:
+            project_ids = project_ids + new_project_ids
+
+    report = await preprocess_projects(project_ids, concurrency=concurrency, force=force)
+
+    report_path = report_path or f"preprocessing_report_{get_timestamp()}.json"
+    with open(report_path, 'w') as f:
+        f.write(report.model_dump_json(indent=2))
+
+    print(f"====Preprocessed {report.unique_combinations} unique song-settings combinations in {report.elapsed_seconds} sec.: {report.count(ProjectPreprocessingStatus.Processed)} projects processed, {report.count(ProjectPreprocessingStatus.Skipped)} skipped, {report.count(ProjectPreprocessingStatus.Failed)} failed.")
+    for item in report.items:
+        if item.status == ProjectPreprocessingStatus.Failed:
+            print(f" - Failed: project {item.project_id} - {item.error}")
+    print(f"Saved report at {report_path}")
+
+async def _preprocess_projects_interactive():
+    all_users_songs = await questionary.confirm("Create projects for every user and song without one?", default=False).ask_async()
+    force = await questionary.confirm("Preprocess projects again even if they were already processed?", default=False).ask_async()
+    await _preprocess_projects(None, all_users_songs, 8, force, None)
+
+
 async def _run_console_loop():
 
     await create_db_and_tables(engine)
@@ -107,11 +156,47 @@ async def _run_console_loop():
             await _list_user()
         if menu is ConsoleMenu.AddSong:
             await _add_song()
+        if menu is ConsoleMenu.AddSongsFromManifest:
+            await _add_songs_from_manifest_interactive()
+        if menu is ConsoleMenu.PreprocessProjects:
+            await _preprocess_projects_interactive()
         elif menu is ConsoleMenu.Exit:
             print("Bye.")
             break
 
 
+async def _run_song_ingestion(args: argparse.Namespace):
+    await create_db_and_tables(engine)
+    await _add_songs_from_manifest(args.manifest, args.workers, args.force, args.report)
+
+async def _run_preprocessing(args: argparse.Namespace):
+    await create_db_and_tables(engine)
+    await _preprocess_projects(args.projects, args.all_users_songs, args.concurrency, args.force, args.report)
+
+
 if __name__ == "__main__":
-    print("Launching admin console...")
-    asyncio.run(_run_console_loop())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ELMI admin console")
+    subparsers = parser.add_subparsers(dest="command")
+
+    ingest_parser = subparsers.add_parser("ingest-songs", help="Ingest songs listed in a CSV/JSON manifest without prompts.")
+    ingest_parser.add_argument("manifest", help="Manifest file path. Each entry has title, artist, youtube_id, and optional lyrics, description, skip_genius and whitelist.")
+    ingest_parser.add_argument("--workers", type=int, default=2, help="Number of songs to ingest concurrently.")
+    ingest_parser.add_argument("--force", action="store_true", help="Ingest songs again even if they already exist.")
+    ingest_parser.add_argument("--report", default=None, help="File path of the JSON summary report.")
+
+    preprocess_parser = subparsers.add_parser("preprocess-projects", help="Preprocess annotations for many projects at once.")
+    preprocess_parser.add_argument("--projects", nargs="+", default=None, help="IDs of the projects to preprocess. All projects if omitted.")
+    preprocess_parser.add_argument("--all-users-songs", action="store_true", help="Create a project for every user and song without one.")
+    preprocess_parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of line batches analyzed at once across all projects.")
+    preprocess_parser.add_argument("--force", action="store_true", help="Preprocess projects again even if they were already processed.")
+    preprocess_parser.add_argument("--report", default=None, help="File path of the JSON summary report.")
+
+    args = parser.parse_args()
+
+    if args.command == "ingest-songs":
+        asyncio.run(_run_song_ingestion(args))
+    elif args.command == "preprocess-projects":
+        asyncio.run(_run_preprocessing(args))
+    else:
+        print("Launching admin console...")
+        asyncio.run(_run_console_loop())
\ No newline at end of file
@@ -0,0 +1,402 @@
+import asyncio
+from enum import StrEnum
+import hashlib
+import json
+from math import ceil
+import random
+import re
+from time import perf_counter
+from typing import Any, Callable
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.pydantic_v1 import Field as FieldV1, PrivateAttr
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from openai.types.audio import Transcription
+from pydantic import BaseModel, computed_field
+
+
+# Offline stand-ins for the OpenAI models used by the pipelines, for benchmarking them without live API calls.
+# Responses are replayed from a recording, or synthesized from the requested output schema.
+# Latencies and failures are sampled from a seeded random generator per request, so a run does not depend on the task scheduling order.
+
+
+class InjectedFailureError(Exception):
+    pass
+
+
+class LatencyDistribution(StrEnum):
+    Constant = "constant"
+    Uniform = "uniform"
+    LogNormal = "lognormal"
+    Recorded = "recorded" # Replay the latency of the recorded response. Constant for synthesized responses.
+
+class LatencyModel(BaseModel):
+    distribution: LatencyDistribution = LatencyDistribution.LogNormal
+    median_seconds: float = 1.0
+    spread: float = 0.5 # Uniform: +/- ratio of the median. LogNormal: sigma.
+    seconds_per_completion_token: float = 0
+
+    def sample(self, rng: random.Random, completion_tokens: int = 0, recorded_seconds: float | None = None) -> float:
+        if self.distribution == LatencyDistribution.Recorded and recorded_seconds is not None:
+            return recorded_seconds
+        elif self.distribution == LatencyDistribution.Uniform:
+            base = rng.uniform(self.median_seconds * (1 - self.spread), self.median_seconds * (1 + self.spread))
+        elif self.distribution == LatencyDistribution.LogNormal:
+            base = rng.lognormvariate(0, self.spread) * self.median_seconds
+        else:
+            base = self.median_seconds
+        return max(0, base) + self.seconds_per_completion_token * completion_tokens
+
+
+class FailureInjection(BaseModel):
+    error_rate: float = 0 # Requests failing with InjectedFailureError, like API errors.
+    malformed_rate: float = 0 # Responses which cannot be parsed.
+    drop_line_rate: float = 0 # Per-line output elements which are left out. For transcriptions, words which are misheard.
+
+
+class FakeClientStats(BaseModel):
+    calls: int = 0
+    replayed: int = 0
+    synthesized: int = 0
+    injected_errors: int = 0
+    malformed: int = 0
+    dropped_elements: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    simulated_latency_seconds: float = 0
+
+    @computed_field
+    @property
+    def cached_token_ratio(self) -> float:
+        return self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens > 0 else 0
+
+
+class RecordedChatResponse(BaseModel):
+    content: str = ""
+    tool_calls: list[dict] = [] # {"name": ..., "args": ...}
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_seconds: float | None = None
+
+class ChatResponseRecording(BaseModel):
+    # Responses by request key. Repeated requests (e.g., retries) replay the recorded responses in order.
+    responses: dict[str, list[RecordedChatResponse]] = {}
+
+    @staticmethod
+    def make_key(messages: list[BaseMessage], tools: list[dict] | None) -> str:
+        tool_names = [tool["function"]["name"] for tool in tools] if tools is not None else []
+        data = json.dumps([tool_names, [(m.type, m.content) for m in messages]])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, key: str, index: int) -> RecordedChatResponse | None:
+        responses = self.responses.get(key)
+        return responses[index % len(responses)] if responses is not None and len(responses) > 0 else None
+
+    def add(self, key: str, response: RecordedChatResponse):
+        self.responses.setdefault(key, []).append(response)
+
+    @classmethod
+    def load(cls, file_path: str) -> "ChatResponseRecording":
+        with open(file_path, 'r') as f:
+            return cls.model_validate_json(f.read())
+
+    def save(self, file_path: str):
+        with open(file_path, 'w') as f:
+            f.write(self.model_dump_json(indent=2))
+
+
+def estimate_tokens(text: str) -> int:
+    return ceil(len(text) / 4)
+
+
+class PromptPrefixCache:
+    # Mimics the provider's prompt caching: a request reuses the longest prefix of an earlier completed request, in steps of
+    # 128 tokens once it is at least 1024 tokens long. Requests sent at the same time do not see each other's prefixes.
+
+    def __init__(self, min_tokens: int = 1024, step_tokens: int = 128, chars_per_token: int = 4):
+        self.min_chars = min_tokens * chars_per_token
+        self.step_chars = step_tokens * chars_per_token
+        self.chars_per_token = chars_per_token
+        self._prefixes: set[str] = set()
+
+    @staticmethod
+    def serialize(messages: list[BaseMessage], tools: list[dict] | None) -> str:
+        # Tools come before the messages in the prompt.
+        return json.dumps(tools or []) + "".join([f"<{m.type}>{m.content}" for m in messages])
+
+    def _hash(self, prompt: str, length: int) -> str:
+        return hashlib.sha1(prompt[:length].encode()).hexdigest()
+
+    def lookup(self, prompt: str) -> int:
+        length = (len(prompt) // self.step_chars) * self.step_chars
+        while length >= self.min_chars:
+            if self._hash(prompt, length) in self._prefixes:
+                return ceil(length / self.chars_per_token)
+            length -= self.step_chars
+        return 0
+
+    def store(self, prompt: str):
+        for length in range(ceil(self.min_chars / self.step_chars) * self.step_chars, len(prompt) + 1, self.step_chars):
+            self._prefixes.add(self._hash(prompt, length))
+
+
+def extract_line_ids(messages: list[BaseMessage]) -> list[str] | None:
+    # Line-level pipelines send the lyric lines with index ids as a JSON input.
+    try:
+        data = json.loads(messages[-1].content)
+        return [str(line["id"]) for line in data["lyrics"]]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def synthesize_from_schema(schema: dict, root: dict, line_ids: list[str] | None, rng: random.Random, drop_line_rate: float = 0, stats: FakeClientStats | None = None) -> Any:
+    # Make a minimal object which satisfies the JSON schema. Arrays of per-line elements get an element for each input line.
+    if "$ref" in schema:
+        definitions = root.get("$defs") or root.get("definitions") or {}
+        return synthesize_from_schema(definitions[schema["$ref"].split("/")[-1]], root, line_ids, rng, drop_line_rate, stats)
+    elif "allOf" in schema:
+        return synthesize_from_schema(schema["allOf"][0], root, line_ids, rng, drop_line_rate, stats)
+    elif "anyOf" in schema:
+        options = [s for s in schema["anyOf"] if s.get("type") != "null"]
+        return synthesize_from_schema(options[0], root, line_ids, rng, drop_line_rate, stats) if len(options) > 0 else None
+    elif "enum" in schema:
+        return schema["enum"][0]
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {key: synthesize_from_schema(prop, root, line_ids, rng, drop_line_rate, stats) for key, prop in schema.get("properties", {}).items()}
+    elif schema_type == "array":
+        item_schema = schema.get("items", {})
+        if "$ref" in item_schema:
+            definitions = root.get("$defs") or root.get("definitions") or {}
+            item_schema = definitions[item_schema["$ref"].split("/")[-1]]
+
+        if line_ids is not None and "line_id" in item_schema.get("properties", {}):
+            elements = []
+            for line_id in line_ids:
+                if rng.random() < drop_line_rate:
+                    if stats is not None:
+                        stats.dropped_elements += 1
+                    continue
+                element = synthesize_from_schema(item_schema, root, None, rng, drop_line_rate, stats)
+                element["line_id"] = line_id
+                elements.append(element)
+            return elements
+        else:
+            return [synthesize_from_schema(item_schema, root, line_ids, rng, drop_line_rate, stats)]
+    elif schema_type == "string":
+        return "synthetic"
+    elif schema_type == "integer" or schema_type == "number":
+        return 0
+    elif schema_type == "boolean":
+        return False
+    else:
+        return None
+
+
+ChatResponder = Callable[[list[BaseMessage], list[dict] | None], RecordedChatResponse | None]
+
+class FakeChatModel(BaseChatModel):
+    # A chat model which replays recorded responses, or synthesizes them when there is no recording for a request.
+    # Supports tool calling, so the ChainMapper structured output mode can be benchmarked as well.
+
+    recording: ChatResponseRecording | None = None
+    # Produces a response for requests which are not in the recording. Synthesized from the tool schema if None or if it returns None.
+    responder: ChatResponder | None = None
+    synthesize_missing: bool = True
+    latency: LatencyModel = FieldV1(default_factory=LatencyModel)
+    failures: FailureInjection = FieldV1(default_factory=FailureInjection)
+    seed: int = 0
+    stats: FakeClientStats = FieldV1(default_factory=FakeClientStats)
+    # Reports cached prompt tokens like the provider, for benchmarking the prompt layout. None disables it.
+    prompt_cache_min_tokens: int | None = 1024
+
+    _call_counts: dict[str, int] = PrivateAttr(default_factory=dict)
+    _prompt_cache: PromptPrefixCache | None = PrivateAttr(default=None)
+
+    def _get_prompt_cache(self) -> PromptPrefixCache | None:
+        if self._prompt_cache is None and self.prompt_cache_min_tokens is not None:
+            self._prompt_cache = PromptPrefixCache(min_tokens=self.prompt_cache_min_tokens)
+        return self._prompt_cache
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-recorded-chat-model"
+
+    def bind_tools(self, tools: list, tool_choice: Any = None, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
+
+    def _make_response(self, key: str, index: int, messages: list[BaseMessage], tools: list[dict] | None, rng: random.Random) -> RecordedChatResponse:
+        response = self.recording.get(key, index) if self.recording is not None else None
+        if response is not None:
+            self.stats.replayed += 1
+            return response
+
+        response = self.responder(messages, tools) if self.responder is not None else None
+        if response is None:
+            if not self.synthesize_missing:
+                raise KeyError(f"No recorded response for the request {key}.")
+
+            if tools is not None and len(tools) > 0:
+                function = tools[0]["function"]
+                args = synthesize_from_schema(function["parameters"], function["parameters"], extract_line_ids(messages), rng,
+                                              self.failures.drop_line_rate, self.stats)
+                response = RecordedChatResponse(tool_calls=[{"name": function["name"], "args": args}])
+            else:
+                response = RecordedChatResponse(content="This is a synthesized response.")
+
+        self.stats.synthesized += 1
+        return response
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        tools: list[dict] | None = kwargs.get("tools")
+        key = ChatResponseRecording.make_key(messages, tools)
+        index = self._call_counts.get(key, 0)
+        self._call_counts[key] = index + 1
+        rng = random.Random(f"{self.seed}:{key}:{index}")
+        self.stats.calls += 1
+
+        if rng.random() < self.failures.error_rate:
+            self.stats.injected_errors += 1
+            await asyncio.sleep(self.latency.sample(rng))
+            raise InjectedFailureError("Injected chat model failure.")
+
+        response = self._make_response(key, index, messages, tools, rng)
+        tool_calls = [{"id": f"call_{i}", "name": call["name"], "args": call["args"]} for i, call in enumerate(response.tool_calls)]
+        content = response.content
+        if rng.random() < self.failures.malformed_rate:
+            # A truncated completion without a function call.
+            self.stats.malformed += 1
+            content = json.dumps(response.tool_calls[0]["args"] if len(response.tool_calls) > 0 else response.content)[:20]
+            tool_calls = []
+
+        prompt_tokens = response.prompt_tokens or estimate_tokens("".join([str(m.content) for m in messages]))
+        completion_tokens = response.completion_tokens or estimate_tokens(content + json.dumps(response.tool_calls))
+        prompt_cache = self._get_prompt_cache()
+        prompt = PromptPrefixCache.serialize(messages, tools) if prompt_cache is not None else None
+        cached_tokens = min(prompt_tokens, prompt_cache.lookup(prompt)) if prompt_cache is not None else 0
+        self.stats.prompt_tokens += prompt_tokens
+        self.stats.cached_prompt_tokens += cached_tokens
+        self.stats.completion_tokens += completion_tokens
+
+        latency = self.latency.sample(rng, completion_tokens, response.latency_seconds)
+        self.stats.simulated_latency_seconds += latency
+        await asyncio.sleep(latency)
+        if prompt_cache is not None:
+            prompt_cache.store(prompt)
+
+        message = AIMessage(content=content, tool_calls=tool_calls,
+                            additional_kwargs={"tool_calls": [{"id": call["id"], "type": "function",
+                                                               "function": {"name": call["name"], "arguments": json.dumps(call["args"])}}
+                                                              for call in tool_calls]} if len(tool_calls) > 0 else {},
+                            usage_metadata={"input_tokens": prompt_tokens, "output_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens})
+        return ChatResult(generations=[ChatGeneration(message=message)],
+                          llm_output={"token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                                      "prompt_tokens_details": {"cached_tokens": cached_tokens}}})
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: CallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        return asyncio.run(self._agenerate(messages, stop, None, **kwargs))
+
+
+class RecordingChatModel(BaseChatModel):
+    # Wraps a real chat model and records its responses, to be replayed later by FakeChatModel.
+
+    model: BaseChatModel
+    recording: ChatResponseRecording = FieldV1(default_factory=ChatResponseRecording)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording-chat-model"
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        # Let the wrapped model format the tool arguments for its API.
+        return self.bind(**self.model.bind_tools(tools, **kwargs).kwargs)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        ts = perf_counter()
+        result = await self.model._agenerate(messages, stop, None, **kwargs)
+        te = perf_counter()
+
+        message: AIMessage = result.generations[0].message
+        token_usage = (result.llm_output or {}).get("token_usage") or {}
+        self.recording.add(ChatResponseRecording.make_key(messages, kwargs.get("tools")),
+                           RecordedChatResponse(content=message.content,
+                                                tool_calls=[{"name": call["name"], "args": call["args"]} for call in message.tool_calls],
+                                                prompt_tokens=token_usage.get("prompt_tokens", 0),
+                                                completion_tokens=token_usage.get("completion_tokens", 0),
+                                                latency_seconds=te - ts))
+        return result
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: CallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        return asyncio.run(self._agenerate(messages, stop, None, **kwargs))
+
+
+class FakeTranscriptions:
+
+    def __init__(self, client: "FakeWhisperClient") -> None:
+        self.client = client
+
+    async def create(self, model: str, file: Any, response_format: str = "json", timestamp_granularities: list[str] | None = None,
+                     language: str | None = None, prompt: str | None = None, **kwargs) -> Transcription:
+        return await self.client.transcribe(prompt)
+
+
+class FakeAudio:
+
+    def __init__(self, client: "FakeWhisperClient") -> None:
+        self.transcriptions = FakeTranscriptions(client)
+
+
+class FakeWhisperClient:
+    # Mimics `openai.AsyncClient().audio.transcriptions.create` for word-level lyric synchronization.
+    # The transcription repeats the lyric given in the prompt, with words evenly spaced in time.
+
+    def __init__(self, latency: LatencyModel | None = None, failures: FailureInjection | None = None,
+                 seconds_per_word: float = 0.4, seed: int = 0) -> None:
+        self.latency = latency or LatencyModel(median_seconds=0.5)
+        self.failures = failures or FailureInjection()
+        self.seconds_per_word = seconds_per_word
+        self.seed = seed
+        self.stats = FakeClientStats()
+        self.audio = FakeAudio(self)
+
+        self._call_counts: dict[str, int] = {}
+
+    async def transcribe(self, prompt: str | None) -> Transcription:
+        match = re.search(r"\"(.*)\"", prompt or "", re.DOTALL)
+        lyric = match.group(1) if match is not None else "synthetic transcription"
+
+        index = self._call_counts.get(lyric, 0)
+        self._call_counts[lyric] = index + 1
+        rng = random.Random(f"{self.seed}:{lyric}:{index}")
+        self.stats.calls += 1
+        self.stats.synthesized += 1
+
+        latency = self.latency.sample(rng)
+        self.stats.simulated_latency_seconds += latency
+        await asyncio.sleep(latency)
+
+        if rng.random() < self.failures.error_rate:
+            self.stats.injected_errors += 1
+            raise InjectedFailureError("Injected transcription failure.")
+
+        words = lyric.split()
+        for i in range(len(words)):
+            if rng.random() < self.failures.drop_line_rate:
+                # A misheard word lowers the similarity to the lyric, so the synchronizer requests the transcription again.
+                self.stats.dropped_elements += 1
+                words[i] = "la"
+
+        return Transcription(text=" ".join(words),
+                             words=[{"word": word, "start": i * self.seconds_per_word, "end": (i + 1) * self.seconds_per_word}
+                                    for i, word in enumerate(words)])
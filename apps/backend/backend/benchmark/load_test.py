@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+from enum import StrEnum
+from os import path
+import random
+import tempfile
+from time import perf_counter
+
+import httpx
+import numpy as np
+from pydantic import BaseModel, computed_field
+from pydub import AudioSegment
+from sqlmodel import select
+
+from backend.config import ElmiConfig
+from backend.database.engine import db_sessionmaker
+from backend.database.models import InteractionType, Song
+from backend.tasks.chat.chatbot import use_chat_model
+from backend.tasks.chat.memory import chat_memory
+from backend.tasks.preprocessing import use_chat_model as use_preprocessing_chat_model
+from backend.utils.time import get_timestamp
+from .fakes import FakeChatModel, FakeClientStats, LatencyDistribution, LatencyModel
+from .synthetic import SyntheticProjectInfo, make_synthetic_lyric, seed_synthetic_workspace, use_benchmark_data_dir, use_benchmark_database
+
+
+# Load test of the FastAPI app, driven in-process through an ASGI client against a synthetic database.
+# Chat responses come from the offline chat model, so the numbers reflect the server rather than the OpenAI API.
+
+
+class LoadTestEndpoint(StrEnum):
+    Login = "login"
+    ProjectDetail = "project_detail"
+    TranslationUpsert = "translation_upsert"
+    TranslationBulkUpdate = "translation_bulk_update"
+    LogInsert = "log_insert"
+    Chat = "chat"
+    MediaTrim = "media_trim"
+
+
+class EndpointLoadResult(BaseModel):
+    endpoint: LoadTestEndpoint
+    concurrency: int
+    requests: int
+    errors: int
+    status_counts: dict[str, int]
+    elapsed_seconds: float
+    latency_mean_ms: float
+    latency_p50_ms: float
+    latency_p95_ms: float
+    latency_p99_ms: float
+    latency_max_ms: float
+
+    @computed_field
+    @property
+    def throughput_rps(self) -> float:
+        return self.requests / self.elapsed_seconds if self.elapsed_seconds > 0 else 0
+
+class LoadTestReport(BaseModel):
+    started_timestamp: int
+    seed: int
+    users: int
+    songs: int
+    projects: int
+    chat_model_stats: FakeClientStats
+    results: list[EndpointLoadResult]
+
+
+API_PREFIX = "/api/v1/app"
+
+async def send_request(client: httpx.AsyncClient, endpoint: LoadTestEndpoint, project: SyntheticProjectInfo, token: str, rng: random.Random) -> httpx.Response:
+    headers = {"Authorization": f"Bearer {token}"}
+    project_path = f"{API_PREFIX}/projects/{project.project_id}"
+    if endpoint == LoadTestEndpoint.Login:
+        return await client.post(f"{API_PREFIX}/auth/login", json={"code": project.passcode})
+    elif endpoint == LoadTestEndpoint.ProjectDetail:
+        return await client.get(project_path, headers=headers)
+    elif endpoint == LoadTestEndpoint.TranslationUpsert:
+        return await client.put(f"{project_path}/lines/{rng.choice(project.line_ids)}/translation", headers=headers,
+                                json={"gloss": make_synthetic_lyric(rng).upper()})
+    elif endpoint == LoadTestEndpoint.TranslationBulkUpdate:
+        # A paste over several lines.
+        line_ids = rng.sample(project.line_ids, min(8, len(project.line_ids)))
+        return await client.patch(f"{project_path}/translations", headers=headers,
+                                  json={"translations": [{"line_id": line_id, "gloss": make_synthetic_lyric(rng).upper()} for line_id in line_ids]})
+    elif endpoint == LoadTestEndpoint.LogInsert:
+        return await client.post(f"{project_path}/logs/insert", headers=headers,
+                                 json={"type": InteractionType.SelectLine, "metadata": {"line_id": rng.choice(project.line_ids)},
+                                       "timestamp": get_timestamp(), "timezone": "UTC"})
+    elif endpoint == LoadTestEndpoint.Chat:
+        return await client.post(f"{project_path}/chat/threads/{rng.choice(project.thread_ids)}/messages/new", headers=headers,
+                                 json={"message": "What does this line mean?"})
+    elif endpoint == LoadTestEndpoint.MediaTrim:
+        # Trims follow line boundaries as in the app, so repeated ranges can be served from the trimmed media cache.
+        line_index = rng.randrange(len(project.line_ids))
+        return await client.get(f"{API_PREFIX}/media/songs/{project.song_id}/audio", headers=headers,
+                                params={"start_millis": line_index * 3000, "end_millis": (line_index + 1) * 3000})
+
+
+async def run_endpoint_load(client: httpx.AsyncClient, endpoint: LoadTestEndpoint, projects: list[SyntheticProjectInfo], tokens: dict[str, str],
+                            concurrency: int, request_count: int, seed: int) -> EndpointLoadResult:
+    if endpoint == LoadTestEndpoint.Chat:
+        projects = [p for p in projects if len(p.thread_ids) > 0]
+
+    rng = random.Random(f"{seed}:{endpoint}:{concurrency}")
+    latencies: list[float] = []
+    status_counts: dict[str, int] = {}
+    remaining = {"count": request_count}
+
+    async def worker():
+        while remaining["count"] > 0:
+            remaining["count"] -= 1
+            project = rng.choice(projects)
+            ts = perf_counter()
+            try:
+                response = await send_request(client, endpoint, project, tokens[project.user_id], rng)
+                status = str(response.status_code)
+            except Exception as ex:
+                status = type(ex).__name__
+            latencies.append(perf_counter() - ts)
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    ts = perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    te = perf_counter()
+
+    latencies_ms = np.array(latencies) * 1000
+    errors = sum([count for status, count in status_counts.items() if not status.startswith("2")])
+    return EndpointLoadResult(endpoint=endpoint, concurrency=concurrency, requests=len(latencies), errors=errors, status_counts=status_counts,
+                              elapsed_seconds=te-ts,
+                              latency_mean_ms=float(np.mean(latencies_ms)),
+                              latency_p50_ms=float(np.percentile(latencies_ms, 50)),
+                              latency_p95_ms=float(np.percentile(latencies_ms, 95)),
+                              latency_p99_ms=float(np.percentile(latencies_ms, 99)),
+                              latency_max_ms=float(np.max(latencies_ms)))
+
+
+async def prepare_song_audio(duration_millis: int):
+    # A silent track for each synthetic song, for the media trim endpoint.
+    async with db_sessionmaker() as db:
+        songs = (await db.exec(select(Song))).all()
+        for song in songs:
+            song.audio_filename = "synthetic.mp3"
+            AudioSegment.silent(duration=duration_millis).export(path.join(ElmiConfig.get_song_dir(song.id), song.audio_filename), format="mp3")
+            db.add(song)
+        await db.commit()
+
+
+async def run_load_test(args: argparse.Namespace) -> LoadTestReport:
+    work_dir = tempfile.mkdtemp(prefix="elmi-load-test-")
+    use_benchmark_data_dir(work_dir)
+    await use_benchmark_database(path.join(work_dir, "database.db"))
+
+    print(f"[Load test] Seed {args.users} users with {args.projects_per_user} projects each over {args.songs} songs in {work_dir}...")
+    async with db_sessionmaker() as db:
+        projects = await seed_synthetic_workspace(db, args.users, args.songs, args.projects_per_user, args.verses, args.lines_per_verse,
+                                                  logs_per_project=args.logs_per_project, seed=args.seed)
+    if LoadTestEndpoint.MediaTrim in args.endpoints:
+        await prepare_song_audio(args.verses * args.lines_per_verse * 3000)
+
+    chat_model = FakeChatModel(latency=LatencyModel(distribution=args.chat_latency, median_seconds=args.chat_latency_median), seed=args.seed)
+    use_chat_model(chat_model)
+    # Saved translations prefetch alt glosses through the preprocessing chains.
+    use_preprocessing_chat_model(chat_model)
+
+    # Imported here, as the app module reads the frontend path and the routers on import.
+    from backend.server import app
+
+    started_timestamp = get_timestamp()
+    results: list[EndpointLoadResult] = []
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load-test", timeout=None) as client:
+            tokens: dict[str, str] = {}
+            for project in projects:
+                if project.user_id not in tokens:
+                    response = await client.post(f"{API_PREFIX}/auth/login", json={"code": project.passcode})
+                    tokens[project.user_id] = response.json()["jwt"]
+
+            for concurrency in args.concurrency:
+                for endpoint in args.endpoints:
+                    result = await run_endpoint_load(client, endpoint, projects, tokens, concurrency, args.requests, args.seed)
+                    results.append(result)
+                    print(f"[Load test] {endpoint} x{concurrency}: {result.throughput_rps:.1f} req/s, p50 {result.latency_p50_ms:.1f} ms, "
+                          f"p95 {result.latency_p95_ms:.1f} ms, p99 {result.latency_p99_ms:.1f} ms, {result.errors} errors")
+    finally:
+        # Summaries of the chat threads are updated in the background.
+        await chat_memory.drain()
+        use_chat_model(None)
+        use_preprocessing_chat_model(None)
+
+    return LoadTestReport(started_timestamp=started_timestamp, seed=args.seed, users=args.users, songs=args.songs, projects=len(projects),
+                          chat_model_stats=chat_model.stats, results=results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the app endpoints against a synthetic database.")
+    parser.add_argument("--endpoints", type=LoadTestEndpoint, nargs="+", choices=list(LoadTestEndpoint), default=list(LoadTestEndpoint))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64], help="Numbers of concurrent clients.")
+    parser.add_argument("--requests", type=int, default=500, help="Number of requests per endpoint and concurrency level.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--songs", type=int, default=10)
+    parser.add_argument("--projects-per-user", type=int, default=2)
+    parser.add_argument("--verses", type=int, default=4)
+    parser.add_argument("--lines-per-verse", type=int, default=6)
+    parser.add_argument("--logs-per-project", type=int, default=50)
+    parser.add_argument("--chat-latency", type=LatencyDistribution, choices=list(LatencyDistribution), default=LatencyDistribution.LogNormal)
+    parser.add_argument("--chat-latency-median", type=float, default=1.0, help="Median latency of the offline chat model in seconds.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=None, help="Path to write the JSON load test report.")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(args))
+    print(report.model_dump_json(indent=2))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            f.write(report.model_dump_json(indent=2))
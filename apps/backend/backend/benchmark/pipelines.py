@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+from os import path
+import random
+import tempfile
+from time import perf_counter
+
+from pydantic import BaseModel, computed_field
+from pydub import AudioSegment
+from sqlmodel import select
+
+from backend.database.engine import db_sessionmaker
+from backend.database.models import Song
+from backend.tasks.media_preparation.common import LyricsPackage
+from backend.tasks.media_preparation.lyric_synchronizer import LyricSynchronizer
+from backend.tasks.preprocessing import use_chat_model
+from backend.tasks.preprocessing.batch_preprocessing import ProjectPreprocessingStatus, preprocess_projects
+from backend.utils.lyric_data_types import SyncedText
+from backend.utils.time import get_timestamp
+from .fakes import (ChatResponseRecording, FailureInjection, FakeChatModel, FakeClientStats, FakeWhisperClient, LatencyDistribution, LatencyModel,
+                    RecordedChatResponse)
+from .synthetic import LINE_DURATION_MILLIS, seed_synthetic_projects, seed_synthetic_songs, use_benchmark_database
+
+
+# End-to-end throughput of preprocessing and ingestion with offline model stand-ins.
+# Each run uses a fresh synthetic database, so the benchmarks never touch the service database.
+
+
+class PipelineBenchmarkResult(BaseModel):
+    pipeline: str
+    parallel_items: int # Projects or songs processed at once.
+    concurrency: int
+    lines: int
+    succeeded: int
+    failed: int
+    elapsed_seconds: float
+    chat_model_stats: FakeClientStats
+    transcription_stats: FakeClientStats | None = None
+
+    @computed_field
+    @property
+    def items_per_second(self) -> float:
+        return self.succeeded / self.elapsed_seconds if self.elapsed_seconds > 0 else 0
+
+    @computed_field
+    @property
+    def lines_per_second(self) -> float:
+        return self.lines / self.elapsed_seconds if self.elapsed_seconds > 0 else 0
+
+class PipelineBenchmarkReport(BaseModel):
+    started_timestamp: int
+    seed: int
+    latency: LatencyModel
+    failures: FailureInjection
+    results: list[PipelineBenchmarkResult]
+
+
+async def benchmark_preprocessing(project_count: int, concurrency: int, chat_model: FakeChatModel,
+                                  song_count: int, verse_count: int, lines_per_verse: int, seed: int) -> PipelineBenchmarkResult:
+    await use_benchmark_database(path.join(tempfile.mkdtemp(prefix="elmi-benchmark-"), "database.db"))
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, min(song_count, project_count), verse_count, lines_per_verse, seed)
+        await seed_synthetic_projects(db, songs, project_count, distinct_settings=True)
+
+    use_chat_model(chat_model)
+    try:
+        report = await preprocess_projects(concurrency=concurrency, force=True)
+    finally:
+        use_chat_model(None)
+
+    return PipelineBenchmarkResult(pipeline="preprocessing", parallel_items=project_count, concurrency=concurrency,
+                                   lines=report.count(ProjectPreprocessingStatus.Processed) * verse_count * lines_per_verse,
+                                   succeeded=report.count(ProjectPreprocessingStatus.Processed),
+                                   failed=report.count(ProjectPreprocessingStatus.Failed),
+                                   elapsed_seconds=report.elapsed_seconds,
+                                   chat_model_stats=chat_model.stats)
+
+
+def make_synthetic_subtitles(song: Song, rng: random.Random, merge_rate: float = 0.2) -> list[SyncedText]:
+    # YouTube subtitles are lowercase without punctuation and sometimes merge consecutive lines.
+    subtitles: list[SyncedText] = []
+    for line in [line for verse in song.verses for line in verse.lines]:
+        text = line.lyric.lower()
+        if len(subtitles) > 0 and rng.random() < merge_rate:
+            subtitles[-1].text += " " + text
+            subtitles[-1].end = line.end_millis / 1000
+        else:
+            subtitles.append(SyncedText(text=text, start=line.start_millis / 1000, end=line.end_millis / 1000))
+    return subtitles
+
+
+def respond_best_match(messages, tools) -> RecordedChatResponse | None:
+    # The line matcher falls back to the LLM for ambiguous subtitles, and expects a JSON index.
+    return RecordedChatResponse(content='{"index": 0}') if tools is None else None
+
+
+async def benchmark_ingestion(song_count: int, chat_model: FakeChatModel, whisper_client: FakeWhisperClient,
+                              verse_count: int, lines_per_verse: int, seed: int) -> PipelineBenchmarkResult:
+    # The synchronization stages of the ingestion. Downloads are left out as they depend on the network, not on the pipeline.
+    work_dir = tempfile.mkdtemp(prefix="elmi-benchmark-")
+    await use_benchmark_database(path.join(work_dir, "database.db"))
+    async with db_sessionmaker() as db:
+        await seed_synthetic_songs(db, song_count, verse_count, lines_per_verse, seed)
+        songs = (await db.exec(select(Song))).all()
+
+    synchronizer = LyricSynchronizer(openai_client=whisper_client, chat_model=chat_model)
+    audio_path = path.join(work_dir, "silence.mp3")
+    AudioSegment.silent(duration=verse_count * lines_per_verse * LINE_DURATION_MILLIS).export(audio_path, format="mp3")
+    rng = random.Random(seed)
+
+    async def sync_song(song: Song) -> bool:
+        lyrics = LyricsPackage.from_list_str(song.get_lyrics().split("\n"))
+        try:
+            line_synced_lyrics = await synchronizer.apply_line_level_timestamps(lyrics, make_synthetic_subtitles(song, rng), song.duration_seconds)
+            word_synced_lyrics = await synchronizer.apply_word_level_timestamps(line_synced_lyrics, audio_path)
+            synchronizer.split_multiline_lyrics(lyrics, word_synced_lyrics)
+            return True
+        except Exception as ex:
+            print(f"Synchronization failed for {song.title} - {type(ex).__name__}: {ex}")
+            return False
+
+    ts = perf_counter()
+    results = await asyncio.gather(*[sync_song(song) for song in songs])
+    te = perf_counter()
+
+    return PipelineBenchmarkResult(pipeline="ingestion", parallel_items=song_count, concurrency=song_count,
+                                   lines=len([r for r in results if r]) * verse_count * lines_per_verse,
+                                   succeeded=len([r for r in results if r]), failed=len([r for r in results if not r]),
+                                   elapsed_seconds=te-ts,
+                                   chat_model_stats=chat_model.stats, transcription_stats=whisper_client.stats)
+
+
+async def run_benchmarks(args: argparse.Namespace) -> PipelineBenchmarkReport:
+    latency = LatencyModel(distribution=args.latency, median_seconds=args.latency_median, spread=args.latency_spread,
+                           seconds_per_completion_token=args.latency_per_token)
+    failures = FailureInjection(error_rate=args.error_rate, malformed_rate=args.malformed_rate, drop_line_rate=args.drop_line_rate)
+    recording = ChatResponseRecording.load(args.recording) if args.recording is not None else None
+
+    started_timestamp = get_timestamp()
+    results: list[PipelineBenchmarkResult] = []
+    for n in args.parallel:
+        if "preprocessing" in args.pipelines:
+            chat_model = FakeChatModel(recording=recording, latency=latency, failures=failures, seed=args.seed)
+            result = await benchmark_preprocessing(n, args.concurrency, chat_model, args.songs, args.verses, args.lines_per_verse, args.seed)
+            results.append(result)
+            print(f"[Benchmark] Preprocessing x{n}: {result.items_per_second:.3f} projects/s, {result.lines_per_second:.2f} lines/s, "
+                  f"{result.chat_model_stats.cached_token_ratio:.0%} of prompt tokens cached ({result.failed} failed)")
+
+        if "ingestion" in args.pipelines:
+            chat_model = FakeChatModel(responder=respond_best_match, latency=latency, failures=failures, seed=args.seed)
+            whisper_client = FakeWhisperClient(latency=latency, failures=failures, seed=args.seed)
+            result = await benchmark_ingestion(n, chat_model, whisper_client, args.verses, args.lines_per_verse, args.seed)
+            results.append(result)
+            print(f"[Benchmark] Ingestion x{n}: {result.items_per_second:.3f} songs/s, {result.lines_per_second:.2f} lines/s ({result.failed} failed)")
+
+    return PipelineBenchmarkReport(started_timestamp=started_timestamp, seed=args.seed, latency=latency, failures=failures, results=results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing and ingestion throughput with offline model stand-ins.")
+    parser.add_argument("--pipelines", nargs="+", choices=["preprocessing", "ingestion"], default=["preprocessing", "ingestion"])
+    parser.add_argument("--parallel", type=int, nargs="+", default=[1, 4, 16], help="Numbers of projects (or songs) processed at once.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Preprocessing line batch concurrency.")
+    parser.add_argument("--songs", type=int, default=4, help="Number of songs the preprocessed projects are spread over.")
+    parser.add_argument("--verses", type=int, default=4)
+    parser.add_argument("--lines-per-verse", type=int, default=6)
+    parser.add_argument("--latency", type=LatencyDistribution, choices=list(LatencyDistribution), default=LatencyDistribution.LogNormal)
+    parser.add_argument("--latency-median", type=float, default=1.0, help="Median latency of a model call in seconds.")
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--latency-per-token", type=float, default=0, help="Additional latency per completion token in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0)
+    parser.add_argument("--drop-line-rate", type=float, default=0)
+    parser.add_argument("--recording", default=None, help="Chat response recording to replay. Missing responses are synthesized.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=None, help="Path to write the JSON benchmark report.")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmarks(args))
+    print(report.model_dump_json(indent=2))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            f.write(report.model_dump_json(indent=2))
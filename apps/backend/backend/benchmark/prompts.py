@@ -0,0 +1,105 @@
+import argparse
+import json
+from time import perf_counter
+from typing import Callable
+
+from langchain_core.prompts.chat import ChatPromptTemplate
+from langchain_core.prompts.string import jinja2_formatter
+from pydantic import BaseModel, computed_field
+
+from backend.database.crud.chat import ChatLineAnnotation, ChatLineInspection
+from backend.database.models import GlossDescription, TranslationChallengeType
+from backend.tasks.chat.prompts import (EMOTING_TEMPLATE, EMOTING_WITH_TRANSLATION_TEMPLATE, GLOSSING_TEMPLATE, GLOSSING_WITH_TRANSLATION_TEMPLATE,
+                                        MEANING_TEMPLATE, OTHER_TEMPLATE, TIMING_TEMPLATE, TIMING_WITH_TRANSLATION_TEMPLATE)
+from backend.tasks import preprocessing
+from backend.utils.prompt_templates import prompt_templates
+
+
+# Per-turn prompt construction time, comparing the templates compiled once in the registry with parsing them on every call as before.
+# Runs offline; no model is called.
+
+
+class PromptBenchmarkResult(BaseModel):
+    prompt: str
+    iterations: int
+    before_seconds: float
+    after_seconds: float
+
+    @computed_field
+    @property
+    def before_micros_per_call(self) -> float:
+        return self.before_seconds / self.iterations * 1e6
+
+    @computed_field
+    @property
+    def after_micros_per_call(self) -> float:
+        return self.after_seconds / self.iterations * 1e6
+
+    @computed_field
+    @property
+    def speedup(self) -> float:
+        return self.before_seconds / self.after_seconds if self.after_seconds > 0 else 0
+
+
+def measure(func: Callable[[], object], iterations: int) -> float:
+    func()
+    ts = perf_counter()
+    for _ in range(iterations):
+        func()
+    return perf_counter() - ts
+
+
+def benchmark_chat_prompts(iterations: int) -> list[PromptBenchmarkResult]:
+    inspection = ChatLineInspection(challenges=[TranslationChallengeType.Poetic], description="The line plays on the double meaning of the stars.")
+    annotation = ChatLineAnnotation(gloss="STARS TONIGHT ME", gloss_description="Point up, then to yourself.", mood=["dreamy"],
+                                    facial_expression="Raised eyebrows", body_gesture="Sway", emotion_description="Hopeful",
+                                    gloss_alts=[GlossDescription(gloss="ME STARS", description="A shorter version.")])
+    variables = dict(title="Stars", artist="Synthetic", lyric_line="Cause I, I, I'm in the stars tonight", user_name="Alex", sign_language="ASL")
+
+    cases = [
+        (MEANING_TEMPLATE, dict(line_inspection_results=inspection.model_dump_json())),
+        (GLOSSING_TEMPLATE, dict(line_glossing_results=annotation.model_dump_json(include={"gloss", "gloss_description"}))),
+        (GLOSSING_WITH_TRANSLATION_TEMPLATE, dict(line_translation_results="ME STARS TONIGHT")),
+        (EMOTING_TEMPLATE, dict(line_emoting_results=annotation.model_dump_json(include={"mood", "facial_expression", "body_gesture", "emotion_description"}))),
+        (EMOTING_WITH_TRANSLATION_TEMPLATE, dict(user_translation="ME STARS TONIGHT")),
+        (TIMING_TEMPLATE, dict(line_timing_results=annotation.model_dump_json(include={"gloss_alts"}))),
+        (TIMING_WITH_TRANSLATION_TEMPLATE, dict(user_translation="ME STARS TONIGHT")),
+        (OTHER_TEMPLATE, dict()),
+    ]
+
+    results: list[PromptBenchmarkResult] = []
+    for name, extra in cases:
+        source = prompt_templates.get_source(name)
+        before = measure(lambda: jinja2_formatter(template=source, **variables, **extra), iterations)
+        after = measure(lambda: prompt_templates.render(name, **variables, **extra), iterations)
+        results.append(PromptBenchmarkResult(prompt=name, iterations=iterations, before_seconds=before, after_seconds=after))
+
+    return results
+
+
+def benchmark_pipeline_prompts(iterations: int) -> list[PromptBenchmarkResult]:
+    input = {"input": '{"song_title": "Stars", "lyrics": [{"id": "1", "lyric": "Cause I, I, I\'m in the stars tonight"}]}'}
+    results: list[PromptBenchmarkResult] = []
+    for pipeline in [preprocessing.inspector, preprocessing.gloss_generator, preprocessing.performance_guide_generator, preprocessing.gloss_options_generator]:
+        before_prompt = ChatPromptTemplate.from_messages([("system", pipeline.system_instruction), ("human", "{input}")])
+        after_prompt = pipeline.prompt
+        before = measure(lambda: before_prompt.invoke(input), iterations)
+        after = measure(lambda: after_prompt.invoke(input), iterations)
+        results.append(PromptBenchmarkResult(prompt=pipeline.stats.name, iterations=iterations, before_seconds=before, after_seconds=after))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-turn prompt construction of the chatbot and the preprocessing chains.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--report", default=None, help="Path to write the JSON benchmark report.")
+    args = parser.parse_args()
+
+    results = benchmark_chat_prompts(args.iterations) + benchmark_pipeline_prompts(args.iterations)
+
+    for result in results:
+        print(f"[Benchmark] {result.prompt}: {result.before_micros_per_call:.1f} -> {result.after_micros_per_call:.1f} us/call (x{result.speedup:.1f})")
+    report = [result.model_dump() for result in results]
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
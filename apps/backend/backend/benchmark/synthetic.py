@@ -0,0 +1,168 @@
+from itertools import product
+from os import path
+import random
+
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.config import ElmiConfig
+from backend.database.engine import create_database_engine, create_db_and_tables, db_sessionmaker
+from backend.database.models import (AgeGroup, BodyLanguage, ClassifierLevel, EmotionalLevel, InteractionLog, InteractionType, LanguageProficiency, Line,
+                                     LineAnnotation, LineInspection, LineTranslation, MainAudience, MessageRole, Project, ProjectConfiguration,
+                                     SignLanguageType, SigningSpeed, Song, Thread, ThreadMessage, TranslationChallengeType, User, Verse)
+from backend.tasks.preprocessing.gloss_index import line_gloss_index
+
+
+# Synthetic songs, users and projects for benchmarks, stored in a separate SQLite database.
+
+VOCABULARY = ["light", "city", "dance", "night", "shine", "heart", "fire", "sky", "dream", "run", "hold", "feel", "baby", "tonight",
+              "gold", "rain", "stars", "home", "wild", "free", "sing", "open", "road", "higher", "slow", "funk", "soul", "morning"]
+
+VERSE_TITLES = ["Verse", "Pre-Chorus", "Chorus", "Bridge"]
+
+LINE_DURATION_MILLIS = 3000
+
+
+async def use_benchmark_database(db_path: str) -> AsyncEngine:
+    # Sessions from the shared session maker, including those opened by the tasks, use the benchmark database from now on.
+    engine = create_database_engine(db_path)
+    await create_db_and_tables(engine)
+    db_sessionmaker.configure(bind=engine)
+    # The gloss index mirrors the accepted glosses of the database.
+    line_gloss_index.clear()
+    return engine
+
+
+def use_benchmark_data_dir(dir_path: str):
+    # Song media and caches of synthetic songs are kept out of the service data directory.
+    ElmiConfig.DIR_DATA = dir_path
+    ElmiConfig.DIR_SONGS = path.join(dir_path, "songs")
+    ElmiConfig.DIR_INGESTION_CHECKPOINTS = path.join(ElmiConfig.DIR_SONGS, "_ingestion")
+    ElmiConfig.DIR_GLOSS_INDEX = path.join(dir_path, "caches", "gloss_index")
+
+
+def make_synthetic_lyric(rng: random.Random) -> str:
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(4, 9))]
+    return " ".join(words).capitalize()
+
+
+def make_synthetic_song(index: int, verse_count: int, lines_per_verse: int, rng: random.Random) -> tuple[Song, list[Verse], list[Line]]:
+    song = Song(title=f"Synthetic Song {index + 1}", artist="Benchmark", description="A synthetic song for benchmarks.",
+                duration_seconds=verse_count * lines_per_verse * LINE_DURATION_MILLIS // 1000,
+                reference_video_id=f"synthetic-{index}")
+
+    verses: list[Verse] = []
+    lines: list[Line] = []
+    for verse_i in range(verse_count):
+        verse_start_millis = verse_i * lines_per_verse * LINE_DURATION_MILLIS
+        verse = Verse(song_id=song.id, title=f"{VERSE_TITLES[verse_i % len(VERSE_TITLES)]} {verse_i // len(VERSE_TITLES) + 1}", verse_ordering=verse_i,
+                      start_millis=verse_start_millis, end_millis=verse_start_millis + lines_per_verse * LINE_DURATION_MILLIS)
+        verses.append(verse)
+        for line_i in range(lines_per_verse):
+            lyric = make_synthetic_lyric(rng)
+            start_millis = verse_start_millis + line_i * LINE_DURATION_MILLIS
+            lines.append(Line(song_id=song.id, verse_id=verse.id, line_number=line_i, lyric=lyric, tokens=lyric.split(" "),
+                              start_millis=start_millis, end_millis=start_millis + LINE_DURATION_MILLIS))
+
+    return song, verses, lines
+
+
+def make_distinct_settings(count: int) -> list[ProjectConfiguration]:
+    combinations = product(MainAudience, SignLanguageType, LanguageProficiency, AgeGroup, SigningSpeed, EmotionalLevel, BodyLanguage, ClassifierLevel)
+    settings: list[ProjectConfiguration] = []
+    for main_audience, main_language, language_proficiency, age_group, signing_speed, emotional_level, body_language, classifier_level in combinations:
+        if len(settings) >= count:
+            break
+        settings.append(ProjectConfiguration(main_audience=main_audience, main_language=main_language, language_proficiency=language_proficiency,
+                                             age_group=age_group, signing_speed=signing_speed, emotional_level=emotional_level,
+                                             body_language=body_language, classifier_level=classifier_level))
+    return settings
+
+
+async def seed_synthetic_songs(db: AsyncSession, song_count: int, verse_count: int = 4, lines_per_verse: int = 6, seed: int = 0) -> list[Song]:
+    rng = random.Random(seed)
+    songs: list[Song] = []
+    for i in range(song_count):
+        song, verses, lines = make_synthetic_song(i, verse_count, lines_per_verse, rng)
+        db.add(song)
+        db.add_all(verses)
+        db.add_all(lines)
+        songs.append(song)
+    await db.commit()
+    return songs
+
+
+async def seed_synthetic_projects(db: AsyncSession, songs: list[Song], project_count: int, distinct_settings: bool = True) -> list[Project]:
+    # Projects are spread over the songs, one user each.
+    # With distinct settings, no two projects share an analysis, so every project costs a full preprocessing run.
+    settings = make_distinct_settings(project_count) if distinct_settings else [ProjectConfiguration()] * project_count
+    projects: list[Project] = []
+    for i in range(project_count):
+        user = User(alias=f"bench-{i + 1}", callable_name=f"Benchmark User {i + 1}", sign_language=SignLanguageType.ASL)
+        project = Project(user_id=user.id, song_id=songs[i % len(songs)].id, user_settings=settings[i % len(settings)].model_dump())
+        db.add(user)
+        db.add(project)
+        projects.append(project)
+    await db.commit()
+    return projects
+
+
+class SyntheticProjectInfo(BaseModel):
+    project_id: str
+    user_id: str
+    passcode: str
+    song_id: str
+    line_ids: list[str]
+    thread_ids: list[str]
+
+
+async def seed_synthetic_workspace(db: AsyncSession, user_count: int, song_count: int, projects_per_user: int = 2,
+                                   verse_count: int = 4, lines_per_verse: int = 6,
+                                   translation_ratio: float = 0.5, thread_ratio: float = 0.2, messages_per_thread: int = 4,
+                                   logs_per_project: int = 50, seed: int = 0) -> list[SyntheticProjectInfo]:
+    # A database shaped like a deployed study: preprocessed projects with translations, chat threads and interaction logs.
+    rng = random.Random(seed)
+    songs = await seed_synthetic_songs(db, song_count, verse_count, lines_per_verse, seed)
+    lines_by_song: dict[str, list[Line]] = {song.id: [] for song in songs}
+    for line in (await db.exec(select(Line))).all():
+        lines_by_song[line.song_id].append(line)
+
+    infos: list[SyntheticProjectInfo] = []
+    for user_i in range(user_count):
+        # Random passcodes may collide among many users.
+        user = User(alias=f"load-{user_i + 1}", callable_name=f"Load User {user_i + 1}", sign_language=SignLanguageType.ASL, passcode=str(100000 + user_i))
+        db.add(user)
+        for song in rng.sample(songs, min(projects_per_user, len(songs))):
+            project = Project(user_id=user.id, song_id=song.id, last_processing_id="synthetic")
+            db.add(project)
+
+            lines = lines_by_song[song.id]
+            for line in lines:
+                db.add(LineInspection(line_id=line.id, project_id=project.id, processing_id="synthetic",
+                                      challenges=[rng.choice(list(TranslationChallengeType))], description="A synthetic inspection."))
+                db.add(LineAnnotation(line_id=line.id, project_id=project.id, processing_id="synthetic",
+                                      gloss=line.lyric.upper(), gloss_description="A synthetic gloss.",
+                                      mood=["joyful"], facial_expression="Smile", body_gesture="Sway", emotion_description="Synthetic emotion."))
+                if rng.random() < translation_ratio:
+                    db.add(LineTranslation(line_id=line.id, project_id=project.id, gloss=line.lyric.upper()))
+
+            thread_ids: list[str] = []
+            for line in lines:
+                if rng.random() < thread_ratio:
+                    thread = Thread(project_id=project.id, line_id=line.id)
+                    db.add(thread)
+                    thread_ids.append(thread.id)
+                    for message_i in range(messages_per_thread):
+                        role = MessageRole.Assistant if message_i % 2 == 0 else MessageRole.User
+                        db.add(ThreadMessage(thread_id=thread.id, project_id=project.id, role=role, message=make_synthetic_lyric(rng)))
+
+            db.add_all([InteractionLog(user_id=user.id, project_id=project.id, type=rng.choice([InteractionType.PlaySong, InteractionType.SelectLine, InteractionType.EnterGloss]),
+                                       metadata_json={"line_id": rng.choice(lines).id}) for _ in range(logs_per_project)])
+
+            infos.append(SyntheticProjectInfo(project_id=project.id, user_id=user.id, passcode=user.passcode, song_id=song.id,
+                                              line_ids=[line.id for line in lines], thread_ids=thread_ids))
+        await db.commit()
+
+    return infos
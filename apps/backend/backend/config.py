@@ -4,6 +4,9 @@ from os import getcwd, path, makedirs
 class ElmiConfig:
     DIR_DATA = path.join(getcwd(), "../../data")
     DIR_SONGS = path.join(DIR_DATA, "songs")
+    DIR_INGESTION_CHECKPOINTS = path.join(DIR_SONGS, "_ingestion")
+    DIR_HTTP_CACHE = path.join(DIR_DATA, "caches", "http")
+    DIR_GLOSS_INDEX = path.join(DIR_DATA, "caches", "gloss_index")
     
     @classmethod
     def get_song_dir(cls, song_id: str)->str:
@@ -22,4 +25,10 @@ class ElmiConfig:
     
     @classmethod
     def get_song_cover_filepath(cls, song_id: str) -> str:
-        return path.join(cls.get_song_dir(song_id), "cover.jpg")
\ No newline at end of file
+        return path.join(cls.get_song_dir(song_id), "cover.jpg")
+    
+    @classmethod
+    def get_ingestion_checkpoint_filepath(cls, key: str) -> str:
+        if not path.exists(cls.DIR_INGESTION_CHECKPOINTS):
+            makedirs(cls.DIR_INGESTION_CHECKPOINTS)
+        return path.join(cls.DIR_INGESTION_CHECKPOINTS, f"{key}.json")
\ No newline at end of file
@@ -1,5 +1,7 @@
+from pydantic import BaseModel
+from sqlmodel import and_, select
 from sqlmodel.ext.asyncio.session import AsyncSession
-from backend.database.models import Thread, ThreadMessage
+from backend.database.models import GlossDescription, Line, LineAnnotation, LineInspection, LineTranslation, Project, ProjectConfiguration, Song, Thread, ThreadMessage, TranslationChallengeType, User
 # Save a message to the ThreadMessage table.
 
 async def save_thread_message(session: AsyncSession, project_id: str, thread_id: str, role, message, mode):
@@ -19,3 +21,68 @@ async def create_thread(session: AsyncSession, project_id: str, line_id: str):
     session.add(new_thread)
     await session.commit()
     return new_thread.id
+
+
+class ChatLineInspection(BaseModel):
+    challenges: list[TranslationChallengeType]
+    description: str
+
+class ChatLineAnnotation(BaseModel):
+    gloss: str
+    gloss_description: str | None
+    mood: list[str]
+    facial_expression: str
+    body_gesture: str
+    emotion_description: str
+    gloss_alts: list[GlossDescription]
+
+class LineChatContext(BaseModel):
+    # Everything the chat system prompts read about a line of a project.
+    project_id: str
+    line_id: str
+    song_title: str
+    song_artist: str
+    lyric: str
+    user_name: str
+    sign_language: str
+    inspection: ChatLineInspection | None
+    annotation: ChatLineAnnotation | None
+    user_translation: str | None
+
+# Fetch the chat context of a line in one query, instead of loading the rows and walking their relationships one by one.
+async def fetch_line_chat_context(db: AsyncSession, project_id: str, line_id: str) -> LineChatContext | None:
+    query = (select(Song.title, Song.artist, Line.lyric, User.alias, User.callable_name, User.sign_language, Project.user_settings,
+                    LineInspection.id, LineInspection.challenges, LineInspection.description,
+                    LineAnnotation.id, LineAnnotation.gloss, LineAnnotation.gloss_description, LineAnnotation.mood, LineAnnotation.facial_expression,
+                    LineAnnotation.body_gesture, LineAnnotation.emotion_description, LineAnnotation.gloss_alts,
+                    LineTranslation.gloss)
+             .select_from(Project)
+             .join(Song, Song.id == Project.song_id)
+             .join(User, User.id == Project.user_id)
+             .join(Line, and_(Line.id == line_id, Line.song_id == Project.song_id))
+             .outerjoin(LineInspection, and_(LineInspection.project_id == Project.id, LineInspection.line_id == Line.id,
+                                             LineInspection.processing_id == Project.last_processing_id))
+             .outerjoin(LineAnnotation, and_(LineAnnotation.project_id == Project.id, LineAnnotation.line_id == Line.id,
+                                             LineAnnotation.processing_id == Project.last_processing_id))
+             .outerjoin(LineTranslation, and_(LineTranslation.project_id == Project.id, LineTranslation.line_id == Line.id))
+             .where(Project.id == project_id)
+             .limit(1))
+
+    row = (await db.exec(query)).first()
+    if row is None:
+        return None
+
+    (title, artist, lyric, alias, callable_name, user_sign_language, user_settings,
+     inspection_id, challenges, inspection_description,
+     annotation_id, gloss, gloss_description, mood, facial_expression, body_gesture, emotion_description, gloss_alts,
+     user_translation) = row
+
+    settings = ProjectConfiguration.model_validate(user_settings) if isinstance(user_settings, dict) else user_settings
+    return LineChatContext(project_id=project_id, line_id=line_id, song_title=title, song_artist=artist, lyric=lyric,
+                           user_name=callable_name or alias,
+                           sign_language=settings.main_language or user_sign_language,
+                           inspection=ChatLineInspection(challenges=challenges, description=inspection_description) if inspection_id is not None else None,
+                           annotation=ChatLineAnnotation(gloss=gloss, gloss_description=gloss_description, mood=mood, facial_expression=facial_expression,
+                                                         body_gesture=body_gesture, emotion_description=emotion_description, gloss_alts=gloss_alts)
+                                      if annotation_id is not None else None,
+                           user_translation=user_translation)
@@ -1,18 +1,23 @@
 from pydantic import BaseModel
 from datetime import datetime
-from sqlmodel import select
+from sqlmodel import func, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from backend.database.models import InteractionLog, InteractionType, Line, LineAnnotation, LineInfo, LineInspection, LineTranslation, LineTranslationInfo, Project, SongInfo, User, VerseInfo
 
+# Preprocessing keeps earlier versions of inspections and annotations, so these read the ones of the last processing.
+
 async def fetch_line_inspections_by_project(db: AsyncSession, project_id: str, user_id: str | None)->list[LineInspection]:
     return (await db.exec(select(LineInspection).join(Line, Line.id == LineInspection.line_id)
-                          .join(Project, Project.id == LineAnnotation.project_id)
+                          .join(Project, Project.id == LineInspection.project_id)
                           .where(Project.user_id == user_id if user_id is not None else True)
+                          .where(LineInspection.processing_id == Project.last_processing_id)
                           .where(LineInspection.project_id == project_id).order_by(Line.start_millis))).all()
 
 async def fetch_line_inspection_by_line(db: AsyncSession, project_id: str, line_id: str) -> LineInspection:
     return (await db.exec(select(LineInspection)
+                          .join(Project, Project.id == LineInspection.project_id)
+                          .where(LineInspection.processing_id == Project.last_processing_id)
                           .where(LineInspection.line_id == line_id)
                           .where(LineInspection.project_id == project_id))).first()
 
@@ -21,6 +26,7 @@ async def fetch_line_annotations_by_project(db: AsyncSession, project_id: str, u
                           .join(Line, Line.id == LineAnnotation.line_id)
                           .join(Project, Project.id == LineAnnotation.project_id)
                           .where(Project.user_id == user_id if user_id is not None else True)
+                          .where(LineAnnotation.processing_id == Project.last_processing_id)
                           .where(LineAnnotation.project_id == project_id).order_by(Line.start_millis))).all()
 
 
@@ -34,8 +40,10 @@ async def fetch_line_translations_by_project(db: AsyncSession, project_id: str,
 
 async def fetch_line_annotation_by_line(db: AsyncSession, project_id: str, line_id: str) -> LineAnnotation | None:
     return (await db.exec(select(LineAnnotation)
+                          .join(Project, Project.id == LineAnnotation.project_id)
+                          .where(LineAnnotation.processing_id == Project.last_processing_id)
                           .where(LineAnnotation.line_id == line_id)
-                          .where(LineInspection.project_id == project_id))).first()
+                          .where(LineAnnotation.project_id == project_id))).first()
 
 
 async def fetch_line_translation_by_line(db: AsyncSession, project_id: str, line_id: str) -> LineTranslation | None:
@@ -43,7 +51,40 @@ async def fetch_line_translation_by_line(db: AsyncSession, project_id: str, line
                           .where(LineTranslation.line_id == line_id)
                           .where(LineTranslation.project_id == project_id))).first()
 
+async def fetch_line_translations_by_lines(db: AsyncSession, project_id: str, line_ids: list[str]) -> list[LineTranslation]:
+    # Rows may have been loaded in the session before a commit, so their server-side timestamps are refreshed as well.
+    return (await db.exec(select(LineTranslation)
+                          .where(LineTranslation.line_id.in_(line_ids))
+                          .where(LineTranslation.project_id == project_id)
+                          .execution_options(populate_existing=True))).all()
+
 async def store_interaction_log(db: AsyncSession, user_id: str, project_id: str, type: InteractionType, metadata: dict | None = None, timestamp: int | None = None, timezone: str | None = None):
     orm = InteractionLog(type=type, metadata_json=metadata, timestamp=timestamp, local_timezone=timezone, user_id=user_id, project_id=project_id)
     print(orm)
-    db.add(orm)
\ No newline at end of file
+    db.add(orm)
+
+async def store_interaction_logs(db: AsyncSession, user_id: str, project_id: str, type: InteractionType, metadata_list: list[dict | None], timestamp: int | None = None, timezone: str | None = None):
+    db.add_all([InteractionLog(type=type, metadata_json=metadata, timestamp=timestamp, local_timezone=timezone, user_id=user_id, project_id=project_id)
+                for metadata in metadata_list])
+
+
+class AcceptedLineGloss(BaseModel):
+    project_id: str
+    line_id: str
+    lyric: str
+    gloss: str
+    user_settings: dict | None = None
+
+def _select_accepted_line_glosses():
+    # Translations saved with a gloss, with the lyric of their line and the settings of their project.
+    return (select(LineTranslation.project_id, LineTranslation.line_id, Line.lyric, LineTranslation.gloss, Project.user_settings)
+            .join(Line, Line.id == LineTranslation.line_id)
+            .join(Project, Project.id == LineTranslation.project_id)
+            .where(LineTranslation.gloss != None, func.trim(LineTranslation.gloss) != ""))
+
+async def fetch_accepted_line_glosses(db: AsyncSession) -> list[AcceptedLineGloss]:
+    return [AcceptedLineGloss(project_id=project_id, line_id=line_id, lyric=lyric, gloss=gloss, user_settings=user_settings)
+            for project_id, line_id, lyric, gloss, user_settings in (await db.exec(_select_accepted_line_glosses())).all()]
+
+async def count_accepted_line_glosses(db: AsyncSession) -> int:
+    return (await db.exec(select(func.count()).select_from(_select_accepted_line_glosses().subquery()))).one()
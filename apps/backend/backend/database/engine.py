@@ -2,6 +2,7 @@ import json
 from os import getcwd, path
 
 from .models import *
+from sqlalchemy import Connection
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import sessionmaker
@@ -18,9 +19,24 @@ def create_database_engine(db_path: str, verbose: bool = False) -> AsyncEngine:
 def make_async_session_maker(engine: AsyncEngine) -> sessionmaker[AsyncSession]:
     return sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+# Columns added to tables of existing databases, as (table, column, definition). create_all only creates missing tables, so these are added when missing.
+ADDED_COLUMNS: list[tuple[str, str, str]] = [
+    ("thread", "summary", "VARCHAR"),
+    ("thread", "summarized_message_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("pipelinetracespan", "cached_prompt_tokens", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+def add_missing_columns(conn: Connection):
+    for table, column, definition in ADDED_COLUMNS:
+        columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()]
+        if column not in columns:
+            print(f"Add column {column} to table {table}.")
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 async def create_db_and_tables(engine: AsyncEngine):
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
 
 
 engine = create_database_engine(path.join(getcwd(), "../../database/database.db"), verbose=False)
@@ -3,7 +3,7 @@ from enum import StrEnum, auto
 from itertools import groupby
 import json
 from os import path
-from typing import Literal, Optional, Union
+from typing import ClassVar, Literal, Optional, Union
 from backend.utils.time import get_timestamp
 from pydantic import BaseModel, ConfigDict, computed_field, field_validator
 from sqlalchemy import DateTime, func
@@ -172,6 +172,17 @@ class ClassifierLevel(StrEnum):
     Rich=auto()
 
 
+# Inspection of challenging lines depends only on these settings, so it can be shared across users.
+class InspectionSettings(BaseModel):
+      model_config = ConfigDict(use_enum_values=True)
+
+      main_audience: MainAudience = Field(default=MainAudience.Deaf)
+      main_language: SignLanguageType = SignLanguageType.ASL
+      language_proficiency: LanguageProficiency = LanguageProficiency.Moderate
+
+      def make_hash(self)->str:
+          return json.dumps(self.model_dump(), sort_keys=True)
+
 class ProjectConfiguration(BaseModel):
       model_config = ConfigDict(use_enum_values=True)
 
@@ -184,9 +195,14 @@ class ProjectConfiguration(BaseModel):
       body_language: BodyLanguage = BodyLanguage.Moderate
       classifier_level: ClassifierLevel = ClassifierLevel.Moderate
 
+      INSPECTION_FIELDS: ClassVar[set[str]] = set(InspectionSettings.model_fields.keys())
+
       def make_hash(self)->str:
           return json.dumps(self.model_dump(), sort_keys=True)
 
+      def to_inspection_settings(self)->InspectionSettings:
+          return InspectionSettings.model_validate(self.model_dump(include=self.INSPECTION_FIELDS))
+
 class Project(SQLModel, IdTimestampMixin, UserIdMixin, SongIdMixin, table=True):
 
     last_accessed_at: Optional[datetime] = Field(
@@ -222,13 +238,25 @@ class Project(SQLModel, IdTimestampMixin, UserIdMixin, SongIdMixin, table=True):
     
     @property
     def latest_annotations(self) -> list["LineAnnotation"]:
+        # Reprocessing keeps the earlier versions of annotations; the current ones carry the last processing id.
+        current = [a for a in self.annotations if a.processing_id == self.last_processing_id]
+        if len(current) > 0:
+            return current
+
         result = []
-        for k, ann_itr in groupby(self.annotations, lambda a: a.line_id):
+        for k, ann_itr in groupby(sorted(self.annotations, key=lambda a: a.line_id), lambda a: a.line_id):
             annotations = list(ann_itr)
             annotations.sort(key=lambda a: a.created_at, reverse=True)
             result.append(annotations[0])
         return result
 
+    @property
+    def latest_inspections(self) -> list["LineInspection"]:
+        # A processing may find no challenging lines, so only rows from before the processing versions fall back to every inspection.
+        if self.last_processing_id is None or not any(a.processing_id == self.last_processing_id for a in self.annotations):
+            return self.inspections
+        return [i for i in self.inspections if i.processing_id == self.last_processing_id]
+
 class ProjectIdMixin(BaseModel):
     project_id: str = Field(foreign_key=f"{Project.__tablename__}.id")
 
@@ -248,7 +276,7 @@ class TrimmedMedia(SQLModel, IdTimestampMixin, SongIdMixin, table=True):
     song: Song = Relationship(back_populates='trimmed_media', sa_relationship_kwargs={'lazy': 'selectin'}) 
 
     def get_trimmed_file_path(self)->str:
-        return path.join(ElmiConfig.get_song_cache_dir(self.id), self.trimmed_filename)
+        return path.join(ElmiConfig.get_song_cache_dir(self.song_id), self.trimmed_filename)
     
     def trimmed_file_exists(self)->bool:
         return path.exists(self.get_trimmed_file_path())
@@ -317,12 +345,25 @@ class CachedAltGlossGenerationResult(SQLModel, AltGlossesInfo, table=True):
 
     user_settings_hash: str = Field(nullable=False)
 
+# Stores inspection of a whole song, shared by all projects of the song with the same inspection settings.
+class CachedSongInspectionResult(SQLModel, IdTimestampMixin, SongIdMixin, table=True):
+    __table_args__ = (UniqueConstraint("song_id", "lyrics_hash", "settings_hash", name="song_lyrics_settings_idx"), )
+
+    lyrics_hash: str = Field(nullable=False)
+    settings_hash: str = Field(nullable=False)
+    inspections: list[dict] = Field(sa_column=Column(JSON), default=[])
+
 # New models for Chat :)
 class Thread(SQLModel, IdTimestampMixin, ProjectIdMixin, LineIdMixin, table=True):
-    messages: list["ThreadMessage"] = Relationship(back_populates="thread", sa_relationship_kwargs={'lazy': 'selectin'},  cascade_delete=True)
+    # In the order they were sent, as the rolling summary covers the first summarized_message_count of them.
+    messages: list["ThreadMessage"] = Relationship(back_populates="thread", sa_relationship_kwargs={'lazy': 'selectin', 'order_by': 'ThreadMessage.created_at'},  cascade_delete=True)
     project: Project = Relationship(back_populates="threads") 
     line: Optional[Line] = Relationship(back_populates="thread", sa_relationship_kwargs={'lazy': 'selectin'})
 
+    # Rolling summary of the oldest messages of the thread, which are no longer replayed to the chat model.
+    summary: Optional[str] = Field(nullable=True, default=None)
+    summarized_message_count: int = Field(default=0)
+
     @computed_field
     @property
     def verse_ordering(self)->int:
@@ -392,6 +433,31 @@ class InteractionType(StrEnum):
     SendChatMessage = "SendChatMessage"
 
 
+class TraceSpanKind(StrEnum):
+    Stage="stage"
+    Chain="chain"
+
+# Records a timed step of a preprocessing run.
+class PipelineTraceSpan(SQLModel, IdTimestampMixin, table=True):
+    processing_id: str = Field(nullable=False, index=True)
+    project_id: Optional[str] = Field(nullable=True, default=None, index=True)
+    parent_id: Optional[str] = Field(nullable=True, default=None)
+
+    kind: TraceSpanKind = Field(nullable=False)
+    name: str = Field(nullable=False)
+    batch_id: Optional[int] = Field(nullable=True, default=None)
+
+    started_timestamp: int = Field(default_factory=get_timestamp, index=True)
+    duration_seconds: float | None = Field(nullable=True, default=None)
+    prompt_tokens: int = Field(default=0)
+    # Prompt tokens served from the provider's prompt prefix cache.
+    cached_prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    retries: int = Field(default=0)
+    error: Optional[str] = Field(nullable=True, default=None)
+    metadata_json: dict | None = Field(sa_column=Column(JSON, name="metadata"), default=None)
+
+
 class InteractionLog(SQLModel, IdTimestampMixin, UserIdMixin, ProjectIdMixin, table=True):
     model_config = ConfigDict(use_enum_values=True)
 
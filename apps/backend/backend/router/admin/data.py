@@ -1,9 +1,11 @@
 
 from typing import Annotated
 from backend.database.engine import with_db_session
-from backend.database.models import InteractionLog, Project, Thread, ThreadMessage, User, SharableUserInfo
+from backend.database.models import InteractionLog, PipelineTraceSpan, Project, Thread, ThreadMessage, User, SharableUserInfo
 from backend.router.admin.common import check_admin_credential
 from backend.router.endpoint_models import ProjectDetails, ProjectInfo, convert_project_to_project_details, convert_project_to_project_info
+from backend.tasks.chain_mapper import ChainMapperStats, get_chain_mapper_stats
+from backend.tasks.preprocessing.batch_preprocessing import BatchPreprocessingReport, create_missing_projects, preprocess_projects
 from fastapi import APIRouter, Depends, HTTPException, status
 from openai import BaseModel
 from sqlmodel import select
@@ -48,4 +50,41 @@ async def get_interaction_logs(user_id: str, project_id: str, db: Annotated[Asyn
     else:
         raise HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST, detail="User ID and project id do not correspond with each other.")
-    
\ No newline at end of file
+    
+
+class BatchPreprocessingArgs(BaseModel):
+    project_ids: list[str] | None = None # All projects if None.
+    create_missing_projects: bool = False # Create a project for every user and song without one.
+    concurrency: int = 8
+    force: bool = False
+
+@router.post("/projects/preprocess", response_model=BatchPreprocessingReport)
+async def preprocess_projects_in_batch(args: BatchPreprocessingArgs):
+    project_ids = args.project_ids
+    if args.create_missing_projects:
+        new_project_ids = await create_missing_projects()
+        if project_ids is not None:
+            project_ids = project_ids + new_project_ids
+    return await preprocess_projects(project_ids, concurrency=args.concurrency, force=args.force)
+
+
+@router.get("/chains/stats", response_model=list[ChainMapperStats])
+async def get_chain_stats():
+    return get_chain_mapper_stats()
+
+
+@router.get("/traces/{processing_id}", response_model=list[PipelineTraceSpan])
+async def get_processing_traces(processing_id: str, db: Annotated[AsyncSession, Depends(with_db_session)]):
+    return (await db.exec(select(PipelineTraceSpan).where(PipelineTraceSpan.processing_id == processing_id)
+                          .order_by(PipelineTraceSpan.started_timestamp))).all()
+
+@router.get("/users/{user_id}/projects/{project_id}/traces", response_model=list[PipelineTraceSpan])
+async def get_project_traces(user_id: str, project_id: str, db: Annotated[AsyncSession, Depends(with_db_session)]):
+    project = await db.get(Project, project_id)
+    if project.user_id == user_id:
+        if project.last_processing_id is None:
+            return []
+        return await get_processing_traces(project.last_processing_id, db)
+    else:
+        raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail="User ID and project id do not correspond with each other.")
@@ -8,6 +8,7 @@ from backend.database.engine import with_db_session
 from backend.database.models import Project, SignLanguageType, User
 from backend.errors import ErrorType
 from backend.router.app.common import get_signed_in_user
+from backend.tasks.chat.chat_context import chat_context_cache
 from backend.utils.env_helper import get_env_variable, EnvironmentVariables
 import jwt
 import pendulum
@@ -73,5 +74,7 @@ async def update_profile(args: ProfileArgs,
     db.add(user)
     await db.commit()
     await db.refresh(user)
+    # The name and language of the user appear in the chat contexts of all their threads.
+    chat_context_cache.clear()
     
     return user
\ No newline at end of file
@@ -1,4 +1,5 @@
-from typing import Annotated, Optional
+import asyncio
+from typing import Annotated, Callable, Optional
 from nanoid import generate
 from pydantic import BaseModel
 from pydub import AudioSegment
@@ -8,10 +9,11 @@ from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from backend.config import ElmiConfig
-from backend.database.engine import with_db_session
+from backend.database.engine import db_sessionmaker, with_db_session
 from backend.database.models import MEDIA_IDENTIFIER_REFERENCE, Line, MediaType, Song, SongWhitelistItem, TrimmedMedia, User
 from backend.errors import ErrorType
 from backend.router.app.common import get_signed_in_user
+from backend.utils.single_flight import SingleFlight
 from os import path
 import numpy as np
 import ffmpeg
@@ -37,6 +39,55 @@ def get_cover_image(song_id: str):
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=ErrorType.ItemNotFound)
     
+# Trims of the same range requested at once, e.g., from several tabs, share one ffmpeg job and one cache entry.
+media_trims: SingleFlight[str] = SingleFlight("media_trim")
+
+def _export_audio_segment(audio_file_path: str, start_millis: int | None, end_millis: int | None, trimmed_file_path: str):
+    if start_millis is not None and end_millis is None:
+        seg: AudioSegment = AudioSegment.from_mp3(audio_file_path)[start_millis:]
+    elif start_millis is None and end_millis is not None:
+        seg: AudioSegment = AudioSegment.from_mp3(audio_file_path)[:end_millis]
+    else:
+        seg: AudioSegment = AudioSegment.from_mp3(audio_file_path)[start_millis:end_millis]
+    seg.export(trimmed_file_path, format="mp3")
+
+def _export_video_segment(video_file_path: str, start_millis: int, end_millis: int, trimmed_file_path: str):
+    probe = ffmpeg.probe(video_file_path)
+    print(probe)
+    video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    fps = int(video_info['r_frame_rate'].split('/')[0])
+    print("Video fps: ", fps)
+    
+    in_file = ffmpeg.input(video_file_path, ss=start_millis/1000, t=(end_millis - start_millis)/1000)
+    out_file = ffmpeg.output(in_file, trimmed_file_path)
+    ffmpeg.run(out_file)
+
+async def _get_or_trim_media(song_id: str, type: MediaType, identifier: str, start_millis: int | None, end_millis: int | None,
+                             trimmed_filename: str, export: Callable[[str], None]) -> str:
+    # Runs on its own session, as it may outlive the request that started it.
+    async with db_sessionmaker() as db:
+        cache_query = select(TrimmedMedia).where(TrimmedMedia.song_id == song_id, 
+                                                 TrimmedMedia.type == type,
+                                                 TrimmedMedia.identifier == identifier,
+                                                 TrimmedMedia.start_millis == start_millis, 
+                                                 TrimmedMedia.end_millis == end_millis).limit(1)
+        cache = (await db.exec(cache_query)).first()
+        if cache is not None and cache.trimmed_file_exists():
+            return cache.get_trimmed_file_path()
+
+        is_new = cache is None
+        if is_new:
+            cache = TrimmedMedia(start_millis=start_millis, end_millis=end_millis, type=type, identifier=identifier,
+                                 song_id=song_id, trimmed_filename=trimmed_filename)
+
+        # Decoding and encoding block, so they run off the event loop. The cache entry is stored once the file exists.
+        await asyncio.to_thread(export, cache.get_trimmed_file_path())
+
+        if is_new:
+            db.add(cache)
+            await db.commit()
+        return cache.get_trimmed_file_path()
+
 @router.get("/songs/{song_id}/audio", dependencies=[Depends(get_signed_in_user)], response_class=FileResponse)
 async def get_audio(song_id: str, 
                     db: Annotated[AsyncSession, Depends(with_db_session)],
@@ -47,39 +98,13 @@ async def get_audio(song_id: str,
         if start_millis is None and end_millis is None:
             return FileResponse(audio_file_path, media_type="audio/mp3")
         else:
-            cache_query = select(TrimmedMedia).where(TrimmedMedia.song_id == song_id, 
-                                                     TrimmedMedia.start_millis == start_millis, 
-                                                     TrimmedMedia.end_millis == end_millis, 
-                                                     TrimmedMedia.song.audio_filename == song.audio_filename).limit(1)
-            caches = await db.exec(cache_query)
-            cache = caches.first()
-            if cache is not None:
-                if cache.trimmed_file_exists():
-                    return FileResponse(cache.get_trimmed_file_path(), media_type="audio/mp3")
-            
-            if start_millis is not None and end_millis is None:
-                seg: AudioSegment = AudioSegment.from_mp3(audio_file_path)[start_millis:]
-            elif start_millis is None and end_millis is not None:
-                seg: AudioSegment = AudioSegment.from_mp3(audio_file_path)[:end_millis]
-            else:
-                seg: AudioSegment = AudioSegment.from_mp3(audio_file_path)[start_millis:end_millis]
-            
-            if cache is None:
-                trimmed_filename = f"{song_id}_{start_millis}_{end_millis}_{generate(size=5)}.mp3"
-                cache = TrimmedMedia(
-                    start_millis=start_millis,
-                    end_millis=end_millis,
-                    type=MediaType.Audio,
-                    song_id=song.id,
-                    trimmed_filename=trimmed_filename
-                )
-                db.add(cache)
-                await db.commit()
-                await db.refresh(cache)
-                
-            seg.export(cache.get_trimmed_file_path(), format="audio/mp3")
+            # Trims are identified by the audio file, so that they are not reused once the song audio is replaced.
+            trimmed_file_path = await media_trims.run((song_id, MediaType.Audio, song.audio_filename, start_millis, end_millis),
+                lambda: _get_or_trim_media(song_id, MediaType.Audio, song.audio_filename, start_millis, end_millis,
+                                           f"{song_id}_{start_millis}_{end_millis}_{generate(size=5)}.mp3",
+                                           lambda trimmed_file_path: _export_audio_segment(audio_file_path, start_millis, end_millis, trimmed_file_path)))
             
-            return FileResponse(cache.get_trimmed_file_path(), media_type="audio/mp3")
+            return FileResponse(trimmed_file_path, media_type="audio/mp3")
 
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=ErrorType.ItemNotFound)
@@ -106,45 +131,13 @@ async def get_video(song_id: str,
         if line is None or line.song_id != song_id:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=ErrorType.ItemNotFound)
         else:
-            cache_query = select(TrimmedMedia).where(TrimmedMedia.song_id == song_id, 
-                                                     TrimmedMedia.type == MediaType.Video,
-                                                     TrimmedMedia.identifier == MEDIA_IDENTIFIER_REFERENCE,
-                                                     TrimmedMedia.start_millis == line.start_millis, 
-                                                     TrimmedMedia.end_millis == line.end_millis).limit(1)
-            caches = await db.exec(cache_query)
-            cache = caches.first()
-            if cache is not None:
-                if cache.trimmed_file_exists():
-                    return FileResponse(cache.get_trimmed_file_path(), media_type="video/mp4")
-            
-            
-            if cache is None:
-                print("Create video cache...")
-                trimmed_filename = f"{song_id}_{MediaType.Video}_{line.start_millis}_{line.end_millis}_{generate(size=5)}.mp4"
-                cache = TrimmedMedia(
-                    start_millis=line.start_millis,
-                    end_millis=line.end_millis,
-                    type=MediaType.Video,
-                    identifier=MEDIA_IDENTIFIER_REFERENCE,
-                    song_id=song.id,
-                    trimmed_filename=trimmed_filename
-                )
-                db.add(cache)
-                await db.commit()
-                await db.refresh(cache)
-
-            probe = ffmpeg.probe(video_file_path)
-            print(probe)
-            video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-            fps = int(video_info['r_frame_rate'].split('/')[0])
-            print("Video fps: ", fps)
-            
-            in_file = ffmpeg.input(video_file_path, ss=line.start_millis/1000, t=(line.end_millis - line.start_millis)/1000)
-            out_file = ffmpeg.output(in_file, cache.get_trimmed_file_path()
-                                     )
-            ffmpeg.run(out_file)
+            start_millis, end_millis = line.start_millis, line.end_millis
+            trimmed_file_path = await media_trims.run((song_id, MediaType.Video, MEDIA_IDENTIFIER_REFERENCE, start_millis, end_millis),
+                lambda: _get_or_trim_media(song_id, MediaType.Video, MEDIA_IDENTIFIER_REFERENCE, start_millis, end_millis,
+                                           f"{song_id}_{MediaType.Video}_{start_millis}_{end_millis}_{generate(size=5)}.mp4",
+                                           lambda trimmed_file_path: _export_video_segment(video_file_path, start_millis, end_millis, trimmed_file_path)))
             
-            return FileResponse(cache.get_trimmed_file_path(), media_type="video/mp4")
+            return FileResponse(trimmed_file_path, media_type="video/mp4")
 
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=ErrorType.ItemNotFound)
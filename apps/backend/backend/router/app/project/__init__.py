@@ -1,7 +1,10 @@
 from typing import Annotated, Optional
 from backend.router.endpoint_models import ProjectInfo, convert_project_to_project_info, ProjectDetails, convert_project_to_project_details
-from backend.tasks.preprocessing import generate_alt_glosses_with_user_translation, generate_line_annotation_with_user_translation, preprocess_song
-from fastapi import APIRouter, status, Depends
+from backend.tasks.preprocessing import generate_alt_glosses_with_user_translation, generate_line_annotation_with_user_translation, preprocess_song, start_reprocess_song
+from backend.tasks.preprocessing.gloss_index import index_accepted_gloss, line_gloss_index, make_gloss_settings_hash
+from backend.tasks.translation_coalescer import translation_coalescer
+from backend.tasks.chat.chat_context import chat_context_cache
+from fastapi import APIRouter, HTTPException, status, Depends
 from pydantic import BaseModel, Field
 from sqlmodel import select, desc
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -9,7 +12,7 @@ from sqlmodel.ext.asyncio.session import AsyncSession
 from backend.database.engine import with_db_session
 from backend.database.models import AltGlossesInfo, InteractionType, Line, LineAnnotation, LineInspection, LineTranslation, LineTranslationInfo, Project, ProjectConfiguration, Song, User
 from backend.router.app.common import get_signed_in_user
-from backend.database.crud.project import fetch_line_annotations_by_project, fetch_line_inspections_by_project, fetch_line_translation_by_line, fetch_line_translations_by_project, store_interaction_log
+from backend.database.crud.project import fetch_line_annotations_by_project, fetch_line_inspections_by_project, fetch_line_translation_by_line, fetch_line_translations_by_lines, fetch_line_translations_by_project, store_interaction_log, store_interaction_logs
 from backend.router.app.project.chat import router as chatRouter
 
 router = APIRouter()
@@ -45,8 +48,8 @@ async def create_project(
                 verses=new_project.song.verses,
                 lines=[line for verse in new_project.song.verses for line in verse.lines],
                 translations=[],
-                annotations=new_project.annotations,
-                inspections=new_project.inspections
+                annotations=new_project.latest_annotations,
+                inspections=new_project.latest_inspections
             )
 
 
@@ -64,6 +67,27 @@ async def get_project_detail(project_id: str, user: Annotated[User, Depends(get_
         return status.HTTP_404_NOT_FOUND
 
 
+@router.put("/{project_id}/settings", response_model=ProjectDetails)
+async def update_project_settings(settings: ProjectConfiguration, project_id: str, user: Annotated[User, Depends(get_signed_in_user)],
+                                  db: Annotated[AsyncSession, Depends(with_db_session)]):
+    project = await db.get(Project, project_id)
+    if project is None or project.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No such project.")
+
+    previous_settings = project.safe_user_settings
+    project.user_settings = settings.model_dump()
+    db.add(project)
+    await db.commit()
+    chat_context_cache.invalidate(project_id)
+    line_gloss_index.update_project_settings(project_id, make_gloss_settings_hash(settings))
+    await line_gloss_index.persist()
+
+    # Only the annotation stages depending on the changed settings run again, in the background.
+    # The returned details hold the current annotations until the new version is stored.
+    start_reprocess_song(project_id, previous_settings)
+    return await convert_project_to_project_details(project, user.id, db)
+
+
 @router.get("/{project_id}/inspections/all", response_model=list[LineInspection])
 async def get_line_inspections(project_id: str, user: Annotated[User, Depends(get_signed_in_user)],
                        db: Annotated[AsyncSession, Depends(with_db_session)]):
@@ -77,11 +101,11 @@ async def get_line_annotations(project_id: str, user: Annotated[User, Depends(ge
 @router.get("/{project_id}/translations/all", response_model=list[LineTranslationInfo])
 async def get_line_translations(project_id: str, user: Annotated[User, Depends(get_signed_in_user)],
                        db: Annotated[AsyncSession, Depends(with_db_session)]):
-    return await fetch_line_translations_by_project(db, project_id, user.id)
+    return translation_coalescer.merge_pending(project_id, await fetch_line_translations_by_project(db, project_id, user.id))
 
 @router.get("/{project_id}/lines/{line_id}/translation", response_model=LineTranslationInfo | None)
 async def get_one_line_translation(project_id: str, line_id: str, db: Annotated[AsyncSession, Depends(with_db_session)]):
-    return await fetch_line_translation_by_line(db, project_id, line_id)
+    return translation_coalescer.get_pending(project_id, line_id) or await fetch_line_translation_by_line(db, project_id, line_id)
 
 class TranslationInfo(BaseModel):
     gloss: Optional[str] = Field(default=None, exclude_default=True)
@@ -99,38 +123,90 @@ async def upsert_line_translation(info: TranslationInfo,
                                   user: Annotated[User, Depends(get_signed_in_user)],
                                   db: Annotated[AsyncSession, Depends(with_db_session)]):
         print(f"Try upserting translation - {user.alias},'{info.gloss}'")
-        translation = await fetch_line_translation_by_line(db, project_id, line_id)
-        
-        if translation is not None:
-            gloss_before = translation.gloss
-            if info.gloss_is_set():
-                translation.gloss = info.gloss if info.gloss is not None and len(info.gloss.strip()) > 0 else None
-            
-            if info.memo_is_set():
-                translation.memo = info.memo if info.memo is not None and len(info.memo.strip()) > 0 else None
-            
-            if gloss_before != info.gloss:
-                await store_interaction_log(db, user.id, project_id, InteractionType.EnterGloss, {
-                    "initial":False,
-                    "translation_id": translation.id,
-                    "before": gloss_before,
-                    "after": info.gloss
-                })                
-        else:
-            translation = LineTranslation(project_id=project_id, line_id=line_id, 
-                                        gloss=info.gloss, memo=info.memo)
-            if translation.gloss != None:
-                await store_interaction_log(db, user.id, project_id, InteractionType.EnterGloss, {
-                    "initial":True,
-                    "translation_id": translation.id,
-                    "before": None,
-                    "after": info.gloss
-                })
-
-        db.add(translation)
-        await db.commit()
-        await db.refresh(translation)
-        return translation
+        # Updates arriving while the user types are merged and written once the burst ends.
+        changes = {}
+        if info.gloss_is_set():
+            changes["gloss"] = info.gloss
+        if info.memo_is_set():
+            changes["memo"] = info.memo
+        return await translation_coalescer.upsert(db, user.id, project_id, line_id, changes)
+
+class LineTranslationUpdate(TranslationInfo):
+    line_id: str
+
+class BulkTranslationUpdateArgs(BaseModel):
+    translations: list[LineTranslationUpdate]
+    timestamp: int | None = None
+    timezone: str | None = None
+
+@router.patch("/{project_id}/translations", response_model=list[LineTranslationInfo])
+async def update_line_translations(args: BulkTranslationUpdateArgs, project_id: str,
+                                   user: Annotated[User, Depends(get_signed_in_user)],
+                                   db: Annotated[AsyncSession, Depends(with_db_session)]):
+    # Imports, undos and pastes in the editor update many lines at once, applied here in a single transaction.
+    project = await db.get(Project, project_id)
+    if project is None or project.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No such project.")
+
+    line_ids = list(dict.fromkeys([update.line_id for update in args.translations]))
+    song_line_ids = set((await db.exec(select(Line.id).where(Line.song_id == project.song_id).where(Line.id.in_(line_ids)))).all())
+    if len(song_line_ids) < len(line_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Some lines do not belong to the song of the project.")
+
+    # Updates still pending from the single-line endpoint are written first, so that this update applies on top of them.
+    await translation_coalescer.flush(project_id)
+
+    translations = {translation.line_id: translation for translation in await fetch_line_translations_by_lines(db, project_id, line_ids)}
+    created_line_ids: set[str] = set()
+    changed_line_ids: set[str] = set()
+    log_metadata_list: list[dict] = []
+    for update in args.translations:
+        translation = translations.get(update.line_id)
+        if translation is None:
+            translation = LineTranslation(project_id=project_id, line_id=update.line_id)
+            translations[update.line_id] = translation
+            created_line_ids.add(update.line_id)
+
+        gloss_before, memo_before = translation.gloss, translation.memo
+        if update.gloss_is_set():
+            translation.gloss = update.gloss if update.gloss is not None and len(update.gloss.strip()) > 0 else None
+        if update.memo_is_set():
+            translation.memo = update.memo if update.memo is not None and len(update.memo.strip()) > 0 else None
+
+        if gloss_before != translation.gloss:
+            log_metadata_list.append({
+                "initial": update.line_id in created_line_ids and gloss_before is None,
+                "translation_id": translation.id,
+                "before": gloss_before,
+                "after": translation.gloss,
+                "bulk": True
+            })
+        if gloss_before != translation.gloss or memo_before != translation.memo:
+            changed_line_ids.add(update.line_id)
+
+    if len(changed_line_ids) == 0:
+        return []
+
+    db.add_all([translations[line_id] for line_id in changed_line_ids])
+    await store_interaction_logs(db, user.id, project_id, InteractionType.EnterGloss, log_metadata_list, args.timestamp, args.timezone)
+    await db.commit()
+    for line_id in changed_line_ids:
+        chat_context_cache.invalidate(project_id, line_id)
+
+    lines = {line.id: line for line in (await db.exec(select(Line).where(Line.id.in_(list(changed_line_ids))))).all()}
+    for line_id in changed_line_ids:
+        await index_accepted_gloss(project_id, lines[line_id], translations[line_id].gloss, project.safe_user_settings)
+
+    # One query instead of refreshing each row for the timestamps set by the database.
+    changed_translations = {translation.line_id: translation for translation in await fetch_line_translations_by_lines(db, project_id, list(changed_line_ids))}
+    return [changed_translations[line_id] for line_id in line_ids if line_id in changed_translations]
+
+@router.get("/{project_id}/lines/{line_id}/annotation/translated", response_model=LineAnnotation | None)
+async def get_line_annotation_with_user_translation(project_id: str, line_id: str,
+                                                    user: Annotated[User, Depends(get_signed_in_user)],
+                                                    db: Annotated[AsyncSession, Depends(with_db_session)]):
+    # Requests for several lines edited in quick succession are annotated in one batch.
+    return await generate_line_annotation_with_user_translation(project_id, db, line_id)
 
 class AltGrossesResult(BaseModel):
     info: AltGlossesInfo | None
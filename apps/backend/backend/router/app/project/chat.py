@@ -3,7 +3,8 @@ from backend.database.crud.project import store_interaction_log
 from backend.database.engine import with_db_session
 from backend.database.models import ChatIntent, InteractionType, MessageRole, Project, Thread, ThreadMessage, User
 from backend.router.app.common import get_project, get_signed_in_user, get_thread
-from backend.tasks.chat.chatbot import generate_chat_response
+from backend.tasks.chat.chatbot import generate_chat_response, schedule_history_summary
+from backend.tasks.chat.intent_fast_path import IntentSource
 from fastapi import APIRouter, HTTPException, status, Depends
 from pydantic import BaseModel, field_validator, model_validator
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -59,7 +60,7 @@ async def start_thread(args: ThreadCreate,
 
     print("Generate initial assistant message...")
 
-    intent, assistant_message = await generate_chat_response(db, thread, None, None)
+    intent, assistant_message, _ = await generate_chat_response(db, thread, None, None)
 
     response_message = ThreadMessage(
             thread_id=thread.id,
@@ -113,7 +114,12 @@ async def send_user_message(args: MessageCreate,
     new_user_message = ThreadMessage(thread_id=thread.id, role=MessageRole.User, message=args.message, project_id=thread.project_id)
     db.add(new_user_message)
     
-    intent, assistant_response = await generate_chat_response(db, thread, args.message, args.intent)
+    intent, assistant_response, intent_source = await generate_chat_response(db, thread, args.message, args.intent)
+
+    # Typed messages keep the intent classified for them, which the local intent classifier learns from.
+    if intent_source in [IntentSource.Local, IntentSource.LLM]:
+        new_user_message.intent = intent
+        new_user_message.message_metadata = {"intent_source": intent_source}
 
     response_message = ThreadMessage(
             thread_id=thread.id,
@@ -132,8 +138,11 @@ async def send_user_message(args: MessageCreate,
         "thread_id": thread.id,
         "message": args.message,
         "intent": intent,
+        "intent_source": intent_source,
         "response": assistant_response 
     })
     await db.commit()
 
+    schedule_history_summary(thread.id)
+
     return UserMessageResponse(user_input=new_user_message, assistant_output=response_message)
\ No newline at end of file
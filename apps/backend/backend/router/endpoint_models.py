@@ -1,5 +1,6 @@
 from datetime import datetime
 from backend.database.crud.project import fetch_line_translations_by_project
+from backend.tasks.translation_coalescer import translation_coalescer
 from backend.database.models import InteractionLog, LineAnnotation, LineInfo, LineInspection, LineTranslationInfo, Project, ProjectConfiguration, SongInfo, Thread, ThreadMessage, VerseInfo
 from pydantic import BaseModel
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -46,9 +47,9 @@ async def convert_project_to_project_details(project: Project, user_id: str, db:
                 song=project.song,
                 verses=project.song.verses,
                 lines=[line for verse in project.song.verses for line in verse.lines],
-                translations=await fetch_line_translations_by_project(db, project.id, user_id),
+                translations=translation_coalescer.merge_pending(project.id, await fetch_line_translations_by_project(db, project.id, user_id)),
                 annotations=project.latest_annotations,
-                inspections=project.inspections,
+                inspections=project.latest_inspections,
                 logs= None if include_logs is False else project.logs,
                 threads=None if include_threads is False else project.threads,
                 messages=None if include_messages is False else project.messages
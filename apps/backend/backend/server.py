@@ -8,10 +8,17 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from backend.database.engine import create_db_and_tables, engine
+from backend.database.engine import create_db_and_tables, db_sessionmaker, engine
 from backend.router.app import router as app_router
 from backend.router.app.project.chat import router as chat_router  # Corrected the import path
 from backend.router.admin import router as admin_router  # Corrected the import path
+from backend.utils.http_client import close_http_client
+from backend.tasks.translation_coalescer import translation_coalescer
+from backend.tasks.chat.intent_fast_path import train_local_intent_classifier
+from backend.tasks.chat.memory import chat_memory
+from backend.tasks.preprocessing import join_reprocessings
+from backend.tasks.preprocessing.gloss_index import line_gloss_index, load_line_gloss_index
+from backend.config import ElmiConfig
 
 from re import compile
 
@@ -20,9 +27,17 @@ async def server_lifespan(app: FastAPI):
     print("Server launched.")
     await create_db_and_tables(engine)
     await create_test_db_entities()
+    async with db_sessionmaker() as db:
+        await train_local_intent_classifier(db)
+        await load_line_gloss_index(db, ElmiConfig.DIR_GLOSS_INDEX)
     yield
 
     # Cleanup logic will come below.
+    await join_reprocessings()
+    await translation_coalescer.flush()
+    await line_gloss_index.save()
+    await chat_memory.drain()
+    await close_http_client()
 
 app = FastAPI(lifespan=server_lifespan)
 
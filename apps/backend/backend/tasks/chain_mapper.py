@@ -1,50 +1,175 @@
 from abc import ABC, abstractmethod
+from enum import StrEnum
 from time import perf_counter
-from typing import Generic, TypeVar
+from typing import Any, Generic, TypeVar
 
-from langchain_core.prompts.chat import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+from langchain_core.prompts.chat import ChatPromptTemplate, SystemMessagePromptTemplate
 from langchain_core.exceptions import OutputParserException
 from langchain_core.runnables.retry import RunnableRetry
 from langchain.output_parsers import PydanticOutputParser
-from langchain_core.runnables import RunnableConfig, Runnable
-from pydantic import BaseModel, ValidationError
+from langchain_core.runnables import RunnableConfig, Runnable, RunnableLambda
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel, ValidationError, computed_field
 from langchain_core.language_models.chat_models import BaseChatModel
 
-from backend.utils.env_helper import EnvironmentVariables, get_env_variable
+from backend.tasks.model_routing import get_route_models
 
 InputType = TypeVar('InputType')
 OutputType = TypeVar('OutputType', bound=BaseModel)
+ElementType = TypeVar('ElementType', bound=BaseModel)
+
+
+class ChainOutputMode(StrEnum):
+    Parser = "parser" # Parse free-form completions with PydanticOutputParser.
+    Structured = "structured" # Use the model's native structured output, falling back to the parser.
+
+
+class ChainMapperStats(BaseModel):
+    name: str
+    output_mode: ChainOutputMode
+    invocations: int = 0
+    attempts: int = 0 # LLM calls including retries.
+    parse_failures: int = 0
+    structured_fallbacks: int = 0 # Structured outputs which had to be parsed from the raw completion.
+    escalated_attempts: int = 0 # LLM calls on the fallback model after the primary model's outputs failed validation.
+    failures: int = 0
+    total_latency_seconds: float = 0
+
+    @computed_field
+    @property
+    def parse_failure_rate(self) -> float:
+        return self.parse_failures / self.attempts if self.attempts > 0 else 0
+
+    @computed_field
+    @property
+    def retry_rate(self) -> float:
+        return (self.attempts - self.invocations) / self.invocations if self.invocations > 0 else 0
+
+    @computed_field
+    @property
+    def mean_latency_seconds(self) -> float:
+        return self.total_latency_seconds / self.invocations if self.invocations > 0 else 0
+
+
+chain_mapper_stats: dict[str, ChainMapperStats] = {}
+
+def get_chain_mapper_stats() -> list[ChainMapperStats]:
+    return list(chain_mapper_stats.values())
+
 
 class ChainMapper(ABC, Generic[InputType, OutputType]):
 
+    DEFAULT_OUTPUT_MODE = ChainOutputMode.Structured
+    PRIMARY_ATTEMPTS_BEFORE_ESCALATION = 2
+
     def __init__(self, name: str, outputModel: type[OutputType],  system_instruction: str,
-                model : BaseChatModel | None = None
+                model : BaseChatModel | None = None,
+                output_mode: ChainOutputMode | None = None,
+                fallback_model: BaseChatModel | None = None
                 ) -> None:
         super().__init__()
 
         self._name = name
+        self._system_instruction = system_instruction
 
-        # Define the prompt template
+        # Define the prompt template. The system instruction has no variables, so it is formatted once here instead of on every call.
+        self._system_message = SystemMessagePromptTemplate.from_template(system_instruction).format()
         chat_prompt = ChatPromptTemplate.from_messages([
-            ("system", system_instruction),
+            self._system_message,
             ("human", "{input}")
         ])
+        self._prompt = chat_prompt
 
-        chat_model = model or ChatOpenAI(api_key=get_env_variable(EnvironmentVariables.OPENAI_API_KEY), 
-                                model_name="gpt-4o", 
-                                temperature=1, 
-                                max_tokens=2048,
-                                model_kwargs=dict(
-                                    frequency_penalty=0, 
-                                    presence_penalty=0)
-                                )
-        
+        if model is None:
+            # Without an explicit model, e.g., an offline stand-in, the models come from the route of the pipeline.
+            model, route_fallback_model = get_route_models(name)
+            fallback_model = fallback_model or route_fallback_model
+
+        self._output_parser = PydanticOutputParser(pydantic_object=outputModel)
+
+        output_mode = output_mode or self.DEFAULT_OUTPUT_MODE
+        llm_call, output_mode = self.__make_llm_call(chat_prompt, model, outputModel, output_mode)
+
+        self._stats = ChainMapperStats(name=name, output_mode=output_mode)
+        chain_mapper_stats[name] = self._stats
 
         # Initialize the chain
-        self._chain = self.__input_parser | RunnableRetry(name="LLM-routin", bound = chat_prompt | chat_model | PydanticOutputParser(pydantic_object=outputModel) | self._postprocess_output,
-                                                         retry_exception_types=(ValidationError, AssertionError, OutputParserException), 
-                                                         max_attempt_number=5, wait_exponential_jitter=True)
+        retry_exception_types = (ValidationError, AssertionError, OutputParserException)
+        llm_routine = RunnableRetry(name="LLM-routin", bound = RunnableLambda(self.__count_attempt, afunc=self.__acount_attempt) | llm_call | self._postprocess_output,
+                                    retry_exception_types=retry_exception_types, 
+                                    max_attempt_number=5 if fallback_model is None else self.PRIMARY_ATTEMPTS_BEFORE_ESCALATION, wait_exponential_jitter=True)
+        if fallback_model is not None:
+            # Outputs which keep failing validation on the primary model are requested from the fallback model.
+            fallback_llm_call, _ = self.__make_llm_call(chat_prompt, fallback_model, outputModel, output_mode)
+            escalated_routine = RunnableRetry(name="LLM-routin-escalated", bound = RunnableLambda(self.__count_escalated_attempt, afunc=self.__acount_escalated_attempt) | fallback_llm_call | self._postprocess_output,
+                                              retry_exception_types=retry_exception_types, 
+                                              max_attempt_number=3, wait_exponential_jitter=True)
+            llm_routine = llm_routine.with_fallbacks([escalated_routine], exceptions_to_handle=retry_exception_types)
+
+        self._base_chain = self.__input_parser | llm_routine
+        self._chain = RunnableLambda(self.__invoke_with_stats, name=name)
+
+    async def __invoke_with_stats(self, input: InputType, config: RunnableConfig) -> OutputType:
+        ts = perf_counter()
+        try:
+            return await self._base_chain.ainvoke(input, config)
+        except:
+            self._stats.failures += 1
+            raise
+        finally:
+            self._stats.invocations += 1
+            self._stats.total_latency_seconds += perf_counter() - ts
+
+    def __count_attempt(self, input: Any) -> Any:
+        self._stats.attempts += 1
+        return input
+
+    async def __acount_attempt(self, input: Any) -> Any:
+        return self.__count_attempt(input)
+
+    def __count_escalated_attempt(self, input: Any) -> Any:
+        self._stats.escalated_attempts += 1
+        return self.__count_attempt(input)
+
+    async def __acount_escalated_attempt(self, input: Any) -> Any:
+        return self.__count_escalated_attempt(input)
+
+    def __make_llm_call(self, chat_prompt: ChatPromptTemplate, chat_model: BaseChatModel, outputModel: type[OutputType], output_mode: ChainOutputMode) -> tuple[Runnable, ChainOutputMode]:
+        if output_mode == ChainOutputMode.Structured:
+            try:
+                # The JSON schema is passed instead of the pydantic v2 class, which LangChain converts with its pydantic v1 schema generator.
+                schema = {"description": f"{outputModel.__name__} object", **outputModel.model_json_schema()}
+                structured_model = chat_model.with_structured_output(schema, include_raw=True)
+                return chat_prompt | structured_model | self.__parse_structured_output, output_mode
+            except NotImplementedError:
+                print(f"{self._name}: The model does not support structured output. Use the output parser instead.")
+
+        return chat_prompt | chat_model | self.__parse_completion, ChainOutputMode.Parser
+
+    def __parse_completion(self, message: AIMessage) -> OutputType:
+        try:
+            return self._output_parser.invoke(message)
+        except:
+            self._stats.parse_failures += 1
+            raise
+
+    def __parse_structured_output(self, output: dict) -> OutputType:
+        if output["parsed"] is not None:
+            try:
+                return self._output_parser.pydantic_object.model_validate(output["parsed"])
+            except ValidationError:
+                pass
+
+        # Fall back to parsing the raw function call arguments or the completion text.
+        self._stats.structured_fallbacks += 1
+        raw: AIMessage = output["raw"]
+        tool_calls = raw.additional_kwargs.get("tool_calls") or []
+        text = tool_calls[0]["function"]["arguments"] if len(tool_calls) > 0 else raw.content
+        try:
+            return self._output_parser.parse(text)
+        except:
+            self._stats.parse_failures += 1
+            raise
 
     @classmethod
     def __input_parser(cls, input: InputType, config: RunnableConfig)->dict:
@@ -72,17 +197,107 @@ class ChainMapper(ABC, Generic[InputType, OutputType]):
     def _postprocess_output(cls, output: OutputType, config: RunnableConfig)->OutputType:
         return output
     
+    @property
+    def system_instruction(self) -> str:
+        return self._system_instruction
+
+    @property
+    def prompt(self) -> ChatPromptTemplate:
+        return self._prompt
+
+    @property
+    def stats(self) -> ChainMapperStats:
+        return self._stats
+
     @property
     def chain(self)-> Runnable:
         return self._chain
 
-    async def run(self, input: InputType) -> OutputType:
+    async def run(self, input: InputType, config: RunnableConfig | None = None) -> OutputType:
         ts = perf_counter()
 
-        result = await self.chain.ainvoke(input)
+        result = await self.chain.ainvoke(input, config)
 
         te = perf_counter()
 
         print(f"{self._name} took {te-ts} sec.")
 
-        return result
\ No newline at end of file
+        return result
+
+
+class LineLevelChainMapper(Generic[InputType, OutputType, ElementType], ChainMapper[InputType, OutputType], ABC):
+    # Mapper whose output has one element per input lyric line, identified by "line_id".
+    # Instead of regenerating the whole batch when some lines are missing or invalid, only those lines are requested again and merged.
+
+    MAX_REPAIR_ATTEMPTS = 3
+
+    def __init__(self, name: str, outputModel: type[OutputType], system_instruction: str, model: BaseChatModel | None = None,
+                 output_mode: ChainOutputMode | None = None, fallback_model: BaseChatModel | None = None) -> None:
+        super().__init__(name, outputModel, system_instruction, model, output_mode, fallback_model)
+        self._repairing_chain = RunnableLambda(self._invoke_with_repair, name=f"{name}-repair")
+
+    @classmethod
+    @abstractmethod
+    def _get_input_lines(cls, input: InputType) -> list[BaseModel]:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def _make_partial_input(cls, input: InputType, line_ids: set[str]) -> InputType:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def _get_output_elements(cls, output: OutputType) -> list[ElementType]:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def _make_output(cls, elements: list[ElementType]) -> OutputType:
+        pass
+
+    @classmethod
+    def _is_valid_element(cls, element: ElementType) -> bool:
+        return True
+
+    @classmethod
+    def _map_line_indices(cls, elements: list[ElementType], lyric_lines: list[BaseModel]) -> list[ElementType]:
+        # Replace number index into unique id. Elements with an unknown or duplicate index are dropped, to be requested again.
+        result: list[ElementType] = []
+        mapped_ids: set[str] = set()
+        for element in elements:
+            try:
+                line_id = lyric_lines[int(element.line_id)].id
+            except (ValueError, IndexError):
+                continue
+            if line_id not in mapped_ids and cls._is_valid_element(element):
+                element.line_id = line_id
+                mapped_ids.add(line_id)
+                result.append(element)
+        return result
+
+    async def _invoke_with_repair(self, input: InputType, config: RunnableConfig) -> OutputType:
+        lines = self._get_input_lines(input)
+
+        output = await self._chain.ainvoke(input, config)
+        elements = {element.line_id: element for element in self._get_output_elements(output)}
+
+        for attempt in range(self.MAX_REPAIR_ATTEMPTS):
+            missing_ids = set([line.id for line in lines if line.id not in elements])
+            if len(missing_ids) == 0:
+                break
+
+            print(f"{self._name}: Request {len(missing_ids)} of {len(lines)} lines again (attempt {attempt + 1}).")
+            partial_output = await self._chain.ainvoke(self._make_partial_input(input, missing_ids), config)
+            for element in self._get_output_elements(partial_output):
+                if element.line_id in missing_ids:
+                    elements[element.line_id] = element
+
+        missing_ids = [line.id for line in lines if line.id not in elements]
+        assert len(missing_ids) == 0, f"{self._name}: No valid result for lines {missing_ids}."
+
+        return self._make_output([elements[line.id] for line in lines])
+
+    @property
+    def chain(self) -> Runnable:
+        return self._repairing_chain
@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.database.crud.chat import LineChatContext, fetch_line_chat_context
+from backend.database.models import Thread
+
+
+class ChatContextCache:
+    # Keeps the chat context of recently active threads, so that the follow-up messages of a thread do not query it again.
+    # Writes to the rows it is built from invalidate it; the TTL only bounds how long a missed invalidation can last.
+
+    def __init__(self, max_threads: int = 256, ttl_seconds: float = 300):
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, LineChatContext]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, thread_id: str) -> LineChatContext | None:
+        entry = self._entries.get(thread_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            return None
+        self._entries.move_to_end(thread_id)
+        return entry[1]
+
+    def put(self, thread_id: str, context: LineChatContext):
+        self._entries[thread_id] = (time.monotonic(), context)
+        self._entries.move_to_end(thread_id)
+        while len(self._entries) > self.max_threads:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, project_id: str, line_id: str | None = None):
+        for thread_id in [thread_id for thread_id, (_, context) in self._entries.items()
+                          if context.project_id == project_id and (line_id is None or context.line_id == line_id)]:
+            self._entries.pop(thread_id)
+
+    def clear(self):
+        self._entries.clear()
+
+
+chat_context_cache = ChatContextCache()
+
+async def get_chat_context(db: AsyncSession, thread: Thread) -> LineChatContext | None:
+    context = chat_context_cache.get(thread.id)
+    if context is not None:
+        chat_context_cache.hits += 1
+        return context
+
+    chat_context_cache.misses += 1
+    context = await fetch_line_chat_context(db, thread.project_id, thread.line_id)
+    if context is not None:
+        chat_context_cache.put(thread.id, context)
+    return context
@@ -1,3 +1,4 @@
+import asyncio
 from enum import StrEnum, auto
 
 from backend.tasks.chain_mapper import ChainMapper
@@ -5,32 +6,25 @@ from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel, ConfigDict
 from sqlmodel.ext.asyncio.session import AsyncSession
-from langchain_core.prompts.string import jinja2_formatter
 
-from backend.database.crud.project import fetch_line_annotation_by_line, fetch_line_inspection_by_line, fetch_line_translation_by_line
-from backend.database.models import ChatIntent, LineAnnotation, LineInspection, LineTranslation, MessageRole, Thread
-from backend.utils.env_helper import get_env_variable, EnvironmentVariables
-from langchain_openai import ChatOpenAI
+from backend.database.models import ChatIntent, Thread
+from backend.tasks.chat.chat_context import get_chat_context
+from backend.tasks.chat.intent_fast_path import IntentSource, local_intent_classifier
+from backend.tasks.chat.memory import chat_memory
+from backend.tasks.chat.prompts import (EMOTING_TEMPLATE, EMOTING_WITH_TRANSLATION_TEMPLATE, GLOSSING_TEMPLATE, GLOSSING_WITH_TRANSLATION_TEMPLATE,
+                                        MEANING_TEMPLATE, OTHER_TEMPLATE, TIMING_TEMPLATE, TIMING_WITH_TRANSLATION_TEMPLATE)
+from backend.utils.prompt_templates import prompt_templates
+from backend.tasks.translation_coalescer import translation_coalescer
+from backend.tasks.model_routing import get_route_models
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate
 from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
+from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage
 
 
-# Retrieve API key from environment variable
-api_key = get_env_variable(EnvironmentVariables.OPENAI_API_KEY)
-
-# Initialize the OpenAI client
-client = ChatOpenAI(
-    api_key=api_key,
-    model_name="gpt-4o",
-    temperature=1,
-    max_tokens=2048,
-    top_p=1,
-    model_kwargs=dict(
-                                    frequency_penalty=0, 
-                                    presence_penalty=0)
-)
+# The chat responses use the standard model of the default route.
+default_client, _ = get_route_models("chat")
+default_summary_client, _ = get_route_models("thread_summary")
 
 class IntentClassification(BaseModel):
     model_config=ConfigDict(use_enum_values=True)
@@ -78,11 +72,22 @@ class IntentClassifier(ChainMapper[str, IntentClassification]):
         return input
 
 
-intent_classifier = IntentClassifier(client)
+client: BaseChatModel = default_client
+summary_client: BaseChatModel = default_summary_client
+# Without a model given, the classifier runs on the models of its route.
+intent_classifier = IntentClassifier(None)
+
+
+def use_chat_model(model: BaseChatModel | None):
+    # Replace the chat model, e.g., with an offline stand-in for benchmarks. None restores the default models.
+    global client, summary_client, intent_classifier
+    client = model or default_client
+    summary_client = model or default_summary_client
+    intent_classifier = IntentClassifier(model)
 
 # Function to classify user intent
-async def classify_user_intent(user_input: str, retry_count: int = 5)->ChatIntent:
-    # Execute the chain with the lyrics input
+async def classify_user_intent(user_input: str, retry_count: int = 1)->ChatIntent:
+    # Execute the chain with the lyrics input. Invalid outputs are already retried within the chain, so this only retries failed calls.
     try:
         response_classification = await intent_classifier.run(user_input)
         return response_classification.intent
@@ -94,67 +99,26 @@ async def classify_user_intent(user_input: str, retry_count: int = 5)->ChatInten
             print("Consumed all retry count. Just return 'Other'")
             return ChatIntent.Other
 
+# Classify with the local classifier first, and with the LLM only when it is unsure.
+async def resolve_user_intent(user_input: str) -> tuple[ChatIntent, IntentSource]:
+    intent = local_intent_classifier.classify(user_input)
+    if intent is not None:
+        return intent, IntentSource.Local
+
+    intent = await classify_user_intent(user_input)
+    local_intent_classifier.add_example(user_input, intent)
+    return intent, IntentSource.LLM
+
 
 
 # Create a formatted system template string with inference results.
 def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric_line: str, result: BaseModel | None, user_name: str, sign_language: str, user_translation: str | None) -> str:
     print(f"Creating system instruction for intent: {intent}, with user_translation: {user_translation}")
     if intent == ChatIntent.Meaning:
-        system_template = '''
-        Your name is ELMI, a helpful chatbot that helps users understand lyrics for song signing.
-        ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-        ELMI you are an active listener.
-        You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?).
-        The user decides whether or not they care to engage in further chat.
-
-        - You are currently talking about the song "{{title}}" by "{{artist}}."
-        - The conversation is about the lyric line, "{{lyric_line}}"
-        - You are assisting {{user_name}} with translating the lyrics to {{sign_language}}.
-
-        You start by prompting questions to users of the input line. 
-        
-        You are answering to questions such as:
-        "How should I understand the deeper context of this line?"
-        "Can you explain the underlying message of this line?"
-        "What is the hidden meaning behind this line?"
-
-        {% if line_inspection_results is not none -%}
-        You are using the outputs from the previous note on the line:
-        [Note on the line]
-        {{line_inspection_results}}
-        {%- endif %}
-
-        The first answer should be string plain text formated line inspection results (remove JSON format) with added explanation. 
-
-        Do not introduce yourself. 
-
-        Key characteristics of ELMI:
-        - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
-        - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
-        - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-        Handling Conversations:
-        - Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-
-        Support and Encouragement:
-        - EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-
-
-        Your role:
-        {% if line_inspection_results is not none -%} Given the note on the line above, {%- else %} Considering the lyric line, 
-        {%- endif %} you will create some thought-provoking questions for users and start a discussion with the user about the meaning of the lyrics. 
-        Your role is to help users to come up with their idea.
-        When you suggest something, make sure to ask if the user wants other things.
-
-        Output format:
-        Do not include JSON or unnecessary data in your response. Respond with clear, empathetic, and thought-provoking questions.
-        Do not ask more than 2 questions at a time.
-        Keep your responses concise and engaging.
-        '''
 
         line_inspection_results = result.model_dump_json(include={"challenges", "description"}) if result else None
 
-        return jinja2_formatter(template=system_template, 
+        return prompt_templates.render(MEANING_TEMPLATE, 
                                 line_inspection_results=line_inspection_results,
                                 title=title,
                                 artist=artist,
@@ -167,60 +131,8 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
 
         if user_translation is not None:
             print("Using template for Glossing with user translation")
-            system_template = '''
-            Your name is ELMI, a helpful chatbot that helps get feedback on gloss for song signing.
-            ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-            ELMI you are an active listener. 
-
-            You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?)
-            The user decides whether or not they care to engage in further chat.
-
-            - You are currently talking about the song "{{title}}" by "{{artist}}."
-            - The conversation is about the lyric line, "{{lyric_line}}"
-            - You are assisting {{user_name}} with translating the lyrics to {{sign_language}} gloss.
-
-            You are answering to questions such as:
-            "How can I improve my glossing?"
-            "What else can I do for my glossing?"
-            "Can you give me a feedback on my gloss?"
-
-
-            You are using the user's gloss that user typed into our prototype:
-            [Note of the line]
-            {{line_translation_results}}
-
-
-            The first answer should be string plain text formated line glossing results (remove JSON format) with added explannation. 
-            Do not introduce yourself. 
-
-            Key characteristics of ELMI:
-            - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
-            - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
-            - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-            Handling Conversations:
-            - Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-
-            Support and Encouragement:
-            - EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-            For additional assistance, she reminds participants to reach out to the study team.
-
-            Your role:
-            Given the note on the line above, Considering the lyric line, you will create some thought-provoking questions for users and give some feedback about the gloss that user created. 
-            Your role is to help users to come up with their idea.
-            When you suggest something, make sure to ask if the user wants other things.
-
-
-            Output format:
-            Do not include JSON or unnecessary data in your response. 
-            Do not talk about emoting or timing as a first response.
-            Respond with clear, empathetic, and thought-provoking questions.
-            First start by recapping the {{line_translation_results}}.
-            Do not ask more than 2 questions at a time.
-            Keep your responses concise and engaging.
-            '''
             
-            return jinja2_formatter(template=system_template,
+            return prompt_templates.render(GLOSSING_WITH_TRANSLATION_TEMPLATE,
                                 line_translation_results=user_translation,
                                 title=title,
                                 artist=artist,
@@ -230,60 +142,8 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
                                 )
         else: 
             print("Using template for Glossing without user translation")
-            system_template = '''
-            Your name is ELMI, a helpful chatbot that helps users create gloss for song signing.
-            ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-            ELMI you are an active listener. 
-
-            You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?)
-            The user decides whether or not they care to engage in further chat.
-
-            - You are currently talking about the song "{{title}}" by "{{artist}}."
-            - The conversation is about the lyric line, "{{lyric_line}}"
-            - You are assisting {{user_name}} with translating the lyrics to {{sign_language}} gloss.
-
-            You are answering to questions such as:
-            "How do you sign this specific line in {{sign_language}}?"
-            "What is the {{sign_language}} translation for the line?"
-            "Can you show me the {{sign_language}} signs for this line?"
-
-
-            You are using the outputs from the previous note on the line about glossing:
-            [note of the line]
-            {{line_glossing_results}}
-
-
-            The first answer should be string plain text formated line glossing results (remove JSON format) with added explannation. 
-            Do not introduce yourself. 
-
-            Key characteristics of ELMI:
-            - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
-            - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
-            - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-            Handling Conversations:
-            - Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-
-            Support and Encouragement:
-            - EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-            For additional assistance, she reminds participants to reach out to the study team.
-
-            Your role:
-            Given the note on the line above, Considering the lyric line, you will create some thought-provoking questions for users and start a discussion with the user about the gloss. 
-            Your role is to help users to come up with their idea.
-            When you suggest something, make sure to ask if the user wants other things.
-
-
-            Output format:
-            Do not include JSON or unnecessary data in your response. 
-            Respond with clear, empathetic, and thought-provoking questions.
-            Do not talk about emoting or timing as a first response. 
-            Make sure to end with the suggested gloss.
-            Do not ask more than 2 questions at a time.
-            Keep your responses concise and engaging.
-            '''
             
-            return jinja2_formatter(template=system_template,
+            return prompt_templates.render(GLOSSING_TEMPLATE,
                                 line_glossing_results=result.model_dump_json(include={"gloss", "gloss_description"}),
                                 title=title,
                                 artist=artist,
@@ -296,54 +156,8 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
     if intent == ChatIntent.Emoting:
         if user_translation is not None:
             print("Using template for Emoting with user translation")
-            system_template = '''
-            Your name is ELMI, a helpful chatbot that helps users perform the lyrics for song signing.
-            ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-            ELMI you are an active listener.
-            You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?)
-            The user decides whether or not they care to engage in further chat.
-
-            - You are currently talking about the song "{{title}}" by "{{artist}}."
-            - The conversation is about the lyric line, "{{lyric_line}}"
-            - You are assisting {{user_name}} with performing {{sign_language}} gloss.
-
-            You are answering to questions such as:
-            "How can convey the emotion in this line?"
-            "What non-manual markers would you use to express the mood of this line?"
-            "Can you demonstrate how to express the mood of this line?"
-
-            You are using the note of the user created gloss and help user with the emotion of the line (emotion, facial expression, body gestures):
-            [Note on the line]
-            {{user_translation}}     
-
-            The first answer should be string plain text formated line emoting results (remove JSON format) with added explannation. Do not introduce yourself.
-
-            Key characteristics of ELMI:
-            - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
-            - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
-            - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-            Handling Conversations:
-            - Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-
-            Support and Encouragement:
-            - EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-            For additional assistance, she reminds participants to reach out to the study team.
-
-            Your role:
-            Given the note on the line above, Considering the lyric line, you will create some thought-provoking questions for users and start a discussion with the user about performing the gloss. 
-            Your role is to help users to come up with their idea.
-            When you suggest something, make sure to ask if the user wants other things.
-
-
-            Output format:
-            Do not include JSON or unnecessary data in your response. Respond with clear, empathetic, and thought-provoking questions.
-            Do not ask more than 2 questions at a time.
-            First start by recapping the {{user_translation}}  
-            Keep your responses concise and engaging.
-            '''
         
-            return jinja2_formatter(template=system_template,
+            return prompt_templates.render(EMOTING_WITH_TRANSLATION_TEMPLATE,
                                 user_translation = user_translation,
                                 title=title,
                                 artist=artist,
@@ -354,55 +168,8 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
 
         else:
             print("Using template for Emoting without user translation")
-            system_template = '''
-            Your name is ELMI, a helpful chatbot that helps users perform the lyrics for song signing.
-            ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-            ELMI you are an active listener.
-            You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?)
-            The user decides whether or not they care to engage in further chat.
-
-            - You are currently talking about the song "{{title}}" by "{{artist}}."
-            - The conversation is about the lyric line, "{{lyric_line}}"
-            - You are assisting {{user_name}} with performing {{sign_language}} gloss.
-
-            You start by prompting questions to users of the input line.
-
-            You are answering to questions such as:
-            "How can convey the emotion in this line?"
-            "What non-manual markers would you use to express the mood of this line?"
-            "Can you demonstrate how to express the mood of this line?"
-
-            You are using the previous note on the emotion of the line (emotion, facial expression, body gestures):
-            [Note on the line]
-            {{line_emoting_results}}     
-
-            The first answer should be string plain text formated line emoting results (remove JSON format) with added explannation. Do not introduce yourself.
-
-            Key characteristics of ELMI:
-            - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
-            - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
-            - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-            Handling Conversations:
-            - Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-
-            Support and Encouragement:
-            - EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-            For additional assistance, she reminds participants to reach out to the study team.
-
-            Your role:
-            Given the note on the line above, Considering the lyric line, you will create some thought-provoking questions for users and start a discussion with the user about performing the gloss. 
-            Your role is to help users to come up with their idea.
-            When you suggest something, make sure to ask if the user wants other things.
-
-
-            Output format:
-            Do not include JSON or unnecessary data in your response. Respond with clear, empathetic, and thought-provoking questions.
-            Do not ask more than 2 questions at a time.
-            Keep your responses concise and engaging.
-            '''
         
-            return jinja2_formatter(template=system_template,
+            return prompt_templates.render(EMOTING_TEMPLATE,
                                 line_emoting_results=result.model_dump_json(include={"mood", "facial_expression", "body_gesture", "emotion_description"}),
                                 title=title,
                                 artist=artist,
@@ -415,55 +182,8 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
     if intent == ChatIntent.Timing:
         if user_translation is not None:
             print("Using template for Timing with user translation")
-            system_template = '''
-            Your name is ELMI, a helpful chatbot that helps users adjust the gloss for song signing.
-            ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-            ELMI you are an active listener.
-            You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?)
-            The user decides whether or not they care to engage in further chat.
-
-            - You are currently talking about the song "{{title}}" by "{{artist}}."
-            - The conversation is about the lyric line, "{{lyric_line}}"
-            - You are assisting {{user_name}} with adjusting the {{sign_language}} gloss.
-
-            You are answering to questions such as:
-            "Can you show me how to modify the gloss to match the song's rhythm?"
-            "How can you tweak the gloss for different parts of the line to match the timing?"
-            "What changes to the gloss help align it with the song’s rhythm?"
-
-
-            You are using the note on user generated gloss for the gloss options of the line (shorter and longer version of the gloss):
-            [Note on the line]
-            {{user_translation}}     
- 
-            Do not introduce yourself.
-
-            Key characteristics of ELMI:
-            - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
-            - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
-            - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-            Handling Conversations:
-            - Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-
-            Support and Encouragement:
-            - EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-            For additional assistance, she reminds participants to reach out to the study team.
-
-            Your role:
-            Given the note above, Considering the lyric line, you will create some thought-provoking questions for users and start a discussion with the user about adjusting the gloss. 
-            Your role is to help users to come up with their idea.
-            When you suggest something, make sure to ask if the user wants other things.
-
-            Output format:
-            Do not include JSON or unnecessary data in your response. 
-            Respond with clear, empathetic, and thought-provoking questions.
-            Do not ask more than 2 questions at a time.
-            Do not mention expected time (sec).
-            Keep your responses concise and engaging.
-            '''
         
-            return jinja2_formatter(template=system_template,  
+            return prompt_templates.render(TIMING_WITH_TRANSLATION_TEMPLATE,  
                                     user_translation = user_translation,
                                     title=title,
                                     artist=artist,
@@ -474,58 +194,8 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
 
         else: 
             print("Using template for Timing without user translation")
-            system_template = '''
-            Your name is ELMI, a helpful chatbot that helps users adjust the gloss for song signing.
-            ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-            ELMI you are an active listener.
-            You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?)
-            The user decides whether or not they care to engage in further chat.
-
-            You start by prompting questions to users of the input line.
-
-            - You are currently talking about the song "{{title}}" by "{{artist}}."
-            - The conversation is about the lyric line, "{{lyric_line}}"
-            - You are assisting {{user_name}} with adjusting the {{sign_language}} gloss.
-
-            You are answering to questions such as:
-            "Can you show me how to modify the gloss to match the song's rhythm?"
-            "How can you tweak the gloss for different parts of the line to match the timing?"
-            "What changes to the gloss help align it with the song’s rhythm?"
-
-
-            You are using the notes on the gloss options of the line (shorter and longer version of the gloss):
-            [Note on the line]
-            {{line_timing_results}}
-
-            The first answer should be string plain text formated line timing results (remove JSON format) with added explannation. 
-            Do not introduce yourself.
-
-            Key characteristics of ELMI:
-            - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
-            - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
-            - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-            Handling Conversations:
-            - Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-
-            Support and Encouragement:
-            - EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-            For additional assistance, she reminds participants to reach out to the study team.
-
-            Your role:
-            Given the note above, Considering the lyric line, you will create some thought-provoking questions for users and start a discussion with the user about adjusting the gloss. 
-            Your role is to help users to come up with their idea.
-            When you suggest something, make sure to ask if the user wants other things.
-
-            Output format:
-            Do not include JSON or unnecessary data in your response. 
-            Respond with clear, empathetic, and thought-provoking questions.
-            Do not ask more than 2 questions at a time.
-            Do not mention expected time (sec).
-            Keep your responses concise and engaging.
-            '''
         
-            return jinja2_formatter(template=system_template,  
+            return prompt_templates.render(TIMING_TEMPLATE,  
                                     line_timing_results=result.model_dump_json(include={"gloss_alts"}),
                                     title=title,
                                     artist=artist,
@@ -536,45 +206,7 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
      
     elif intent == ChatIntent.Other:
         print("Other intent prompt")
-        system_template = '''
-- Your name is ELMI, a helpful chatbot that assists users with various queries for song signing.
-
-- ELMI specializes in guiding users to have a critical thinking process about the lyrics.
-- ELMI you are an active listener.
-- You are not giving all the possible answers, instead, listen to what the users are thinking and ask them to reflect on little things a bit more (What does the user want?)
-- The user decides whether or not they care to engage in further chat.
-- The user {{user_name}} can talk to you anytime in the middle of song signing process. So do not greet or say hello."
-
-[Conversation Context]
-- You are currently talking about the song "{{title}}" by "{{artist}}."
-- You are assisting {{user_name}} using the {{sign_language}}.
-- The conversation is about the lyric line, "{{lyric_line}}"
-
-[Your task]
-- You start by prompting questions to users.
-- You are answering to questions that may not fit into predefined categories. Thus, you will need to adapt your responses to the user's query and provide the necessary guidance to below categories:
-    1. Meaning: Questions about understanding or interpreting the lyrics.
-    2. Glossing: Questions about how to sign specific words or phrases. {{sign_language}} translation.
-    3. Emoting: Questions about expressing emotions through facial expressions and body language.
-    4. Timing: Questions about the timing or rhythm of the gloss, including changing and adjusting the gloss (shorter or longer).
-
-[Key characteristics of ELMI]
- - Clear Communication: ELMI offers simple, articulate instructions with engaging examples.
- - Humor: ELMI infuses the sessions with light-hearted humour to enhance the enjoyment. Add some emojis.
- - Empathy and Sensitivity: ELMI shows understanding and empathy, aligning with the participant's emotional state.
-
-[Support and Encouragement]
-- EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-- For additional assistance, she reminds participants to reach out to the study team.
-
-[Carrying on Conversations]
-- Redirecting Off-Topic Chats: ELMI gently guides the conversation back to lyrics interpretation topics, suggesting social interaction with friends for other discussions.
-- Support and Encouragement: EMLI offers continuous support, using her identity to add fun and uniqueness to her encouragement.
-- Your role is to help users with their queries by providing thoughtful responses and guiding them through their thought processes.      
-- Do not ask more than 2 questions at a time.
-- Keep your responses concise and engaging.
-        '''
-        return jinja2_formatter(template=system_template, 
+        return prompt_templates.render(OTHER_TEMPLATE, 
                             title=title,
                             artist=artist,
                             lyric_line=lyric_line,
@@ -583,59 +215,61 @@ def create_system_instruction(intent: ChatIntent, title: str, artist: str, lyric
                             )
 
 # Initiate a proactive chat session with a user based on a specific line ID.
-async def generate_chat_response(db: AsyncSession, thread: Thread, user_input: str | None, intent: ChatIntent | None)  -> tuple[ChatIntent, str]:
-    
-    # Log input parameters
-    line_inspection: LineInspection = await fetch_line_inspection_by_line(db, thread.project_id, thread.line_id)
-    line_annotation: LineAnnotation = await fetch_line_annotation_by_line(db, thread.project_id, thread.line_id)
-    line_translation: LineTranslation = await fetch_line_translation_by_line(db, thread.project_id, thread.line_id)
+async def generate_chat_response(db: AsyncSession, thread: Thread, user_input: str | None, intent: ChatIntent | None)  -> tuple[ChatIntent, str, IntentSource | None]:
+
+    # The intent of a typed message is classified while the line context is loaded.
+    classification = asyncio.create_task(resolve_user_intent(user_input)) if intent is None and user_input is not None else None
+
+    context = await get_chat_context(db, thread)
+    if context is None:
+        if classification is not None:
+            classification.cancel()
+        raise ValueError(f"No line {thread.line_id} in project {thread.project_id}.")
+
+    # A gloss the user is still typing is not written yet.
+    pending_translation = translation_coalescer.get_pending(thread.project_id, thread.line_id)
+    user_translation = pending_translation.gloss if pending_translation is not None else context.user_translation
 
-    song = thread.project.song
-    user = thread.project.user
-        
     # Use the provided intent directly if it's a button click
     safe_intent = intent or ChatIntent.Other
+    intent_source = IntentSource.Button if intent is not None else None
     if intent is None:
-        if user_input is not None:
-            classification_result = await classify_user_intent(user_input)
-            safe_intent = classification_result
-        elif line_inspection is not None:
+        if classification is not None:
+            safe_intent, intent_source = await classification
+        elif context.inspection is not None:
             safe_intent = ChatIntent.Meaning
     else:
         safe_intent = ChatIntent.Other
-        
-    user_name = user.callable_name or user.alias
-    sign_language = thread.project.safe_user_settings.main_language or user.sign_language
-    user_translation = line_translation.gloss if line_translation else None
-    print(f"User's gloss: {user_translation}. Sign language: {sign_language}, intent: {safe_intent}") 
-
-    # Initialize system_instruction with a default value
-    system_instruction = ""
-
-    if safe_intent == ChatIntent.Meaning:
-        system_instruction = create_system_instruction(safe_intent, 
-                                                       title = song.title, 
-                                                       artist = song.artist, 
-                                                       lyric_line=line_annotation.line.lyric, result=line_inspection, 
-                                                       user_name=user_name, 
-                                                       sign_language=sign_language, 
-                                                       user_translation=user_translation)
-    else:
-        system_instruction = create_system_instruction(safe_intent, song.title, song.artist, line_annotation.line.lyric, line_annotation, user_name, sign_language, user_translation)
+
+    print(f"User's gloss: {user_translation}. Sign language: {context.sign_language}, intent: {safe_intent}") 
+
+    system_instruction = create_system_instruction(safe_intent, 
+                                                   title=context.song_title, 
+                                                   artist=context.song_artist, 
+                                                   lyric_line=context.lyric, 
+                                                   result=context.inspection if safe_intent == ChatIntent.Meaning else context.annotation, 
+                                                   user_name=context.user_name, 
+                                                   sign_language=context.sign_language, 
+                                                   user_translation=user_translation)
 
 
     try:
         messages: list[BaseMessage] = [SystemMessage(system_instruction)]
 
-        messages.extend([AIMessage(message.message) if message.role == MessageRole.Assistant else HumanMessage(message.message) for message in thread.messages])
+        # The latest turns within a token budget, preceded by a summary of the earlier ones.
+        messages.extend(chat_memory.build_history(thread))
 
         if user_input is not None:
             messages.append(HumanMessage(user_input))
 
         response = await client.agenerate([messages])
 
-        return safe_intent, response.generations[0][0].message.content
+        return safe_intent, response.generations[0][0].message.content, intent_source
 
     except Exception as ex:
         print(ex)
-        raise ex
\ No newline at end of file
+        raise ex
+
+# Update the summary of the older messages of a thread in the background, once the new messages are stored.
+def schedule_history_summary(thread_id: str):
+    chat_memory.schedule_summary(thread_id, summary_client)
@@ -0,0 +1,127 @@
+from collections import Counter
+from enum import StrEnum
+import math
+import re
+
+from pydantic import BaseModel
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.database.models import ChatIntent, MessageRole, ThreadMessage
+
+
+class IntentSource(StrEnum):
+    Button="button" # Picked by the user.
+    Local="local" # The local classifier was confident enough.
+    LLM="llm"
+
+
+# Labeled examples the local classifier starts from, before any logged messages, following the examples given to the LLM classifier.
+SEED_EXAMPLES: list[tuple[str, ChatIntent]] = [
+    ("What is the deeper meaning of this line?", ChatIntent.Meaning),
+    ("Can you explain the underlying message of this line?", ChatIntent.Meaning),
+    ("What is the hidden meaning behind this line?", ChatIntent.Meaning),
+    ("How should I understand the context of these lyrics?", ChatIntent.Meaning),
+    ("What does the singer mean here?", ChatIntent.Meaning),
+    ("How do I sign this specific line?", ChatIntent.Glossing),
+    ("Give me feedback on my gloss.", ChatIntent.Glossing),
+    ("How can I improve my gloss?", ChatIntent.Glossing),
+    ("Which sign should I use for this word?", ChatIntent.Glossing),
+    ("How do I translate this phrase into sign language?", ChatIntent.Glossing),
+    ("How can I convey the emotion in this line?", ChatIntent.Emoting),
+    ("What facial expression should I use?", ChatIntent.Emoting),
+    ("How should my body language express the feeling?", ChatIntent.Emoting),
+    ("How do I show that I am sad with my face?", ChatIntent.Emoting),
+    ("What mood should my expression have?", ChatIntent.Emoting),
+    ("Can you show me how to modify the gloss?", ChatIntent.Timing),
+    ("How can I make a longer gloss?", ChatIntent.Timing),
+    ("How can I make a shorter gloss?", ChatIntent.Timing),
+    ("My signing is too slow for the rhythm of the song.", ChatIntent.Timing),
+    ("How do I fit the signs to the timing of the music?", ChatIntent.Timing),
+    ("Hello, how are you?", ChatIntent.Other),
+    ("Thank you!", ChatIntent.Other),
+    ("What is your name?", ChatIntent.Other),
+    ("Tell me a joke.", ChatIntent.Other),
+    ("What should I eat for dinner?", ChatIntent.Other),
+]
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"[a-z]+", text.lower())
+
+
+class IntentPrediction(BaseModel):
+    intent: ChatIntent
+    confidence: float
+
+
+class LocalIntentClassifier:
+    # A multinomial naive Bayes classifier over the words of a message, taking microseconds instead of an LLM round trip.
+    # Messages it is unsure about still go to the LLM classifier, whose answers are learned as new examples.
+
+    def __init__(self, min_confidence: float = 0.9, smoothing: float = 0.5):
+        self.min_confidence = min_confidence
+        self.smoothing = smoothing
+        self._word_counts: dict[ChatIntent, Counter[str]] = {intent: Counter() for intent in ChatIntent}
+        self._example_counts: Counter[ChatIntent] = Counter()
+        self._vocabulary: set[str] = set()
+        self.fit(SEED_EXAMPLES)
+
+    @property
+    def example_count(self) -> int:
+        return sum(self._example_counts.values())
+
+    def add_example(self, text: str, intent: ChatIntent):
+        tokens = tokenize(text)
+        if len(tokens) == 0:
+            return
+        self._word_counts[intent].update(tokens)
+        self._example_counts[intent] += 1
+        self._vocabulary.update(tokens)
+
+    def fit(self, examples: list[tuple[str, ChatIntent]]):
+        for text, intent in examples:
+            self.add_example(text, intent)
+
+    def predict(self, text: str) -> IntentPrediction | None:
+        tokens = [token for token in tokenize(text) if token in self._vocabulary]
+        if len(tokens) == 0:
+            return None
+
+        total_examples = self.example_count
+        vocabulary_size = len(self._vocabulary)
+        log_likelihoods: dict[ChatIntent, float] = {}
+        for intent in ChatIntent:
+            if self._example_counts[intent] == 0:
+                continue
+            word_counts = self._word_counts[intent]
+            denominator = sum(word_counts.values()) + self.smoothing * vocabulary_size
+            log_likelihoods[intent] = math.log(self._example_counts[intent] / total_examples) + \
+                sum(math.log((word_counts[token] + self.smoothing) / denominator) for token in tokens)
+
+        best = max(log_likelihoods, key=log_likelihoods.get)
+        normalizer = sum(math.exp(value - log_likelihoods[best]) for value in log_likelihoods.values())
+        return IntentPrediction(intent=best, confidence=1 / normalizer)
+
+    def classify(self, text: str) -> ChatIntent | None:
+        # None if the message should go to the LLM classifier.
+        prediction = self.predict(text)
+        if prediction is not None and prediction.confidence >= self.min_confidence:
+            return prediction.intent
+        return None
+
+
+local_intent_classifier = LocalIntentClassifier()
+
+async def load_logged_intent_examples(db: AsyncSession) -> list[tuple[str, ChatIntent]]:
+    # User messages labeled by the LLM classifier. Those labeled by the local classifier are left out, so that it does not learn from itself.
+    messages = (await db.exec(select(ThreadMessage)
+                              .where(ThreadMessage.role == MessageRole.User)
+                              .where(col(ThreadMessage.intent).is_not(None)))).all()
+    return [(message.message, ChatIntent(message.intent)) for message in messages
+            if (message.message_metadata or {}).get("intent_source") == IntentSource.LLM]
+
+async def train_local_intent_classifier(db: AsyncSession) -> int:
+    examples = await load_logged_intent_examples(db)
+    local_intent_classifier.fit(examples)
+    print(f"Trained the local intent classifier with {len(examples)} logged messages.")
+    return len(examples)
@@ -0,0 +1,124 @@
+import traceback
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from pydantic import BaseModel
+
+from backend.database.engine import db_sessionmaker
+from backend.database.models import MessageRole, Thread, ThreadMessage
+from backend.tasks.preprocessing.batch_planner import count_tokens
+from backend.utils.prompt_templates import prompt_templates
+from backend.utils.single_flight import SingleFlight
+
+
+class ChatMemoryConfig(BaseModel):
+    # Turns (a user message and the reply) always replayed verbatim.
+    recent_turns: int = 4
+    # Tokens for the replayed messages. The last turn is kept even beyond it.
+    history_token_budget: int = 2000
+    # Older turns are folded into the summary once this many have fallen out of the recent window, so that a summary call covers several turns.
+    summarize_every_turns: int = 2
+    # Chat messages are wrapped with a few tokens of role markup.
+    tokens_per_message_overhead: int = 4
+
+
+SUMMARY_TEMPLATE = prompt_templates.register("chat.history_summary", '''
+You maintain the memory of a conversation between a user and ELMI, a chatbot helping the user translate song lyrics into sign language.
+Update the summary of the earlier conversation with the new messages below.
+Keep what the user thinks about the meaning of the line, the glosses, expressions and timings discussed, and what the user decided or asked to revisit.
+Write at most 150 words in plain text, without greetings or filler.
+
+{% if summary is not none -%}
+[Summary so far]
+{{summary}}
+{%- endif %}
+
+[New messages]
+{% for role, message in messages -%}
+{{role}}: {{message}}
+{% endfor %}
+''')
+
+
+def _to_chat_message(message: ThreadMessage) -> BaseMessage:
+    return AIMessage(message.message) if message.role == MessageRole.Assistant else HumanMessage(message.message)
+
+
+class ChatMemoryManager:
+    # Replaying every message of a thread makes prompts, latency and cost grow with the thread.
+    # Instead, the last turns are replayed within a token budget and the ones before them are represented by a rolling summary,
+    # which is updated in the background after a response so that it does not add to the response latency.
+
+    def __init__(self, config: ChatMemoryConfig | None = None):
+        self.config = config or ChatMemoryConfig()
+        self.summaries: SingleFlight[None] = SingleFlight("thread_summary")
+
+    def _message_tokens(self, message: ThreadMessage) -> int:
+        return count_tokens(message.message) + self.config.tokens_per_message_overhead
+
+    def _window_start(self, thread: Thread) -> int:
+        # Index of the first message of the recent window: the last recent_turns turns, fewer when they exceed the token budget.
+        # The last turn is always in it. Messages before the window are left to the summary.
+        messages = thread.messages
+        start = max(thread.summarized_message_count, len(messages) - 2 * self.config.recent_turns)
+        used_tokens = 0
+        for i in range(len(messages) - 1, start - 1, -1):
+            used_tokens += self._message_tokens(messages[i])
+            if i < len(messages) - 2 and used_tokens > self.config.history_token_budget:
+                return i + 1
+        return start
+
+    def build_history(self, thread: Thread) -> list[BaseMessage]:
+        # Only the recent window is replayed, whether or not the messages before it are in the summary yet,
+        # so that a thread whose summary lags behind, e.g., after a failed summary call, still stays within the budget.
+        history = [_to_chat_message(message) for message in thread.messages[self._window_start(thread):]]
+
+        if thread.summary is not None:
+            history.insert(0, SystemMessage(f"Summary of the earlier conversation in this thread:\n{thread.summary}"))
+
+        return history
+
+    def _summarizable_count(self, thread: Thread) -> int:
+        # Messages before the recent window that are not in the summary yet. They are folded once there are enough of them for a
+        # summary call to cover several turns, or right away when the window was cut short by the token budget.
+        window_start = self._window_start(thread)
+        count = window_start - thread.summarized_message_count
+        budget_limited = window_start > max(0, len(thread.messages) - 2 * self.config.recent_turns)
+        return count if count >= 2 * self.config.summarize_every_turns or (budget_limited and count > 0) else 0
+
+    def schedule_summary(self, thread_id: str, model: BaseChatModel):
+        # The messages of the caller may not include the ones just stored, so the summary task checks them on its own session.
+        if not self.summaries.in_flight(thread_id):
+            self.summaries.start(thread_id, lambda: self._summarize(thread_id, model))
+
+    async def drain(self):
+        await self.summaries.join()
+
+    async def _summarize(self, thread_id: str, model: BaseChatModel):
+        try:
+            async with db_sessionmaker() as db:
+                thread = await db.get(Thread, thread_id)
+                if thread is None:
+                    return
+                await db.refresh(thread, ["messages"])
+
+                count = self._summarizable_count(thread)
+                if count == 0:
+                    return
+                folded = thread.messages[thread.summarized_message_count:thread.summarized_message_count + count]
+
+                prompt = prompt_templates.render(SUMMARY_TEMPLATE, summary=thread.summary,
+                                          messages=[("ELMI" if message.role == MessageRole.Assistant else "User", message.message) for message in folded])
+                response = await model.ainvoke([HumanMessage(prompt)])
+
+                thread.summary = response.content
+                thread.summarized_message_count += count
+                db.add(thread)
+                await db.commit()
+                print(f"Summarized {count} messages of thread {thread_id}.")
+        except Exception as ex:
+            print(f"Thread summary failed - {thread_id}: {ex}")
+            traceback.print_exc()
+
+
+chat_memory = ChatMemoryManager()
@@ -1,13 +1,9 @@
-from math import ceil, floor
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
-from pydub import AudioSegment
 
-from backend.database.models import Line, Song, TimestampRangeMixin, Verse
-from .genius import GeniusSongInfo, genius
-from .media import MediaManager
+from backend.database.models import Song
 from .common import LyricsPackage
-from backend.utils.string import spinalcase
+from .ingestion import SongIngestionPipeline
 from .lyric_synchronizer import LyricSynchronizer
 
 synchronizer = LyricSynchronizer()
@@ -24,65 +20,54 @@ async def prepare_song(title: str, artist: str,
     if match_song is not None and force is False:
         return match_song
 
+    pipeline = await make_song_ingestion_pipeline(title, artist, reference_youtube_id, db,
+                                                  skip_genius=skip_genius,
+                                                  override_description=override_description,
+                                                  override_lyrics=override_lyrics)
+    await pipeline.run()
+
     async with db.begin_nested():
-        if skip_genius is True:
-            song_info = GeniusSongInfo(id=0, title=title, artist_names=artist, song_art_image_thumbnail_url=None, song_art_image_url=None, lyrics=override_lyrics, description=override_description)
-        else:
-            song_info = await genius.retrieve_song_info(title, artist)
-        
-        if override_lyrics is not None:
-            print("Override custom lyrics.")
-            song_info.lyrics = override_lyrics
-
-        if override_description is not None:
-            song_info.description = override_description
-
-        song = Song(title=song_info.title, artist=song_info.artist_names, description=song_info.description, reference_video_id=reference_youtube_id)
+        return add_ingested_song(pipeline, reference_youtube_id, db)
+
+
+async def make_song_ingestion_pipeline(title: str, artist: str,
+                                       reference_youtube_id: str, db: AsyncSession,
+                                       skip_genius: bool = False,
+                                       override_description: str | None = None,
+                                       override_lyrics: LyricsPackage | None = None) -> SongIngestionPipeline:
+    pipeline = SongIngestionPipeline(title, artist, reference_youtube_id, synchronizer,
+                                     skip_genius=skip_genius,
+                                     override_description=override_description,
+                                     override_lyrics=override_lyrics)
+    
+    if (await db.get(Song, pipeline.song_id)) is not None:
+        # The checkpoint belongs to a song which was already stored. Start a fresh ingestion.
+        pipeline.reset()
+
+    return pipeline
+
+
+def add_ingested_song(pipeline: SongIngestionPipeline, reference_youtube_id: str, db: AsyncSession) -> Song:
+    song_info = pipeline.get_song_info()
+    checkpoint = pipeline.checkpoint
+
+    song = Song(id=pipeline.song_id, 
+                title=song_info.title, artist=song_info.artist_names, description=song_info.description, 
+                reference_video_id=reference_youtube_id,
+                cover_image_stored=checkpoint.cover_image_stored,
+                audio_filename=checkpoint.audio_filename,
+                video_filename=checkpoint.video_filename,
+                duration_seconds=checkpoint.duration_seconds)
+    db.add(song)
+
+    duration_millis = round(checkpoint.duration_seconds * 1000)
+
+    verse_orms, line_orms = synchronizer.convert_lyrics_to_orms(song.id, song_info.lyrics, duration_millis, pipeline.get_word_synced_lyrics())
                     
-        if song_info.song_art_image_url is not None:
-            print("Download cover image file...")
-            if (await MediaManager.retrieve_song_image_file(song.id, song_info.song_art_image_url)) == True:
-                song.cover_image_stored = True
-                db.add(song)
-
-        audio_filename = f"{spinalcase(title)}_{spinalcase(artist)}.mp3".lower()
-        MediaManager.retrieve_song_from_youtube(song.id, audio_filename, song.reference_video_id)
-        song.audio_filename = audio_filename
-        print(f"Saved audio file at {song.get_audio_file_path()}")
-
-        video_filename = f"{spinalcase(title)}_{spinalcase(artist)}.mp4".lower()
-        MediaManager.retrieve_video_from_youtube(song.id, video_filename, song.reference_video_id)
-        song.video_filename = video_filename
-        print(f"Saved video file at {song.get_video_file_path()}")
-
-        audio: AudioSegment = AudioSegment.from_mp3(song.get_audio_file_path())
-        song.duration_seconds = audio.duration_seconds
-        db.add(song)
-
-        duration_millis = round(audio.duration_seconds * 1000)
-
-        print("Reference Lyrics:")
-        print(song_info.lyrics)
-
-        segmented_lyrics = synchronizer.retrieve_segment_timestamped_subtitles_from_youtube(song.reference_video_id)
-
-        print("Segmented lyrics from YouTube:")
-        print(segmented_lyrics)
-        
-        line_synced_lyrics = await synchronizer.apply_line_level_timestamps(song_info.lyrics, segmented_lyrics, audio.duration_seconds)
-        print("Line-synced lyrics:")
-        print(line_synced_lyrics)
-
-
-        word_synced_lyrics = await synchronizer.apply_word_level_timestamps(line_synced_lyrics, song.get_audio_file_path())
-        word_synced_lyrics = synchronizer.split_multiline_lyrics(song_info.lyrics, word_synced_lyrics)
-
-        verse_orms, line_orms = synchronizer.convert_lyrics_to_orms(song.id, song_info.lyrics, duration_millis, word_synced_lyrics)
-                        
-        for verse in verse_orms:
-            db.add(verse)
+    for verse in verse_orms:
+        db.add(verse)
 
-        for line in line_orms:
-            db.add(line)
+    for line in line_orms:
+        db.add(line)
 
-        return song
\ No newline at end of file
+    return song
@@ -0,0 +1,175 @@
+import asyncio
+import csv
+from enum import StrEnum
+from os import path
+from time import perf_counter
+import traceback
+
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+from sqlmodel import select
+
+from backend.database.engine import db_sessionmaker
+from backend.database.models import Song, SongWhitelistItem, User
+from backend.utils.time import get_timestamp
+from .common import LyricsPackage
+from . import add_ingested_song, make_song_ingestion_pipeline
+
+
+class SongManifestItem(BaseModel):
+    title: str
+    artist: str
+    youtube_id: str
+    lyrics: str | None = None
+    description: str | None = None
+    skip_genius: bool = False
+    whitelist: list[str] = Field(default=[], description="Aliases of the users allowed to sign this song.")
+
+    @field_validator('lyrics', 'description', mode="before")
+    @classmethod
+    def handle_empty_strings(cls, value) -> str | None:
+        if isinstance(value, str) and value.strip() == '':
+            return None
+        else:
+            return value
+
+    @field_validator('whitelist', mode="before")
+    @classmethod
+    def split_whitelist(cls, value) -> list[str]:
+        if value is None:
+            return []
+        elif isinstance(value, str):
+            return [alias.strip() for alias in value.split(";") if alias.strip() != '']
+        else:
+            return value
+
+    @field_validator('skip_genius', mode="before")
+    @classmethod
+    def parse_bool(cls, value) -> bool:
+        if value is None or (isinstance(value, str) and value.strip() == ''):
+            return False
+        else:
+            return value
+
+def load_song_manifest(file_path: str) -> list[SongManifestItem]:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if path.splitext(file_path)[1].lower() == ".csv":
+            # CSV columns: title, artist, youtube_id, lyrics, description, skip_genius, whitelist (aliases separated by ';')
+            return [SongManifestItem.model_validate(row) for row in csv.DictReader(f)]
+        else:
+            return TypeAdapter(list[SongManifestItem]).validate_json(f.read())
+
+
+class SongIngestionStatus(StrEnum):
+    Created = "created"
+    Exists = "exists"
+    Failed = "failed"
+
+class SongIngestionReportItem(BaseModel):
+    title: str
+    artist: str
+    youtube_id: str
+    status: SongIngestionStatus
+    song_id: str | None = None
+    elapsed_seconds: float
+    error: str | None = None
+
+class SongIngestionReport(BaseModel):
+    manifest_path: str
+    workers: int
+    started_timestamp: int
+    elapsed_seconds: float
+    items: list[SongIngestionReportItem]
+
+    def count(self, status: SongIngestionStatus) -> int:
+        return len([item for item in self.items if item.status == status])
+
+
+async def _ingest_manifest_item(item: SongManifestItem, force: bool) -> tuple[SongIngestionStatus, str]:
+    async with db_sessionmaker() as db:
+        if force is False:
+            existing_song = (await db.exec(select(Song).where(Song.title == item.title, Song.artist == item.artist).limit(1))).first()
+            if existing_song is not None:
+                return SongIngestionStatus.Exists, existing_song.id
+
+        whitelist_users: list[User] = []
+        if len(item.whitelist) > 0:
+            whitelist_users = (await db.exec(select(User).where(User.alias.in_(item.whitelist)))).all()
+            unknown_aliases = set(item.whitelist) - set([u.alias for u in whitelist_users])
+            if len(unknown_aliases) > 0:
+                raise ValueError(f"Unknown user aliases in whitelist: {', '.join(unknown_aliases)}")
+
+        override_lyrics = LyricsPackage.from_list_str(item.lyrics.split("\n")) if item.lyrics is not None else None
+
+        pipeline = await make_song_ingestion_pipeline(item.title, item.artist, item.youtube_id, db,
+                                                      skip_genius=item.skip_genius,
+                                                      override_lyrics=override_lyrics,
+                                                      override_description=item.description)
+
+    # Downloading and transcribing take minutes, so they run outside of a transaction, not to keep the other workers from writing.
+    await pipeline.run()
+
+    async with db_sessionmaker() as db:
+        async with db.begin():
+            song = add_ingested_song(pipeline, item.youtube_id, db)
+            if len(whitelist_users) > 0:
+                db.add_all([SongWhitelistItem(user_id=u.id, song_id=song.id, active=True) for u in whitelist_users])
+
+            return SongIngestionStatus.Created, song.id
+
+
+async def ingest_song_manifest(manifest_path: str, workers: int = 2, force: bool = False) -> SongIngestionReport:
+    items = load_song_manifest(manifest_path)
+    semaphore = asyncio.Semaphore(workers)
+    report_items: list[SongIngestionReportItem | None] = [None] * len(items)
+    progress = {"running": 0, "done": 0}
+
+    def print_progress(message: str):
+        print(f"[Batch ingestion {progress['done']}/{len(items)} done, {progress['running']} running] {message}")
+
+    async def run_item(index: int, item: SongManifestItem):
+        async with semaphore:
+            label = f"\"{item.title}\" by {item.artist}"
+            progress["running"] += 1
+            print_progress(f"Start {label}")
+            ts = perf_counter()
+            try:
+                status, song_id = await _ingest_manifest_item(item, force)
+                error = None
+            except Exception as ex:
+                # A failed song must not abort the rest of the batch.
+                traceback.print_exc()
+                status, song_id, error = SongIngestionStatus.Failed, None, f"{type(ex).__name__}: {ex}"
+            te = perf_counter()
+
+            report_items[index] = SongIngestionReportItem(title=item.title, artist=item.artist, youtube_id=item.youtube_id,
+                                                          status=status, song_id=song_id, elapsed_seconds=te-ts, error=error)
+            progress["running"] -= 1
+            progress["done"] += 1
+            print_progress(f"{status} {label} - {te-ts} sec." + (f" ({error})" if error is not None else ""))
+
+    started_timestamp = get_timestamp()
+    ts = perf_counter()
+
+    # Entries of the same song would share one ingestion checkpoint, so only the first one is ingested.
+    scheduled_keys: set[tuple[str, str]] = set()
+    tasks = []
+    for i, item in enumerate(items):
+        key = (item.title.strip().lower(), item.artist.strip().lower())
+        if key in scheduled_keys:
+            report_items[i] = SongIngestionReportItem(title=item.title, artist=item.artist, youtube_id=item.youtube_id,
+                                                      status=SongIngestionStatus.Failed, elapsed_seconds=0, error="Duplicate manifest entry.")
+            progress["done"] += 1
+        else:
+            scheduled_keys.add(key)
+            tasks.append(run_item(i, item))
+
+    await asyncio.gather(*tasks)
+    te = perf_counter()
+
+    return SongIngestionReport(manifest_path=manifest_path, workers=workers, started_timestamp=started_timestamp,
+                               elapsed_seconds=te-ts, items=report_items)
+
+
+def write_song_ingestion_report(report: SongIngestionReport, file_path: str):
+    with open(file_path, 'w') as f:
+        f.write(report.model_dump_json(indent=2))
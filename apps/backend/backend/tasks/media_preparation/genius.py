@@ -1,13 +1,17 @@
+import asyncio
+import json
 import re
 from backend.tasks.media_preparation.common import LyricLine, LyricVerse, LyricsPackage, clean_lyric_line
-from fastapi import HTTPException
-import httpx
 from pydantic import BaseModel
 from bs4 import BeautifulSoup
 from retry import retry
 from rapidfuzz import fuzz
 
 from backend.utils.env_helper import get_env_variable, EnvironmentVariables
+from backend.utils.http_client import ResponseCache
+
+genius_search_cache = ResponseCache("genius_search", ttl_seconds=24 * 3600)
+genius_page_cache = ResponseCache("genius_pages", ttl_seconds=7 * 24 * 3600)
 
 class GeniusSongInfo(BaseModel):
     id: int
@@ -25,13 +29,7 @@ async def extract_lyrics_and_description(song_path: str) -> tuple[LyricsPackage|
 
     print(url)
 
-    webpage_text: str
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url=url)
-        if response.status_code != 200:
-            raise HTTPException("Failed to get Genius webpage.")
-        webpage_text = response.text.replace('<br/>', '\n')
-        
+    webpage_text = (await genius_page_cache.fetch_text(url)).replace('<br/>', '\n')
 
     html = BeautifulSoup(webpage_text,
             "html.parser"
@@ -75,34 +73,51 @@ class GeniusManager:
                 'Authorization': f"Bearer {self.token}"
             }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url=self.ENDPOINT_SEARCH, params=params, headers=headers, timeout=20000)
-            print(response.json())
-            songs = [hit["result"] for hit in response.json()["response"]["hits"] if hit["type"] == "song"]
-            
-            return songs
+        response = json.loads(await genius_search_cache.fetch_text(self.ENDPOINT_SEARCH, params=params, headers=headers))
+        songs = [hit["result"] for hit in response["response"]["hits"] if hit["type"] == "song"]
+        
+        return songs
     
+    @staticmethod
+    def find_matching_song(songs: list[dict], title: str, artist: str) -> dict | None:
+        for song in songs:
+
+            title_similarity = fuzz.ratio(song['title'], title)
+            artist_similarity = fuzz.ratio(song['artist_names'], artist)
+
+            print(f"Check {song['title']} / {song['artist_names']}.. title similarity - {title_similarity}, artist similarity - {artist_similarity}")
+
+            if song["title"].strip().lower() == title.strip().lower() or title_similarity > 90:
+                if song["artist_names"].strip().lower() == artist.strip().lower() or artist_similarity > 90:
+                    return song
+        return None
     
     async def retrieve_song_info(self, title: str, artist: str) -> GeniusSongInfo | None:
         search_terms = [f"{title} by {artist}", f"{title} - {artist}", f"{title}"]
-        for term in search_terms:
+
+        async def search(term: str) -> dict | None:
             print(f"Query Genius with term \"{term}\"...")
             songs = await self.query_genius(term)
-            if len(songs) > 0:
-                print(f"{len(songs)} songs")
-                for song in songs:
-
-                    title_similarity = fuzz.ratio(song['title'], title)
-                    artist_similarity = fuzz.ratio(song['artist_names'], artist)
-
-                    print(f"Check {song['title']} / {song['artist_names']}.. title similarity - {title_similarity}, artist similarity - {artist_similarity}")
-
-                    if song["title"].strip().lower() == title.strip().lower() or title_similarity > 90:
-                        if song["artist_names"].strip().lower() == artist.strip().lower() or artist_similarity > 90:
-                            print(song)
-
-                            lyrics, desc = await extract_lyrics_and_description(song["path"])
-                            return GeniusSongInfo(**song, lyrics=lyrics, description=desc)
+            print(f"{len(songs)} songs")
+            return self.find_matching_song(songs, title, artist)
+
+        # Query all term variants at once and take the first acceptable match.
+        tasks = [asyncio.create_task(search(term)) for term in search_terms]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                try:
+                    song = await next_result
+                except Exception as ex:
+                    print("Genius search failed - ", ex)
+                    continue
+
+                if song is not None:
+                    print(song)
+                    lyrics, desc = await extract_lyrics_and_description(song["path"])
+                    return GeniusSongInfo(**song, lyrics=lyrics, description=desc)
+        finally:
+            for task in tasks:
+                task.cancel()
         
         return None
 
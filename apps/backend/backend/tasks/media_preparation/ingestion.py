@@ -0,0 +1,271 @@
+import asyncio
+from enum import StrEnum
+import hashlib
+import json
+from os import path
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel, Field, TypeAdapter
+from pydub import AudioSegment
+
+from backend.config import ElmiConfig
+from backend.database.models import generate_id
+from backend.utils.lyric_data_types import SyncedLyricSegment, SyncedLyricsSegmentWithWordLevelTimestamp, SyncedText
+from backend.utils.string import spinalcase
+from .common import LyricsPackage
+from .genius import GeniusSongInfo, genius
+from .lyric_synchronizer import LyricSynchronizer
+from .media import MediaDownloadManager, MediaManager, make_progress_printer
+
+
+class IngestionStage(StrEnum):
+    SongInfo = "song_info"
+    Cover = "cover"
+    Audio = "audio"
+    Video = "video"
+    Subtitles = "subtitles"
+    LineSync = "line_sync"
+    WordSync = "word_sync"
+
+# Stages are scheduled as soon as their dependencies are complete, so cover, video and audio+subtitles run concurrently.
+STAGE_DEPENDENCIES: dict[IngestionStage, list[IngestionStage]] = {
+    IngestionStage.SongInfo: [],
+    IngestionStage.Cover: [IngestionStage.SongInfo],
+    IngestionStage.Audio: [],
+    IngestionStage.Video: [],
+    IngestionStage.Subtitles: [],
+    IngestionStage.LineSync: [IngestionStage.SongInfo, IngestionStage.Subtitles, IngestionStage.Audio],
+    IngestionStage.WordSync: [IngestionStage.LineSync],
+}
+
+ARTIFACT_FILENAMES: dict[IngestionStage, str] = {
+    IngestionStage.SongInfo: "song_info.json",
+    IngestionStage.Subtitles: "subtitles.json",
+    IngestionStage.LineSync: "line_synced_lyrics.json",
+    IngestionStage.WordSync: "word_synced_lyrics.json",
+}
+
+subtitles_type_adapter = TypeAdapter(list[SyncedText])
+line_synced_type_adapter = TypeAdapter(list[SyncedLyricSegment])
+word_synced_type_adapter = TypeAdapter(list[SyncedLyricsSegmentWithWordLevelTimestamp])
+
+
+class IngestionCheckpoint(BaseModel):
+    key: str
+    input_hash: str
+    song_id: str = Field(default_factory=generate_id)
+    completed_stages: list[IngestionStage] = []
+
+    cover_image_stored: bool = False
+    audio_filename: str | None = None
+    video_filename: str | None = None
+    duration_seconds: float | None = None
+
+
+class SongIngestionPipeline:
+
+    def __init__(self, title: str, artist: str, reference_youtube_id: str,
+                 synchronizer: LyricSynchronizer,
+                 skip_genius: bool = False,
+                 override_description: str | None = None,
+                 override_lyrics: LyricsPackage | None = None) -> None:
+        self.title = title
+        self.artist = artist
+        self.reference_youtube_id = reference_youtube_id
+        self.synchronizer = synchronizer
+        self.skip_genius = skip_genius
+        self.override_description = override_description
+        self.override_lyrics = override_lyrics
+
+        self.key = f"{spinalcase(title)}_{spinalcase(artist)}_{reference_youtube_id}".lower()
+        self.checkpoint_path = ElmiConfig.get_ingestion_checkpoint_filepath(self.key)
+
+        self.checkpoint = self.__load_checkpoint() or IngestionCheckpoint(key=self.key, input_hash=self.__make_input_hash())
+
+        self.download_manager = MediaDownloadManager(on_progress=make_progress_printer(self.key))
+        self._media_info_task: asyncio.Task | None = None
+
+        self._stage_handlers: dict[IngestionStage, Callable[[], Awaitable[None]]] = {
+            IngestionStage.SongInfo: self._retrieve_song_info,
+            IngestionStage.Cover: self._retrieve_cover,
+            IngestionStage.Audio: self._retrieve_audio,
+            IngestionStage.Video: self._retrieve_video,
+            IngestionStage.Subtitles: self._retrieve_subtitles,
+            IngestionStage.LineSync: self._sync_lines,
+            IngestionStage.WordSync: self._sync_words,
+        }
+
+    def __make_input_hash(self) -> str:
+        inputs = dict(skip_genius=self.skip_genius,
+                      override_description=self.override_description,
+                      override_lyrics=[line.text_original for line in self.override_lyrics.lines] if self.override_lyrics is not None else None)
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def __load_checkpoint(self) -> IngestionCheckpoint | None:
+        if path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = IngestionCheckpoint.model_validate_json(f.read())
+            if checkpoint.input_hash == self.__make_input_hash():
+                return checkpoint
+            else:
+                print("Song ingestion inputs have changed. Discard the previous checkpoint.")
+        return None
+
+    def _save_checkpoint(self):
+        with open(self.checkpoint_path, 'w') as f:
+            f.write(self.checkpoint.model_dump_json(indent=2))
+
+    def reset(self):
+        self.checkpoint = IngestionCheckpoint(key=self.key, input_hash=self.__make_input_hash())
+        self._save_checkpoint()
+
+    @property
+    def song_id(self) -> str:
+        return self.checkpoint.song_id
+
+    def get_artifact_path(self, stage: IngestionStage) -> str:
+        return path.join(ElmiConfig.get_song_cache_dir(self.song_id), ARTIFACT_FILENAMES[stage])
+
+    def _write_artifact(self, stage: IngestionStage, data: bytes | str):
+        with open(self.get_artifact_path(stage), 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+
+    def _read_artifact(self, stage: IngestionStage) -> str:
+        with open(self.get_artifact_path(stage), 'r') as f:
+            return f.read()
+
+    def is_stage_completed(self, stage: IngestionStage) -> bool:
+        if stage not in self.checkpoint.completed_stages:
+            return False
+
+        # Make sure that the stage output still exists on the disk.
+        if stage in ARTIFACT_FILENAMES:
+            return path.exists(self.get_artifact_path(stage))
+        elif stage == IngestionStage.Audio:
+            return path.exists(path.join(ElmiConfig.get_song_dir(self.song_id), self.checkpoint.audio_filename))
+        elif stage == IngestionStage.Video:
+            return path.exists(path.join(ElmiConfig.get_song_dir(self.song_id), self.checkpoint.video_filename))
+        else:
+            return True
+
+    def _invalidate_dependents(self, stage: IngestionStage):
+        # Outputs derived from a stage being re-run are stale.
+        for dependent, dependencies in STAGE_DEPENDENCIES.items():
+            if stage in dependencies and dependent in self.checkpoint.completed_stages:
+                self.checkpoint.completed_stages.remove(dependent)
+                self._invalidate_dependents(dependent)
+
+    async def run(self):
+        print(f"Run song ingestion pipeline for {self.key} (song id: {self.song_id})...")
+        self._save_checkpoint()
+
+        tasks: dict[IngestionStage, asyncio.Task] = {}
+
+        async def run_stage(stage: IngestionStage):
+            await asyncio.gather(*[tasks[dependency] for dependency in STAGE_DEPENDENCIES[stage]])
+            if self.is_stage_completed(stage):
+                print(f"[Ingestion] Skip completed stage - {stage}")
+                return
+
+            print(f"[Ingestion] Start stage - {stage}")
+            self._invalidate_dependents(stage)
+            await self._stage_handlers[stage]()
+            if stage not in self.checkpoint.completed_stages:
+                self.checkpoint.completed_stages.append(stage)
+            self._save_checkpoint()
+            print(f"[Ingestion] Completed stage - {stage}")
+
+        for stage in STAGE_DEPENDENCIES:
+            tasks[stage] = asyncio.create_task(run_stage(stage))
+
+        # Let independent stages finish and checkpoint their work even if another stage fails.
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if len(errors) > 0:
+            raise errors[0]
+
+    # Stage results ===========================================================
+
+    def get_song_info(self) -> GeniusSongInfo:
+        return GeniusSongInfo.model_validate_json(self._read_artifact(IngestionStage.SongInfo))
+
+    def get_subtitles(self) -> list[SyncedText]:
+        return subtitles_type_adapter.validate_json(self._read_artifact(IngestionStage.Subtitles))
+
+    def get_line_synced_lyrics(self) -> list[SyncedLyricSegment]:
+        return line_synced_type_adapter.validate_json(self._read_artifact(IngestionStage.LineSync))
+
+    def get_word_synced_lyrics(self) -> list[SyncedLyricsSegmentWithWordLevelTimestamp]:
+        return word_synced_type_adapter.validate_json(self._read_artifact(IngestionStage.WordSync))
+
+    def get_audio_file_path(self) -> str:
+        return path.join(ElmiConfig.get_song_dir(self.song_id), self.checkpoint.audio_filename)
+
+    # Stage handlers ==========================================================
+
+    async def _retrieve_song_info(self):
+        if self.skip_genius is True:
+            song_info = GeniusSongInfo(id=0, title=self.title, artist_names=self.artist, song_art_image_thumbnail_url=None, song_art_image_url=None, lyrics=self.override_lyrics, description=self.override_description)
+        else:
+            song_info = await genius.retrieve_song_info(self.title, self.artist)
+
+        if self.override_lyrics is not None:
+            print("Override custom lyrics.")
+            song_info.lyrics = self.override_lyrics
+
+        if self.override_description is not None:
+            song_info.description = self.override_description
+
+        print("Reference Lyrics:")
+        print(song_info.lyrics)
+
+        self._write_artifact(IngestionStage.SongInfo, song_info.model_dump_json(indent=2))
+
+    async def _retrieve_cover(self):
+        song_info = self.get_song_info()
+        if song_info.song_art_image_url is not None:
+            print("Download cover image file...")
+            self.checkpoint.cover_image_stored = (await MediaManager.retrieve_song_image_file(self.song_id, song_info.song_art_image_url)) == True
+
+    async def _get_media_info(self) -> dict:
+        # Audio and video stages share a single metadata extraction.
+        if self._media_info_task is None:
+            self._media_info_task = asyncio.create_task(
+                asyncio.to_thread(self.download_manager.extract_info, MediaManager.get_youtube_url(self.reference_youtube_id)))
+        return await self._media_info_task
+
+    async def _retrieve_audio(self):
+        audio_filename = f"{spinalcase(self.title)}_{spinalcase(self.artist)}.mp3".lower()
+        await self.download_manager.download_audio(await self._get_media_info(), MediaManager.get_audio_download_path(self.song_id, audio_filename))
+        self.checkpoint.audio_filename = audio_filename
+        print(f"Saved audio file at {self.get_audio_file_path()}")
+
+        audio: AudioSegment = await asyncio.to_thread(AudioSegment.from_mp3, self.get_audio_file_path())
+        self.checkpoint.duration_seconds = audio.duration_seconds
+
+    async def _retrieve_video(self):
+        video_filename = f"{spinalcase(self.title)}_{spinalcase(self.artist)}.mp4".lower()
+        await self.download_manager.download_video(await self._get_media_info(), MediaManager.get_video_download_path(self.song_id, video_filename))
+        self.checkpoint.video_filename = video_filename
+        print(f"Saved video file at {MediaManager.get_video_download_path(self.song_id, video_filename)}")
+
+    async def _retrieve_subtitles(self):
+        segmented_lyrics = await asyncio.to_thread(self.synchronizer.retrieve_segment_timestamped_subtitles_from_youtube, self.reference_youtube_id)
+
+        print("Segmented lyrics from YouTube:")
+        print(segmented_lyrics)
+
+        self._write_artifact(IngestionStage.Subtitles, subtitles_type_adapter.dump_json(segmented_lyrics, indent=2))
+
+    async def _sync_lines(self):
+        line_synced_lyrics = await self.synchronizer.apply_line_level_timestamps(self.get_song_info().lyrics, self.get_subtitles(), self.checkpoint.duration_seconds)
+        print("Line-synced lyrics:")
+        print(line_synced_lyrics)
+
+        self._write_artifact(IngestionStage.LineSync, line_synced_type_adapter.dump_json(line_synced_lyrics, indent=2))
+
+    async def _sync_words(self):
+        word_synced_lyrics = await self.synchronizer.apply_word_level_timestamps(self.get_line_synced_lyrics(), self.get_audio_file_path())
+        word_synced_lyrics = self.synchronizer.split_multiline_lyrics(self.get_song_info().lyrics, word_synced_lyrics)
+
+        self._write_artifact(IngestionStage.WordSync, word_synced_type_adapter.dump_json(word_synced_lyrics, indent=2))
@@ -4,8 +4,7 @@ from math import ceil, floor
 import re
 from backend.database.models import Line, TimestampRangeMixin, Verse
 from .common import LyricLine, LyricsPackage
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel, TypeAdapter, validate_call
+from pydantic import BaseModel, TypeAdapter, ValidationError, validate_call
 from backend.utils.env_helper import get_env_variable, EnvironmentVariables
 import openai
 from openai.types.audio import Transcription
@@ -13,8 +12,11 @@ from youtube_transcript_api import YouTubeTranscriptApi
 from rapidfuzz import fuzz
 from pydub import AudioSegment
 from langchain_core.runnables import Runnable
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.prompts.chat import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.exceptions import OutputParserException
+from backend.tasks.model_routing import get_route_models
 
 import json
 
@@ -99,7 +101,7 @@ def find_subsequent_indices(lst: list, condition) -> tuple[int, int] | None:
 class BestMatchOutput(BaseModel):
     index: int
 
-async def find_best_match_llm(ref: str, candidates: list[str])->int:
+async def find_best_match_llm(ref: str, candidates: list[str], model: BaseChatModel | None = None)->int:
     prompt= ChatPromptTemplate.from_messages(
         [("system", """
 You are a helpful assistant that matches the reference lyrics with automatically-generated subtitles which may be dirty.
@@ -115,25 +117,28 @@ Yield a json object formatted as follows:
         ]
     )
 
-    model = ChatOpenAI(api_key=get_env_variable(EnvironmentVariables.OPENAI_API_KEY), 
-                                model_name="gpt-4o", 
-                                temperature=0, 
-                                max_tokens=256,
-                                model_kwargs=dict(
-                                    frequency_penalty=0, 
-                                    presence_penalty=0)
-                                )
-
-    chain = prompt | model | PydanticOutputParser(pydantic_object=BestMatchOutput)
-
-    result: BestMatchOutput = await chain.ainvoke({"ref": f"\"{ref}\"", "candidates": "\n".join([f"{i}: \"{c}\"" for i, c in enumerate(candidates)])})
-
-    return result.index
+    # An explicit model, e.g., an offline stand-in, is used alone. Otherwise a fast model picks, and the standard model when its answer is invalid.
+    models = [model] if model is not None else [m for m in get_route_models("best_match") if m is not None]
+    input = {"ref": f"\"{ref}\"", "candidates": "\n".join([f"{i}: \"{c}\"" for i, c in enumerate(candidates)])}
+
+    for i, model in enumerate(models):
+        chain = prompt | model | PydanticOutputParser(pydantic_object=BestMatchOutput)
+        try:
+            result: BestMatchOutput = await chain.ainvoke(input)
+            if -1 <= result.index < len(candidates) or i == len(models) - 1:
+                return result.index
+            print(f"Best match index {result.index} is out of {len(candidates)} candidates. Ask the fallback model.")
+        except (OutputParserException, ValidationError) as ex:
+            if i == len(models) - 1:
+                raise
+            print(f"Invalid best match output ({ex}). Ask the fallback model.")
 
 class LyricSynchronizer:
     
-    def __init__(self) -> None:
-        self.openai_client = openai.AsyncClient(api_key=get_env_variable(EnvironmentVariables.OPENAI_API_KEY))
+    def __init__(self, openai_client: openai.AsyncClient | None = None, chat_model: BaseChatModel | None = None) -> None:
+        # The clients can be replaced with offline stand-ins, e.g., for benchmarks.
+        self.openai_client = openai_client or openai.AsyncClient(api_key=get_env_variable(EnvironmentVariables.OPENAI_API_KEY))
+        self.chat_model = chat_model
 
     def retrieve_segment_timestamped_subtitles_from_youtube(self, youtube_id: str, expand_duration_millis: int = 1000) -> list[SyncedText]:
 
@@ -239,7 +244,7 @@ class LyricSynchronizer:
                 for i, (candidate1, candidate2) in enumerate(stitched_candidates):
                     normalized_candidates.append((candidate1.text + " " + candidate2.text, True, i))
                 
-                best_match_index = await find_best_match_llm(lyric_line.text, [c[0] for c in normalized_candidates])
+                best_match_index = await find_best_match_llm(lyric_line.text, [c[0] for c in normalized_candidates], self.chat_model)
                 print(f"Best match index for {lyric_line.text}, among {[c[0] for c in normalized_candidates]}: ", best_match_index)
                 if best_match_index >= 0:
                     best_match_normalized_candidate = normalized_candidates[best_match_index]
@@ -1,14 +1,131 @@
+import asyncio
+from copy import deepcopy
 from io import BytesIO
-import os
+from typing import Any, Callable
 import gdown
 from os import path
 from PIL import Image
+from pydantic import BaseModel
 from retry import retry
 
 from backend.config import ElmiConfig
-import httpx
+from backend.database.models import MediaType
+from backend.utils.http_client import get_http_client
 from yt_dlp import YoutubeDL
 
+
+class DownloadProgressEvent(BaseModel):
+    media_type: MediaType
+    status: str # "downloading" | "finished" | "error"
+    filename: str | None = None
+    downloaded_bytes: int | None = None
+    total_bytes: int | None = None
+    speed: float | None = None
+    eta: float | None = None
+
+    @property
+    def progress(self) -> float | None:
+        if self.downloaded_bytes is not None and self.total_bytes is not None and self.total_bytes > 0:
+            return self.downloaded_bytes / self.total_bytes
+        else:
+            return None
+
+
+DownloadProgressCallback = Callable[[DownloadProgressEvent], None]
+
+
+class MediaDownloadManager:
+
+    AUDIO_OPTIONS = {
+        "format": "bestaudio/best",
+        "postprocessors": [{
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "mp3",
+            "preferredquality": "192"
+        }]
+    }
+
+    VIDEO_OPTIONS = {
+        "format": "bv*[vcodec^=avc]",
+        'postprocessors': [{  # Add post-processor
+            'key': 'FFmpegVideoConvertor',
+            'preferedformat': 'mp4',  # Convert to mp4 after download
+        }],
+    }
+
+    def __init__(self, on_progress: DownloadProgressCallback | None = None,
+                 convert: bool = True,
+                 ydl_params: dict[str, Any] | None = None) -> None:
+        self.on_progress = on_progress
+        self.convert = convert
+        self.ydl_params = {
+            "quiet": True,
+            "continuedl": True, # Resume from the .part file left by the interrupted download.
+            "retries": 10,
+            **(ydl_params or {})
+        }
+
+    def extract_info(self, url: str) -> dict:
+        # Unprocessed info keeps the whole format list so that audio and video can select their own streams.
+        with YoutubeDL(self.ydl_params) as ydl:
+            return ydl.extract_info(url, download=False, process=False)
+
+    @retry(tries=3)
+    def download_stream(self, info: dict, media_type: MediaType, file_path: str):
+        options = self.AUDIO_OPTIONS if media_type == MediaType.Audio else self.VIDEO_OPTIONS
+
+        opts = {
+            **self.ydl_params,
+            "outtmpl": file_path,
+            "format": options["format"],
+            "postprocessors": options["postprocessors"] if self.convert else [],
+            "progress_hooks": [lambda d: self.__emit_progress(media_type, d)],
+        }
+
+        with YoutubeDL(opts) as ydl:
+            ydl.process_ie_result(deepcopy(info), download=True)
+
+    async def download_audio(self, info: dict, file_path: str):
+        await asyncio.to_thread(self.download_stream, info, MediaType.Audio, file_path)
+
+    async def download_video(self, info: dict, file_path: str):
+        await asyncio.to_thread(self.download_stream, info, MediaType.Video, file_path)
+
+    async def download_audio_and_video(self, url: str, audio_file_path: str, video_file_path: str):
+        info = await asyncio.to_thread(self.extract_info, url)
+        await asyncio.gather(
+            self.download_audio(info, audio_file_path),
+            self.download_video(info, video_file_path)
+        )
+
+    def __emit_progress(self, media_type: MediaType, d: dict):
+        if self.on_progress is not None:
+            self.on_progress(DownloadProgressEvent(
+                media_type=media_type,
+                status=d.get("status"),
+                filename=d.get("filename"),
+                downloaded_bytes=d.get("downloaded_bytes"),
+                total_bytes=d.get("total_bytes") or d.get("total_bytes_estimate"),
+                speed=d.get("speed"),
+                eta=d.get("eta")
+            ))
+
+
+def make_progress_printer(label: str, step: float = 0.1) -> DownloadProgressCallback:
+    last_printed: dict[MediaType, float] = {}
+
+    def print_progress(event: DownloadProgressEvent):
+        if event.status == "downloading":
+            progress = event.progress
+            if progress is not None and progress - last_printed.get(event.media_type, -1) >= step:
+                last_printed[event.media_type] = progress
+                print(f"[{label}] Downloading {event.media_type} - {round(progress * 100)}%")
+        else:
+            print(f"[{label}] {event.media_type} download {event.status} - {event.filename}")
+
+    return print_progress
+
+
 class MediaManager:
     @staticmethod
     def retrieve_song_from_gdrive(song_id: str, filename: str, gdrive_file_id: str):
@@ -16,57 +133,40 @@ class MediaManager:
         gdown.download(id=gdrive_file_id, output=file_path)
 
     @staticmethod
-    @retry(tries=3)
-    def retrieve_song_from_youtube(song_id: str, filename: str, youtube_id: str):
-        file_path = path.join(ElmiConfig.get_song_dir(song_id), filename.replace('.mp3', ''))
-        
-        if path.exists(file_path):
-            os.remove(file_path)
-        
-        opts = {
-            "outtmpl": file_path,
-            "format": "bestaudio/best",
-            "postprocessors": [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192"
-            }]
-        }
-        YoutubeDL(opts).download(f"https://www.youtube.com/watch?v={youtube_id}")
+    def get_youtube_url(youtube_id: str) -> str:
+        return f"https://www.youtube.com/watch?v={youtube_id}"
 
+    @staticmethod
+    def get_audio_download_path(song_id: str, filename: str) -> str:
+        # The audio extractor appends the .mp3 extension.
+        return path.join(ElmiConfig.get_song_dir(song_id), filename.replace('.mp3', ''))
 
     @staticmethod
-    @retry(tries=3)
-    def retrieve_video_from_youtube(song_id: str, filename: str, youtube_id: str):
-        file_path = path.join(ElmiConfig.get_song_dir(song_id), filename.replace('.mp3', ''))
-        if path.exists(file_path):
-            os.remove(file_path)
-        
-        opts = {
-            "outtmpl": file_path,
-            "format": "bv*[vcodec^=avc]",
-             'postprocessors': [{  # Add post-processor
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',  # Convert to mp4 after download
-            }],
-        }
-        YoutubeDL(opts).download(f"https://www.youtube.com/watch?v={youtube_id}")
+    def get_video_download_path(song_id: str, filename: str) -> str:
+        return path.join(ElmiConfig.get_song_dir(song_id), filename)
+
+    @staticmethod
+    async def retrieve_media_from_youtube(song_id: str, audio_filename: str, video_filename: str, youtube_id: str,
+                                          on_progress: DownloadProgressCallback | None = None):
+        manager = MediaDownloadManager(on_progress=on_progress or make_progress_printer(youtube_id))
+        await manager.download_audio_and_video(MediaManager.get_youtube_url(youtube_id),
+                                               MediaManager.get_audio_download_path(song_id, audio_filename),
+                                               MediaManager.get_video_download_path(song_id, video_filename))
 
     @staticmethod
     @retry(tries=3)
     async def retrieve_song_image_file(song_id: str, image_url: str) -> bool:
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(image_url)
-                if response.status_code == 200:
-                    file_path = ElmiConfig.get_song_cover_filepath(song_id)
-                    print(file_path)
-                    image = Image.open(BytesIO(response.content))
-                    print(image)
-                    image.convert("RGB").save(file_path, format="JPEG")
-                    return True
-                else:
-                    return False
+            response = await get_http_client().get(image_url)
+            if response.status_code == 200:
+                file_path = ElmiConfig.get_song_cover_filepath(song_id)
+                print(file_path)
+                image = Image.open(BytesIO(response.content))
+                print(image)
+                image.convert("RGB").save(file_path, format="JPEG")
+                return True
+            else:
+                return False
         except Exception as ex:
             print(ex)
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,56 @@
+from enum import StrEnum
+from functools import cache
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+
+from backend.utils.env_helper import EnvironmentVariables, get_env_variable
+
+
+class ModelTier(StrEnum):
+    Fast="fast"
+    Standard="standard"
+
+MODEL_NAMES: dict[ModelTier, str] = {
+    ModelTier.Fast: "gpt-4o-mini",
+    ModelTier.Standard: "gpt-4o",
+}
+
+
+class ModelRoute(BaseModel):
+    primary: ModelTier
+    # Takes over when the outputs of the primary model keep failing validation.
+    fallback: ModelTier | None = None
+    temperature: float = 1
+    max_tokens: int = 2048
+
+DEFAULT_MODEL_ROUTE = ModelRoute(primary=ModelTier.Standard)
+
+# Routes by pipeline name. Simple choices and summaries run on the fast model; the rest stays on the standard one.
+MODEL_ROUTES: dict[str, ModelRoute] = {
+    "intent_classifier": ModelRoute(primary=ModelTier.Fast, fallback=ModelTier.Standard, max_tokens=256),
+    "best_match": ModelRoute(primary=ModelTier.Fast, fallback=ModelTier.Standard, temperature=0, max_tokens=256),
+    "thread_summary": ModelRoute(primary=ModelTier.Fast, max_tokens=512),
+}
+
+def get_model_route(name: str) -> ModelRoute:
+    return MODEL_ROUTES.get(name, DEFAULT_MODEL_ROUTE)
+
+
+@cache
+def make_chat_model(tier: ModelTier, temperature: float = 1, max_tokens: int = 2048) -> BaseChatModel:
+    return ChatOpenAI(api_key=get_env_variable(EnvironmentVariables.OPENAI_API_KEY),
+                      model_name=MODEL_NAMES[tier],
+                      temperature=temperature,
+                      max_tokens=max_tokens,
+                      model_kwargs=dict(
+                          frequency_penalty=0,
+                          presence_penalty=0)
+                      )
+
+def get_route_models(name: str) -> tuple[BaseChatModel, BaseChatModel | None]:
+    route = get_model_route(name)
+    primary = make_chat_model(route.primary, route.temperature, route.max_tokens)
+    fallback = make_chat_model(route.fallback, route.temperature, route.max_tokens) if route.fallback is not None else None
+    return primary, fallback
@@ -1,17 +1,29 @@
+from contextlib import nullcontext
+import hashlib
+import json
 from time import perf_counter
 from backend.database.crud.project import fetch_line_annotation_by_line, fetch_line_translation_by_line
 from nanoid import generate
-from sqlmodel import select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import delete, select
 from sqlmodel.ext.asyncio.session import AsyncSession
-from langchain_core.runnables import RunnableParallel
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig, RunnableParallel
 import asyncio
-from more_itertools import sliced
+from pydantic import BaseModel
 
-from backend.database.models import AltGlossesInfo, CachedAltGlossGenerationResult, GlossDescription, Line, LineAnnotation, LineInspection, Project
+from backend.database.engine import db_sessionmaker
+from backend.tasks.chat.chat_context import chat_context_cache
+from backend.tasks.tracing import PipelineTracer
+from backend.utils.single_flight import SingleFlight
+from backend.database.models import AltGlossesInfo, CachedAltGlossGenerationResult, CachedSongInspectionResult, GlossDescription, InspectionSettings, Line, LineAnnotation, LineInspection, Project, ProjectConfiguration, Song
 from .base_gloss_generation import BaseGlossGenerationPipeline
-from .common import BaseGlossGenerationPipelineInputArgs, GlossGenerationResult, GlossLine, GlossOptionGenerationResult, InspectionPipelineInputArgs, PerformanceGuideGenerationResult, TranslatedLyricsPipelineInputArgs
+from .batch_planner import LineBatchPlanner, count_tokens
+from .common import BaseGlossGenerationPipelineInputArgs, GlossGenerationResult, GlossLine, GlossOptionElement, GlossOptionGenerationResult, InspectionElement, InspectionPipelineInputArgs, InspectionResult, PerformanceGuideElement, PerformanceGuideGenerationResult, PreprocessingStage, TranslatedLyricsPipelineInputArgs, get_affected_stages
+from .gloss_index import find_reusable_glosses
 from .gloss_option_generation import GlossOptionGenerationPipeline
 from .inspection import InspectionPipeline
+from .line_annotation_batcher import LineAnnotationBatcher
 from .performance_guide_generation import PerformanceGuideGenerationPipeline
 
 inspector = InspectionPipeline()
@@ -19,27 +31,32 @@ gloss_generator = BaseGlossGenerationPipeline()
 performance_guide_generator = PerformanceGuideGenerationPipeline()
 gloss_options_generator = GlossOptionGenerationPipeline()
 
+batch_planner = LineBatchPlanner()
 
-async def generate_alt_glosses_with_user_translation(project_id: str, db: AsyncSession, line_id: str, user_translation: str)->AltGlossesInfo | None:
 
-    project = await db.get(Project, project_id)
-    user_settings = project.safe_user_settings
+def use_chat_model(model: BaseChatModel | None):
+    # Rebuild the preprocessing chains on another chat model, e.g., an offline stand-in for benchmarks. None restores the default model.
+    global inspector, gloss_generator, performance_guide_generator, gloss_options_generator
+    inspector = InspectionPipeline(model)
+    gloss_generator = BaseGlossGenerationPipeline(model)
+    performance_guide_generator = PerformanceGuideGenerationPipeline(model)
+    gloss_options_generator = GlossOptionGenerationPipeline(model)
 
-    cache = (await db.exec(select(CachedAltGlossGenerationResult).where(
-            CachedAltGlossGenerationResult.project_id == project_id,
-            CachedAltGlossGenerationResult.line_id == line_id,
-            CachedAltGlossGenerationResult.base_gloss == user_translation,
-            CachedAltGlossGenerationResult.user_settings_hash == user_settings.make_hash()
-        ))).first()
-    
-    if cache is not None:
-        return cache
-    
 
-    line = await db.get(Line, line_id)
+# A request for alt glosses being generated attaches to the running generation instead of starting another.
+alt_gloss_generations: SingleFlight[AltGlossesInfo | None] = SingleFlight("alt_gloss_generation")
 
-    if user_translation is not None and len(user_translation) > 0:
-        
+async def _run_alt_gloss_generation(project_id: str, line_id: str, user_translation: str) -> AltGlossesInfo | None:
+    # Runs on its own session, as it may outlive the request that started it.
+    async with db_sessionmaker() as db:
+        project = await db.get(Project, project_id)
+        user_settings = project.safe_user_settings
+
+        cache = await fetch_cached_alt_glosses(db, project_id, line_id, user_translation, user_settings.make_hash())
+        if cache is not None:
+            return AltGlossesInfo.model_validate(cache.model_dump())
+
+        line = await db.get(Line, line_id)
 
         simulated_base_gloss_generation_result = GlossGenerationResult(translations=[GlossLine(line_id=line_id, gloss=user_translation, description="User-inserted translation")])
         translated_lyrics_input = TranslatedLyricsPipelineInputArgs(
@@ -62,146 +79,429 @@ async def generate_alt_glosses_with_user_translation(project_id: str, db: AsyncS
         db.add(result)
         await db.commit()
 
-        return result
+        return AltGlossesInfo.model_validate(result.model_dump())
+
+
+def _make_alt_gloss_work(project_id: str, line_id: str, user_translation: str):
+    return lambda: _run_alt_gloss_generation(project_id, line_id, user_translation)
+
+
+async def fetch_cached_alt_glosses(db: AsyncSession, project_id: str, line_id: str, user_translation: str, settings_hash: str) -> CachedAltGlossGenerationResult | None:
+    return (await db.exec(select(CachedAltGlossGenerationResult).where(
+            CachedAltGlossGenerationResult.project_id == project_id,
+            CachedAltGlossGenerationResult.line_id == line_id,
+            CachedAltGlossGenerationResult.base_gloss == user_translation,
+            CachedAltGlossGenerationResult.user_settings_hash == settings_hash
+        ))).first()
+
+
+async def generate_alt_glosses_with_user_translation(project_id: str, db: AsyncSession, line_id: str, user_translation: str)->AltGlossesInfo | None:
+
+    project = await db.get(Project, project_id)
+    settings_hash = project.safe_user_settings.make_hash()
+
+    cache = await fetch_cached_alt_glosses(db, project_id, line_id, user_translation, settings_hash)
+    if cache is not None:
+        return cache
+
+    if user_translation is not None and len(user_translation) > 0:
+        # Usually prefetched when the translation was saved.
+        return await alt_gloss_generations.run((project_id, line_id, user_translation, settings_hash), _make_alt_gloss_work(project_id, line_id, user_translation))
     else:
         return None
-                                
+
+
+def _report_prefetch_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Alt gloss prefetch failed - {type(task.exception()).__name__}: {task.exception()}")
+
+def prefetch_alt_glosses(project_id: str, line_id: str, user_translation: str | None, settings_hash: str):
+    # Speculatively generates the alt glosses of a saved translation in the background, so that the request for them hits the cache.
+    if user_translation is None or len(user_translation) == 0:
+        return
+    alt_gloss_generations.start((project_id, line_id, user_translation, settings_hash),
+                                _make_alt_gloss_work(project_id, line_id, user_translation)).add_done_callback(_report_prefetch_failure)
+
+def make_line_annotation(project_id: str, processing_id: str, base_gloss: GlossLine, performance_guide: PerformanceGuideElement, gloss_options: GlossOptionElement) -> LineAnnotation:
+    return LineAnnotation( project_id=project_id, 
+                            processing_id=processing_id,
+                            line_id=base_gloss.line_id, 
+                            gloss=base_gloss.gloss,
+                            gloss_description=base_gloss.description,
+                            gloss_alts=[
+                                GlossDescription(gloss=gloss_options.gloss_short_ver, description=gloss_options.gloss_description_short_ver).model_dump(),
+                                GlossDescription(gloss=gloss_options.gloss_long_ver, description=gloss_options.gloss_description_long_ver).model_dump()
+                            ],
+                            **performance_guide.model_dump(exclude={"line_id"})
+                        )
+
+
+async def _run_line_annotation_batch(project: Project, lines: list[Line], user_translations: list[str], user_settings: ProjectConfiguration) -> list[LineAnnotation]:
+    simulated_base_gloss_generation_result = GlossGenerationResult(translations=[GlossLine(line_id=line.id, gloss=user_translation, description="User-inserted translation")
+                                                                                 for line, user_translation in zip(lines, user_translations)])
+    translated_lyrics_input = TranslatedLyricsPipelineInputArgs(
+                    song_info=project.song,
+                    configuration=user_settings,
+                    lyric_lines=lines,
+                    gloss_generations=simulated_base_gloss_generation_result
+                )
+    
+    combined_result = await RunnableParallel(
+                    performance_guides = performance_guide_generator.chain, 
+                    gloss_options = gloss_options_generator.chain).ainvoke(translated_lyrics_input)
+    
+    performance_guide_result: PerformanceGuideGenerationResult = combined_result["performance_guides"]
+    gloss_option_generation_result: GlossOptionGenerationResult = combined_result["gloss_options"]
+
+    annotations: list[LineAnnotation] = []
+    for base_gloss, performance_guide, gloss_options in zip(simulated_base_gloss_generation_result.translations, performance_guide_result.guides, gloss_option_generation_result.options):
+        assert base_gloss.line_id == performance_guide.line_id == gloss_options.line_id
+        annotations.append(make_line_annotation(project.id, "", base_gloss, performance_guide, gloss_options))
+    return annotations
+
+# Requests for the same line and gloss share one generation, and the generations of a project within a short window share one batch.
+line_annotation_generations: SingleFlight[LineAnnotation] = SingleFlight("line_annotation_generation")
+line_annotation_batcher = LineAnnotationBatcher(_run_line_annotation_batch)
+
 async def generate_line_annotation_with_user_translation(project_id: str, db:AsyncSession, line_id: str) -> LineAnnotation | None:
         project = await db.get(Project, project_id)
         user_settings = project.safe_user_settings
-        line, user_translation = await asyncio.gather(
-            db.get(Line, line_id),
-            fetch_line_translation_by_line(db, project_id, line_id)
-            )
+        # A session does not run queries concurrently.
+        line = await db.get(Line, line_id)
+        user_translation = await fetch_line_translation_by_line(db, project_id, line_id)
         
         if user_translation is not None and user_translation.gloss is not None and len(user_translation.gloss) > 0:
             existing_annotation = await fetch_line_annotation_by_line(db, project_id, line_id)
             if existing_annotation is None or existing_annotation.gloss != user_translation.gloss:
+                return await line_annotation_generations.run((project_id, line_id, user_translation.gloss, user_settings.make_hash()),
+                                                             lambda: line_annotation_batcher.request(project, line, user_translation.gloss, user_settings))
 
-                simulated_base_gloss_generation_result = GlossGenerationResult(translations=[GlossLine(line_id=line_id, gloss=user_translation.gloss, description="User-inserted translation")])
-                translated_lyrics_input = TranslatedLyricsPipelineInputArgs(
-                                song_info=project.song,
-                                configuration=user_settings,
-                                lyric_lines=[line],
-                                gloss_generations=simulated_base_gloss_generation_result
-                            )
-                
-                combined_result = await RunnableParallel(
-                                performance_guides = performance_guide_generator.chain, 
-                                gloss_options = gloss_options_generator.chain).ainvoke(translated_lyrics_input)
-                
-                performance_guide_result: PerformanceGuideGenerationResult = combined_result["performance_guides"]
-                gloss_option_generation_result: GlossOptionGenerationResult = combined_result["gloss_options"]
+        return None
 
-                base_gloss, performance_guide, gloss_options = simulated_base_gloss_generation_result.translations[0], performance_guide_result.guides[0], gloss_option_generation_result.options[0]
-                assert base_gloss.line_id == performance_guide.line_id == gloss_options.line_id
-                annotation = LineAnnotation( project_id=project.id, 
-                                        processing_id="",
-                                        line_id=base_gloss.line_id, 
-                                        gloss=base_gloss.gloss,
-                                        gloss_description=base_gloss.description,
-                                        gloss_alts=[
-                                            GlossDescription(gloss=gloss_options.gloss_short_ver, description=gloss_options.gloss_description_short_ver).model_dump(),
-                                            GlossDescription(gloss=gloss_options.gloss_long_ver, description=gloss_options.gloss_description_long_ver).model_dump()
-                                            ],
-                                        **performance_guide.model_dump(exclude={"line_id"})
-                                )
-                print(annotation)
-                return annotation
 
-        return None
+class SongPreprocessingResult(BaseModel):
+    inspections: list[InspectionElement] = []
+    translations: list[GlossLine] = []
+    guides: list[PerformanceGuideElement] = []
+    options: list[GlossOptionElement] = []
 
+    def covers(self, lines: list[Line]) -> bool:
+        # Inspections are left out, as lines without challenges have none.
+        return all(set([line.id for line in lines]) <= set([e.line_id for e in elements]) for elements in [self.translations, self.guides, self.options])
 
-async def preprocess_song(project_id: str, db: AsyncSession, force: bool = True):
-    async with db.begin_nested():
-        project = await db.get(Project, project_id)
-        if project is not None:
+    def select_lines(self, lines: list[Line]) -> "SongPreprocessingResult":
+        # The elements of the lines, in the order of the lines.
+        line_ids = set([line.id for line in lines])
+        translations, guides, options = [{e.line_id: e for e in elements} for elements in [self.translations, self.guides, self.options]]
+        return SongPreprocessingResult(inspections=[inspection for inspection in self.inspections if inspection.line_id in line_ids],
+                                       translations=[translations[line.id] for line in lines],
+                                       guides=[guides[line.id] for line in lines],
+                                       options=[options[line.id] for line in lines])
 
-            if project.last_processing_id is None or force is True:
-                # Clear previuse annotations and inspections
-                await db.exec(delete(LineAnnotation).where(LineAnnotation.project_id == project_id))
-                await db.exec(delete(LineInspection).where(LineInspection.project_id == project_id))
-                await db.refresh(project)
 
-                processing_id = generate(size=8)
+def load_song_preprocessing_result(project: Project) -> SongPreprocessingResult:
+    # The current version of the stored inspections and annotations of a project.
+    annotations = project.latest_annotations
+    return SongPreprocessingResult(
+        inspections=[InspectionElement(line_id=inspection.line_id, challenges=inspection.challenges, description=inspection.description) for inspection in project.latest_inspections],
+        translations=[GlossLine(line_id=a.line_id, gloss=a.gloss, description=a.gloss_description or "") for a in annotations],
+        guides=[PerformanceGuideElement(line_id=a.line_id, mood=a.mood, facial_expression=a.facial_expression, body_gesture=a.body_gesture,
+                                        emotion_description=a.emotion_description) for a in annotations],
+        options=[GlossOptionElement(line_id=a.line_id,
+                                    gloss_short_ver=GlossDescription.model_validate(a.gloss_alts[0]).gloss,
+                                    gloss_description_short_ver=GlossDescription.model_validate(a.gloss_alts[0]).description,
+                                    gloss_long_ver=GlossDescription.model_validate(a.gloss_alts[1]).gloss,
+                                    gloss_description_long_ver=GlossDescription.model_validate(a.gloss_alts[1]).description)
+                 for a in annotations if len(a.gloss_alts) >= 2])
 
-                user_settings = project.safe_user_settings
 
-                #lines = [line for verse in project.song.verses for line in verse.lines]
+def make_line_batches(song: Song) -> list[list[Line]]:
+    line_batches, plan = batch_planner.plan([verse.lines for verse in song.verses])
 
-                line_batches: list[list[Line]] = []
-                
-                if len(project.song.verses) > 1:
-                    for verse_i, verse in enumerate(project.song.verses):
-                        if len(verse.lines) > 12:
-                            verse_batches = list(sliced([line for line in verse.lines], n=8))
-                            line_batches.extend(verse_batches)
-                        elif len(verse.lines) > 0:
-                            line_batches.append(verse.lines)
-                else:
-                    line_batches = list(sliced([line for verse in project.song.verses for line in verse.lines], n=10))
+    system_prompt_tokens = sum([count_tokens(pipeline.system_instruction) for pipeline in [inspector, gloss_generator, performance_guide_generator, gloss_options_generator]])
+    print(f"Line batch plan for \"{song.title}\" - {plan.describe()}")
+    print(f"  System prompts add ~{system_prompt_tokens * len(line_batches)} prompt tokens over all chains.")
 
-                print(line_batches)
+    return line_batches
 
-                async def batch_analysis(lines: list[Line], batch_id: int):
 
-                    print(f"[Batch {batch_id}] Inspecting lyrics to note potential challenges...")
+def make_song_lyrics_hash(song: Song) -> str:
+    content = [song.description] + [[line.id, line.lyric] for verse in song.verses for line in verse.lines]
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
 
-                    inspection_input = InspectionPipelineInputArgs(lyric_lines=lines, song_info=project.song, configuration=user_settings)
-                    inspection_result = await inspector.run(InspectionPipelineInputArgs(lyric_lines=lines, song_info=project.song, configuration=user_settings))
 
-                    print(f"[Batch {batch_id}] Inspection complete.")
+async def _run_song_inspection(song: Song, inspection_settings: InspectionSettings, line_batches: list[list[Line]], tracer: PipelineTracer, budget: asyncio.Semaphore | None = None) -> list[InspectionElement]:
 
-                    for inspection in inspection_result.inspections:
-                        db.add(
-                            LineInspection(project_id=project.id, processing_id=processing_id, **inspection.__dict__)
-                        )
+    async def batch_inspection(lines: list[Line], batch_id: int) -> list[InspectionElement]:
+        async with budget or nullcontext(), tracer.span("inspection_batch", batch_id=batch_id, lines=len(lines)) as span:
+            print(f"[Batch {batch_id}] Inspecting lyrics to note potential challenges...")
+            inspection_result = await inspector.run(InspectionPipelineInputArgs(lyric_lines=lines, song_info=song, configuration=inspection_settings),
+                                                    {"callbacks": [tracer.make_callback_handler(span, batch_id)]})
+            print(f"[Batch {batch_id}] Inspection complete.")
+            return inspection_result.inspections
+
+    batch_results = await asyncio.gather(*[batch_inspection(batch, i) for i, batch in enumerate(line_batches)])
+    return [inspection for inspections in batch_results for inspection in inspections]
+
+
+# Concurrent preprocessing of the same song runs the inspection once.
+song_inspections: SingleFlight[list[InspectionElement]] = SingleFlight("song_inspection")
+
+async def inspect_song(song: Song, user_settings: ProjectConfiguration, db: AsyncSession, tracer: PipelineTracer, budget: asyncio.Semaphore | None = None,
+                       line_batches: list[list[Line]] | None = None) -> list[InspectionElement]:
+    inspection_settings = user_settings.to_inspection_settings()
+    lyrics_hash = make_song_lyrics_hash(song)
+    settings_hash = inspection_settings.make_hash()
+
+    cache = (await db.exec(select(CachedSongInspectionResult).where(
+            CachedSongInspectionResult.song_id == song.id,
+            CachedSongInspectionResult.lyrics_hash == lyrics_hash,
+            CachedSongInspectionResult.settings_hash == settings_hash
+        ))).first()
+
+    if cache is not None:
+        print(f"Reuse song inspection of {song.title}.")
+        return [InspectionElement.model_validate(inspection) for inspection in cache.inspections]
+
+    key = (song.id, lyrics_hash, settings_hash)
+    # Only the caller starting the inspection stores its cache entry.
+    is_first = not song_inspections.in_flight(key)
+    inspections = await song_inspections.run(key, lambda: _run_song_inspection(song, inspection_settings, line_batches or make_line_batches(song), tracer, budget))
+    if not is_first:
+        return inspections
+
+    # The key is released before the caller commits, so a caller arriving in between runs the inspection again.
+    # The entry the first of them commits is kept, instead of the other one failing on the unique constraint.
+    cache = CachedSongInspectionResult(song_id=song.id, lyrics_hash=lyrics_hash, settings_hash=settings_hash,
+                                       inspections=[inspection.model_dump() for inspection in inspections])
+    await db.exec(sqlite_insert(CachedSongInspectionResult).values(**cache.model_dump(exclude={"created_at", "updated_at"}))
+                  .on_conflict_do_nothing(index_elements=["song_id", "lyrics_hash", "settings_hash"]))
+    return inspections
+
+
+async def analyze_song(song: Song, user_settings: ProjectConfiguration, db: AsyncSession, tracer: PipelineTracer, budget: asyncio.Semaphore | None = None,
+                       previous: SongPreprocessingResult | None = None, stages: set[PreprocessingStage] | None = None) -> SongPreprocessingResult:
+    # The result depends only on the song and the user settings, so it can be shared by projects with identical settings.
+    # When given, the budget bounds the number of line batches analyzed at once across every song sharing it.
+    # The song inspection is inserted in the session as a cache entry; the caller commits it.
+    # With a previous result covering the song, only the given stages run and the outputs of the others are reused.
+    stages = set(PreprocessingStage) if previous is None or stages is None else stages
+    line_batches = make_line_batches(song)
+
+    if PreprocessingStage.Inspection in stages:
+        async with tracer.span("inspection", song_id=song.id, batches=len(line_batches)):
+            song_inspections = await inspect_song(song, user_settings, db, tracer, budget, line_batches)
+    else:
+        song_inspections = previous.inspections
+
+    async def batch_analysis(lines: list[Line], batch_id: int) -> SongPreprocessingResult:
+        async with budget or nullcontext(), tracer.span("annotation_batch", batch_id=batch_id, lines=len(lines)) as span:
+            config: RunnableConfig = {"callbacks": [tracer.make_callback_handler(span, batch_id)]}
+            previous_batch = previous.select_lines(lines) if previous is not None else None
+
+            if PreprocessingStage.BaseGloss in stages:
+                # Lines matching a line with an accepted gloss, e.g., a repeated chorus, take that gloss instead of being sent to the LLM.
+                reused_glosses = find_reusable_glosses(lines, user_settings)
+                span.metadata_json = {**(span.metadata_json or {}), "reused_glosses": len(reused_glosses)}
+                lines_to_translate = [line for line in lines if line.id not in reused_glosses]
+                generated_glosses: list[GlossLine] = []
+
+                if len(lines_to_translate) > 0:
+                    line_ids = set([line.id for line in lines_to_translate])
+                    inspection_input = InspectionPipelineInputArgs(lyric_lines=lines_to_translate, song_info=song, configuration=user_settings)
+                    inspection_result = InspectionResult(inspections=[inspection for inspection in song_inspections if inspection.line_id in line_ids])
 
-                    print(f"[Batch {batch_id}] Generating base gloss...")
-                    
-                    base_gloss_generation_result = await gloss_generator.run(BaseGlossGenerationPipelineInputArgs(**inspection_input.__dict__, inspection_result=inspection_result))
+                    print(f"[Batch {batch_id}] Generating base gloss of {len(lines_to_translate)} lines, reusing accepted glosses of {len(reused_glosses)}...")
+
+                    generated_glosses = (await gloss_generator.run(BaseGlossGenerationPipelineInputArgs(**inspection_input.__dict__, inspection_result=inspection_result), config)).translations
 
                     print(f"[Batch {batch_id}] Generated base gloss.")
+                else:
+                    print(f"[Batch {batch_id}] Reused accepted glosses of every line.")
+
+                glosses = {**{gloss.line_id: gloss for gloss in generated_glosses}, **reused_glosses}
+                base_gloss_generation_result = GlossGenerationResult(translations=[glosses[line.id] for line in lines])
+            else:
+                base_gloss_generation_result = GlossGenerationResult(translations=previous_batch.translations)
+
+            translated_lyrics_input = TranslatedLyricsPipelineInputArgs(
+                song_info=song,
+                configuration=user_settings,
+                lyric_lines=lines,
+                gloss_generations=base_gloss_generation_result
+            )
 
-                    translated_lyrics_input = TranslatedLyricsPipelineInputArgs(
-                        song_info=project.song,
-                        configuration=user_settings,
-                        lyric_lines=lines,
-                        gloss_generations=base_gloss_generation_result
-                    )
-
-                    print(f"[Batch {batch_id}] Generating performance guides and alternative glosses...")
-
-                    combined_result = await RunnableParallel(
-                        performance_guides = performance_guide_generator.chain, 
-                        gloss_options = gloss_options_generator.chain).ainvoke(translated_lyrics_input)
-
-                    performance_guide_result: PerformanceGuideGenerationResult = combined_result["performance_guides"]
-                    gloss_option_generation_result: GlossOptionGenerationResult = combined_result["gloss_options"]
-
-                    for base_gloss, performance_guide, gloss_options in zip(base_gloss_generation_result.translations, performance_guide_result.guides, gloss_option_generation_result.options):
-                        assert base_gloss.line_id == performance_guide.line_id == gloss_options.line_id
-
-                        db.add(
-                            LineAnnotation( project_id=project.id, 
-                                            processing_id=processing_id,
-                                            line_id=base_gloss.line_id, 
-                                            gloss=base_gloss.gloss,
-                                            gloss_description=base_gloss.description,
-                                            gloss_alts=[
-                                                GlossDescription(gloss=gloss_options.gloss_short_ver, description=gloss_options.gloss_description_short_ver).model_dump(),
-                                                GlossDescription(gloss=gloss_options.gloss_long_ver, description=gloss_options.gloss_description_long_ver).model_dump()
-                                            ],
-                                            **performance_guide.model_dump(exclude={"line_id"})
-                                        )
-                        )
-                    print(f"[Batch {batch_id}] Preprocessing complete.")
-                
-                ts = perf_counter()
-                await asyncio.gather(*[batch_analysis(batch, i) for i, batch in enumerate(line_batches)])
-                te = perf_counter()
-
-                print(f"Preprocessing complete - {te-ts} sec.")
-                project.last_processing_id = processing_id
-                db.add(project)
-                await db.commit()
\ No newline at end of file
+            chains = {}
+            if PreprocessingStage.PerformanceGuide in stages:
+                chains["performance_guides"] = performance_guide_generator.chain
+            if PreprocessingStage.GlossOptions in stages:
+                chains["gloss_options"] = gloss_options_generator.chain
+
+            if len(chains) > 0:
+                print(f"[Batch {batch_id}] Generating {' and '.join(chains.keys())}...")
+                combined_result = await RunnableParallel(**chains).ainvoke(translated_lyrics_input, config)
+            else:
+                combined_result = {}
+
+            performance_guide_result: PerformanceGuideGenerationResult = combined_result.get("performance_guides") or PerformanceGuideGenerationResult(guides=previous_batch.guides)
+            gloss_option_generation_result: GlossOptionGenerationResult = combined_result.get("gloss_options") or GlossOptionGenerationResult(options=previous_batch.options)
+
+            for base_gloss, performance_guide, gloss_options in zip(base_gloss_generation_result.translations, performance_guide_result.guides, gloss_option_generation_result.options):
+                assert base_gloss.line_id == performance_guide.line_id == gloss_options.line_id
+
+            print(f"[Batch {batch_id}] Preprocessing complete.")
+
+            return SongPreprocessingResult(translations=base_gloss_generation_result.translations,
+                                           guides=performance_guide_result.guides,
+                                           options=gloss_option_generation_result.options)
+
+    batch_results = await asyncio.gather(*[batch_analysis(batch, i) for i, batch in enumerate(line_batches)])
+
+    result = SongPreprocessingResult(inspections=song_inspections)
+    for batch_result in batch_results:
+        result.translations.extend(batch_result.translations)
+        result.guides.extend(batch_result.guides)
+        result.options.extend(batch_result.options)
+    return result
+
+
+def generate_processing_id() -> str:
+    return generate(size=8)
+
+
+async def store_song_preprocessing_result(project: Project, result: SongPreprocessingResult, db: AsyncSession, processing_id: str | None = None) -> str:
+    # The stored rows form a full new version, including the outputs carried over from the previous one.
+    # Only the previous version is kept besides it, as the project loads the rows of every version it holds.
+    processing_id = processing_id or generate_processing_id()
+    kept_processing_ids = [id for id in [processing_id, project.last_processing_id] if id is not None]
+    # The loaded collections of the project are left as they are, like for the added rows, until it is refreshed.
+    for model in [LineInspection, LineAnnotation]:
+        await db.exec(delete(model).where(model.project_id == project.id, model.processing_id.not_in(kept_processing_ids))
+                      .execution_options(synchronize_session=False))
+
+    for inspection in result.inspections:
+        db.add(
+            LineInspection(project_id=project.id, processing_id=processing_id, **inspection.__dict__)
+        )
+
+    for base_gloss, performance_guide, gloss_options in zip(result.translations, result.guides, result.options):
+        db.add(make_line_annotation(project.id, processing_id, base_gloss, performance_guide, gloss_options))
+
+    project.last_processing_id = processing_id
+    db.add(project)
+    return processing_id
+
+
+async def preprocess_song(project_id: str, db: AsyncSession, force: bool = True):
+    tracer: PipelineTracer | None = None
+    try:
+        async with db.begin_nested():
+            project = await db.get(Project, project_id)
+            if project is not None:
+
+                if project.last_processing_id is None or force is True:
+                    processing_id = generate_processing_id()
+                    tracer = PipelineTracer(processing_id, project.id)
+
+                    ts = perf_counter()
+                    async with tracer.span("preprocessing", song_id=project.song_id):
+                        result = await analyze_song(project.song, project.safe_user_settings, db, tracer)
+                    te = perf_counter()
+
+                    print(f"Preprocessing complete - {te-ts} sec. ({tracer.summarize()})")
+                    await store_song_preprocessing_result(project, result, db, processing_id)
+                    await db.commit()
+                    chat_context_cache.invalidate(project_id)
+    except Exception:
+        # Ends the transaction holding the database, for the spans to be stored on another session.
+        await db.rollback()
+        raise
+    finally:
+        if tracer is not None:
+            await tracer.store()
+
+
+async def reprocess_song(project_id: str, db: AsyncSession, previous_settings: ProjectConfiguration) -> set[PreprocessingStage]:
+    # After a settings change, re-runs only the stages reading the changed settings and those downstream of them.
+    tracer: PipelineTracer | None = None
+    try:
+        async with db.begin_nested():
+            project = await db.get(Project, project_id)
+            if project is None:
+                return set()
+
+            user_settings = project.safe_user_settings
+            stages = get_affected_stages(previous_settings, user_settings)
+            previous = load_song_preprocessing_result(project)
+            if project.last_processing_id is None or not previous.covers([line for verse in project.song.verses for line in verse.lines]):
+                previous, stages = None, set(PreprocessingStage)
+            elif len(stages) == 0:
+                return stages
+
+            processing_id = generate_processing_id()
+            tracer = PipelineTracer(processing_id, project.id)
+
+            ts = perf_counter()
+            async with tracer.span("reprocessing", song_id=project.song_id, stages=sorted(stages)):
+                result = await analyze_song(project.song, user_settings, db, tracer, previous=previous, stages=stages)
+            te = perf_counter()
+
+            print(f"Reprocessing of {', '.join(sorted(stages))} complete - {te-ts} sec. ({tracer.summarize()})")
+            await store_song_preprocessing_result(project, result, db, processing_id)
+            await db.commit()
+            chat_context_cache.invalidate(project_id)
+            return stages
+    except Exception:
+        # Ends the transaction holding the database, for the spans to be stored on another session.
+        await db.rollback()
+        raise
+    finally:
+        if tracer is not None:
+            await tracer.store()
+
+
+class ProjectReprocessing:
+    # A reprocessing running in the background, with the settings the stored version it starts from was made with.
+    def __init__(self, previous_settings: ProjectConfiguration) -> None:
+        self.previous_settings = previous_settings
+        self.task: asyncio.Task[set[PreprocessingStage]] | None = None
+
+    def failed(self) -> bool:
+        return self.task.done() and (self.task.cancelled() or self.task.exception() is not None)
+
+# The last reprocessing of each project, kept after it failed, as the stored version is still made from its previous settings.
+project_reprocessings: dict[str, ProjectReprocessing] = {}
+
+def _report_reprocess_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Reprocessing failed - {type(task.exception()).__name__}: {task.exception()}")
+
+def start_reprocess_song(project_id: str, previous_settings: ProjectConfiguration) -> asyncio.Task[set[PreprocessingStage]]:
+    # Reprocesses in the background on a session of its own, as the stages may take long to run again.
+    # A change arriving during a reprocessing runs after it instead of joining it, so that it is not missed.
+    # If the one before fails, its changes are still unprocessed, so the next one starts from the settings it started from.
+    before = project_reprocessings.get(project_id)
+    reprocessing = ProjectReprocessing(previous_settings)
+
+    async def work() -> set[PreprocessingStage]:
+        if before is not None:
+            await asyncio.wait([before.task])
+            if before.failed():
+                reprocessing.previous_settings = before.previous_settings
+        async with db_sessionmaker() as db:
+            return await reprocess_song(project_id, db, reprocessing.previous_settings)
+
+    reprocessing.task = asyncio.create_task(work())
+    project_reprocessings[project_id] = reprocessing
+
+    def on_done(task: asyncio.Task):
+        if project_reprocessings.get(project_id) is reprocessing and not reprocessing.failed():
+            project_reprocessings.pop(project_id)
+    reprocessing.task.add_done_callback(on_done)
+    reprocessing.task.add_done_callback(_report_reprocess_failure)
+    return reprocessing.task
+
+async def join_reprocessings():
+    # Waits for the reprocessings in flight, e.g., on shutdown.
+    while any(not reprocessing.task.done() for reprocessing in project_reprocessings.values()):
+        await asyncio.gather(*[reprocessing.task for reprocessing in project_reprocessings.values()], return_exceptions=True)
@@ -1,18 +1,20 @@
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.runnables import RunnableConfig
 
 from backend.database.models import LineInfo
-from backend.tasks.chain_mapper import ChainMapper
-from backend.tasks.preprocessing.common import BaseGlossGenerationPipelineInputArgs, BaseInspectionElement, BasePipelineInput, GlossGenerationResult, InputLyricLine
+from backend.tasks.chain_mapper import LineLevelChainMapper
+from backend.tasks.preprocessing.common import BaseGlossGenerationPipelineInputArgs, BaseGlossSettings, BaseInspectionElement, BasePipelineInput, GlossGenerationResult, GlossLine, InputLyricLine, InspectionResult
 
 class InputLyricLineWithInspection(InputLyricLine):
     note: BaseInspectionElement | None = None
 
 class GlossGenerationPromptInputArgs(BasePipelineInput):
+    user_settings: BaseGlossSettings
     lyrics: list[InputLyricLineWithInspection]
 
-class BaseGlossGenerationPipeline(ChainMapper[BaseGlossGenerationPipelineInputArgs, GlossGenerationResult]):
+class BaseGlossGenerationPipeline(LineLevelChainMapper[BaseGlossGenerationPipelineInputArgs, GlossGenerationResult, GlossLine]):
 
-    def __init__(self) -> None:
+    def __init__(self, model: BaseChatModel | None = None) -> None:
         super().__init__(
             "BaseGlossGeneration", GlossGenerationResult, '''
   You are a helpful assistant that helps user to translate ENG lyrics into sign language.
@@ -36,24 +38,8 @@ class BaseGlossGenerationPipeline(ChainMapper[BaseGlossGenerationPipelineInputAr
     - Professional: Use advanced terminology and detailed descriptions, assuming high proficiency in the language.
     - Moderate: Include common terms and moderately complex structures, providing some explanations for less common signs.
     - Novice: Use basic vocabulary and simple sentence structures, providing detailed explanations and context for each sign.
-   5. Speed of Signing
-    - Slow: Generate gloss with clear, spaced-out instructions, suitable for learners who need more time to process each sign.
-    - Moderate: Create gloss that balances clarity with fluidity, appropriate for users with some experience.
-    - Fast: Focus on natural speed and flow, suitable for advanced users who can keep up with rapid signing.
-   6. Emotional Level
-    - Simple: Keep emotional expressions straightforward, using basic facial expressions and body language.
-    - Moderate: Include a range of emotional expressions with more nuanced NMS.
-    - Complex: Integrate intricate emotional expressions and detailed body language to convey complex emotions.
-   7. Use of Body Language (NMS) *NMS should be described in parenthesis "()" 
-    - NotUsed: Do not use NMS, only provide the signs.
-    - Moderate: Use a balanced amount of NMS to enhance meaning without overwhelming the user.
-    - Rich: Incorporate extensive NMS to convey richer meaning and context.
-   8. Use of Classifiers *Classifiers should be described in "(CL: )"
-    - NotUsed: Do not incorporate classifiers, focusing on standard signs.
-    - Moderate: Use classifiers where necessary to enhance understanding.
-    - Rich: Integrate classifiers frequently to convey detailed and complex concepts efficiently.
 
-  
+  The signing speed and classifiers are applied in the gloss options, and the emotions and NMS in the performance guide, so leave them out of these glosses.
 
 [Input format]
   - The user will provide a JSON object formatted as follows:
@@ -81,34 +67,54 @@ class BaseGlossGenerationPipeline(ChainMapper[BaseGlossGenerationPipelineInputAr
         "gloss": string // gloss labels for the line of lyrics. Refer to user preference above.
         "description": string // description on you rationale of why you created this line of gloss. Show that you considered the user settings.
     }}> // The translations must be provided for all lyric lines.
-  }}''')
+  }}''', model)
 
     @classmethod
     def _postprocess_output(cls, output: GlossGenerationResult, config: RunnableConfig) -> GlossGenerationResult:
         lyric_lines : list[LineInfo] = config["metadata"]["lyric_lines"]
+        output.translations = cls._map_line_indices(output.translations, lyric_lines)
+        return output
 
-        for translation in output.translations:
-            translation.line_id = lyric_lines[int(translation.line_id)].id # Replace number index into unique id.
+    @classmethod
+    def _is_valid_element(cls, element: GlossLine) -> bool:
+        return len(element.gloss.strip()) > 0
 
-        assert len(lyric_lines) == len(output.translations)
-        assert all(l.id == g.line_id for l, g in zip(lyric_lines, output.translations))
+    @classmethod
+    def _get_input_lines(cls, input: BaseGlossGenerationPipelineInputArgs) -> list[LineInfo]:
+        return input.lyric_lines
 
-        return output
+    @classmethod
+    def _make_partial_input(cls, input: BaseGlossGenerationPipelineInputArgs, line_ids: set[str]) -> BaseGlossGenerationPipelineInputArgs:
+        return BaseGlossGenerationPipelineInputArgs(
+            song_info=input.song_info,
+            configuration=input.configuration,
+            lyric_lines=[line for line in input.lyric_lines if line.id in line_ids],
+            inspection_result=InspectionResult(inspections=[i for i in input.inspection_result.inspections if i.line_id in line_ids])
+        )
+
+    @classmethod
+    def _get_output_elements(cls, output: GlossGenerationResult) -> list[GlossLine]:
+        return output.translations
+
+    @classmethod
+    def _make_output(cls, elements: list[GlossLine]) -> GlossGenerationResult:
+        return GlossGenerationResult(translations=elements)
 
     @classmethod
     def _input_to_str(cls, input: BaseGlossGenerationPipelineInputArgs, config: RunnableConfig) -> str:
         lyrics = [InputLyricLineWithInspection(lyric=line.lyric, id=str(line_index)) 
                   for line_index, line in enumerate(input.lyric_lines)]
         for inspection in input.inspection_result.inspections:
-            ls = [l for l in lyrics if l.id == inspection.line_id]
+            # Inspections refer to the unique line ids while the prompt uses indices.
+            ls = [l for l, line in zip(lyrics, input.lyric_lines) if line.id == inspection.line_id]
             if len(ls) > 0:
-                ls[0].note = BaseInspectionElement(**inspection)
+                ls[0].note = BaseInspectionElement(**inspection.model_dump(exclude={"line_id"}))
 
         prompt_input = GlossGenerationPromptInputArgs(
                 song_title=input.song_info.title,
                 song_description=input.song_info.description,
                 lyrics=lyrics,
-                user_settings=input.configuration
+                user_settings=BaseGlossSettings.model_validate(input.configuration.model_dump(include=set(BaseGlossSettings.model_fields.keys())))
             )
         
         return prompt_input.model_dump_json(exclude_none=True, indent=2)
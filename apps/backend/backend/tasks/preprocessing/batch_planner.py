@@ -0,0 +1,109 @@
+from functools import cache
+from math import ceil
+
+from pydantic import BaseModel
+import tiktoken
+
+from backend.database.models import Line
+
+
+@cache
+def _get_encoding() -> tiktoken.Encoding | None:
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as ex:
+        # The encoding file is downloaded on first use; fall back to an estimate when offline.
+        print(f"Tokenizer is not available ({ex}). Estimate token counts from text length.")
+        return None
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    else:
+        return ceil(len(text) / 4)
+
+
+class BatchPlannerConfig(BaseModel):
+    # Each line is serialized as a JSON object with an index id in the prompt.
+    prompt_tokens_per_line_overhead: int = 16
+    # The longest per-line output among the preprocessing chains (gloss options with short/long glosses and descriptions).
+    completion_tokens_per_line: int = 110
+    completion_tokens_per_lyric_token: float = 1.5
+    # Batches are packed up to the target and never exceed the max, which leaves a margin below the chains' max_tokens=2048.
+    target_completion_tokens: int = 1200
+    max_completion_tokens: int = 1600
+
+
+class LineBatchEstimate(BaseModel):
+    line_ids: list[str]
+    verse_count: int
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class LineBatchPlan(BaseModel):
+    batches: list[LineBatchEstimate]
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum([b.prompt_tokens for b in self.batches])
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum([b.completion_tokens for b in self.batches])
+
+    def describe(self) -> str:
+        rows = [f"  - Batch {i}: {len(b.line_ids)} lines from {b.verse_count} verse(s), ~{b.prompt_tokens} prompt / ~{b.completion_tokens} completion tokens"
+                for i, b in enumerate(self.batches)]
+        return "\n".join([f"{len(self.batches)} batches, ~{self.prompt_tokens} prompt / ~{self.completion_tokens} completion tokens per chain (excluding system prompt):"] + rows)
+
+
+class LineBatchPlanner:
+
+    def __init__(self, config: BatchPlannerConfig | None = None) -> None:
+        self.config = config or BatchPlannerConfig()
+
+    def estimate_line(self, line: Line) -> tuple[int, int]:
+        lyric_tokens = count_tokens(line.lyric)
+        return (lyric_tokens + self.config.prompt_tokens_per_line_overhead,
+                self.config.completion_tokens_per_line + ceil(lyric_tokens * self.config.completion_tokens_per_lyric_token))
+
+    def plan(self, verses: list[list[Line]]) -> tuple[list[list[Line]], LineBatchPlan]:
+        # Pack whole verses together up to the target size. Only verses exceeding the max are split, into near-equal chunks.
+        estimates: dict[str, tuple[int, int]] = {line.id: self.estimate_line(line) for lines in verses for line in lines}
+        completion_of = lambda lines: sum([estimates[line.id][1] for line in lines])
+
+        units: list[list[Line]] = []
+        for lines in verses:
+            if len(lines) == 0:
+                continue
+
+            verse_completion = completion_of(lines)
+            if verse_completion <= self.config.max_completion_tokens:
+                units.append(lines)
+            else:
+                chunk_count = min(len(lines), ceil(verse_completion / self.config.target_completion_tokens))
+                chunk_size, remainder = divmod(len(lines), chunk_count)
+                start = 0
+                for i in range(chunk_count):
+                    end = start + chunk_size + (1 if i < remainder else 0)
+                    units.append(lines[start:end])
+                    start = end
+
+        batches: list[list[Line]] = []
+        batch_verse_counts: list[int] = []
+        for unit in units:
+            if len(batches) > 0 and completion_of(batches[-1]) + completion_of(unit) <= self.config.target_completion_tokens:
+                batches[-1] = batches[-1] + unit
+                batch_verse_counts[-1] += 1
+            else:
+                batches.append(list(unit))
+                batch_verse_counts.append(1)
+
+        plan = LineBatchPlan(batches=[LineBatchEstimate(line_ids=[line.id for line in batch],
+                                                        verse_count=verse_count,
+                                                        prompt_tokens=sum([estimates[line.id][0] for line in batch]),
+                                                        completion_tokens=completion_of(batch))
+                                      for batch, verse_count in zip(batches, batch_verse_counts)])
+        return batches, plan
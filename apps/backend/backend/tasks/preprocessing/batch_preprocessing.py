@@ -0,0 +1,134 @@
+import asyncio
+from enum import StrEnum
+from itertools import groupby
+from time import perf_counter
+import traceback
+
+from pydantic import BaseModel
+from sqlmodel import select
+
+from backend.database.engine import db_sessionmaker
+from backend.database.models import Project, Song, User
+from backend.utils.time import get_timestamp
+from backend.tasks.tracing import PipelineTracer
+from . import analyze_song, generate_processing_id, store_song_preprocessing_result
+
+
+class ProjectPreprocessingStatus(StrEnum):
+    Processed = "processed"
+    Skipped = "skipped"
+    Failed = "failed"
+
+class ProjectPreprocessingReportItem(BaseModel):
+    project_id: str
+    user_id: str
+    song_id: str
+    status: ProjectPreprocessingStatus
+    processing_id: str | None = None
+    shared_by: int = 1 # Number of projects which received the same analysis.
+    error: str | None = None
+
+class BatchPreprocessingReport(BaseModel):
+    concurrency: int
+    force: bool
+    started_timestamp: int
+    elapsed_seconds: float
+    unique_combinations: int
+    items: list[ProjectPreprocessingReportItem]
+
+    def count(self, status: ProjectPreprocessingStatus) -> int:
+        return len([item for item in self.items if item.status == status])
+
+
+async def create_missing_projects() -> list[str]:
+    # Make sure that every user has a project for each song available to them, with the default settings.
+    async with db_sessionmaker() as db:
+        async with db.begin():
+            users = (await db.exec(select(User))).all()
+            songs = (await db.exec(select(Song))).all()
+            existing_pairs = set((p.user_id, p.song_id) for p in (await db.exec(select(Project))).all())
+
+            new_projects = [Project(user_id=user.id, song_id=song.id) for user in users for song in songs
+                            if song.is_whitelisted_to_user(user.id) and (user.id, song.id) not in existing_pairs]
+            db.add_all(new_projects)
+            print(f"Created {len(new_projects)} projects.")
+
+            return [p.id for p in new_projects]
+
+
+async def preprocess_projects(project_ids: list[str] | None = None, concurrency: int = 8, force: bool = False) -> BatchPreprocessingReport:
+    # Preprocess the given projects (all projects if None).
+    # Projects of the same song with identical settings would receive the same analysis, so it is computed once per combination.
+
+    async with db_sessionmaker() as db:
+        query = select(Project)
+        if project_ids is not None:
+            query = query.where(Project.id.in_(project_ids))
+        projects = (await db.exec(query)).all()
+
+    report_items: list[ProjectPreprocessingReportItem] = []
+
+    targets: list[Project] = []
+    for project in projects:
+        if project.last_processing_id is None or force is True:
+            targets.append(project)
+        else:
+            report_items.append(ProjectPreprocessingReportItem(project_id=project.id, user_id=project.user_id, song_id=project.song_id,
+                                                               status=ProjectPreprocessingStatus.Skipped, processing_id=project.last_processing_id))
+
+    make_combination_key = lambda p: (p.song_id, p.safe_user_settings.make_hash())
+    combinations = [(key, list(group)) for key, group in groupby(sorted(targets, key=make_combination_key), key=make_combination_key)]
+
+    # The budget is shared by all combinations and bounds the number of line batches in flight at once.
+    budget = asyncio.Semaphore(concurrency)
+    # SQLite accepts a single writer at a time.
+    write_lock = asyncio.Lock()
+    progress = {"done": 0}
+
+    async def process_combination(index: int, group: list[Project]):
+        song = group[0].song
+        label = f"\"{song.title}\" ({len(group)} project(s))"
+        print(f"[Batch preprocessing] Start combination {index + 1}/{len(combinations)} - {label}")
+        # Projects sharing an analysis also share its processing id, under which the analysis is traced.
+        processing_id = generate_processing_id()
+        tracer = PipelineTracer(processing_id, group[0].id if len(group) == 1 else None)
+        try:
+            async with db_sessionmaker() as db:
+                async with tracer.span("preprocessing", song_id=song.id, projects=[p.id for p in group]):
+                    result = await analyze_song(song, group[0].safe_user_settings, db, tracer, budget)
+                async with write_lock:
+                    await db.commit()
+        except Exception as ex:
+            traceback.print_exc()
+            report_items.extend([ProjectPreprocessingReportItem(project_id=p.id, user_id=p.user_id, song_id=p.song_id, shared_by=len(group),
+                                                                status=ProjectPreprocessingStatus.Failed, error=f"{type(ex).__name__}: {ex}") for p in group])
+        else:
+            for p in group:
+                try:
+                    async with write_lock:
+                        async with db_sessionmaker() as db:
+                            project = await db.get(Project, p.id)
+                            await store_song_preprocessing_result(project, result, db, processing_id)
+                            await db.commit()
+                    report_items.append(ProjectPreprocessingReportItem(project_id=p.id, user_id=p.user_id, song_id=p.song_id, shared_by=len(group),
+                                                                       status=ProjectPreprocessingStatus.Processed, processing_id=processing_id))
+                except Exception as ex:
+                    traceback.print_exc()
+                    report_items.append(ProjectPreprocessingReportItem(project_id=p.id, user_id=p.user_id, song_id=p.song_id, shared_by=len(group),
+                                                                       status=ProjectPreprocessingStatus.Failed, error=f"{type(ex).__name__}: {ex}"))
+        finally:
+            # Also stored for a failed analysis, whose spans hold the error.
+            async with write_lock:
+                await tracer.store()
+        progress["done"] += 1
+        print(f"[Batch preprocessing {progress['done']}/{len(combinations)} done] Finished {label} - {tracer.summarize()}")
+
+    print(f"[Batch preprocessing] {len(targets)} projects to preprocess in {len(combinations)} unique combinations. {len(projects) - len(targets)} projects skipped.")
+
+    started_timestamp = get_timestamp()
+    ts = perf_counter()
+    await asyncio.gather(*[process_combination(i, group) for i, (key, group) in enumerate(combinations)])
+    te = perf_counter()
+
+    return BatchPreprocessingReport(concurrency=concurrency, force=force, started_timestamp=started_timestamp, elapsed_seconds=te-ts,
+                                    unique_combinations=len(combinations), items=report_items)
@@ -1,12 +1,69 @@
 
+import json
 from abc import ABC
+from enum import StrEnum
 from typing import Generic
 from typing_extensions import Self
 from pydantic import BaseModel, ConfigDict, Field, model_validator
 from langchain_core.runnables import RunnableConfig
 
-from backend.database.models import LineInfo, ProjectConfiguration, SongInfo, TranslationChallengeType
-from backend.tasks.chain_mapper import ChainMapper, OutputType
+from backend.database.models import AgeGroup, InspectionSettings, LanguageProficiency, LineInfo, MainAudience, ProjectConfiguration, SignLanguageType, SongInfo, TranslationChallengeType
+from backend.tasks.chain_mapper import ElementType, LineLevelChainMapper, OutputType
+
+
+class PreprocessingStage(StrEnum):
+    Inspection="inspection"
+    BaseGloss="base_gloss"
+    PerformanceGuide="performance_guide"
+    GlossOptions="gloss_options"
+
+# The settings the base gloss prompt receives. The signing speed and the classifiers are left to the gloss options,
+# and the emotions and NMS to the performance guide, so changing them does not translate the lyrics again.
+class BaseGlossSettings(BaseModel):
+    model_config=ConfigDict(use_enum_values=True)
+
+    main_audience: MainAudience = MainAudience.Deaf
+    age_group: AgeGroup = AgeGroup.Adult
+    main_language: SignLanguageType = SignLanguageType.ASL
+    language_proficiency: LanguageProficiency = LanguageProficiency.Moderate
+
+# Settings each stage reads, beyond the outputs of its upstream stages.
+SETTINGS_STAGE_DEPENDENCIES: dict[PreprocessingStage, set[str]] = {
+    PreprocessingStage.Inspection: ProjectConfiguration.INSPECTION_FIELDS,
+    PreprocessingStage.BaseGloss: set(BaseGlossSettings.model_fields.keys()),
+    PreprocessingStage.PerformanceGuide: {"main_audience", "age_group", "emotional_level", "body_language"},
+    PreprocessingStage.GlossOptions: {"main_language", "language_proficiency", "signing_speed", "classifier_level"},
+}
+
+# Stages consuming the output of a stage.
+DOWNSTREAM_STAGES: dict[PreprocessingStage, set[PreprocessingStage]] = {
+    PreprocessingStage.Inspection: {PreprocessingStage.BaseGloss},
+    PreprocessingStage.BaseGloss: {PreprocessingStage.PerformanceGuide, PreprocessingStage.GlossOptions},
+    PreprocessingStage.PerformanceGuide: set(),
+    PreprocessingStage.GlossOptions: set(),
+}
+
+def get_affected_stages(before: ProjectConfiguration, after: ProjectConfiguration) -> set[PreprocessingStage]:
+    before_values, after_values = before.model_dump(), after.model_dump()
+    changed_fields = set([field for field in after_values.keys() if before_values.get(field) != after_values[field]])
+
+    affected = set([stage for stage, fields in SETTINGS_STAGE_DEPENDENCIES.items() if len(fields & changed_fields) > 0])
+    stack = list(affected)
+    while len(stack) > 0:
+        for downstream in DOWNSTREAM_STAGES[stack.pop()]:
+            if downstream not in affected:
+                affected.add(downstream)
+                stack.append(downstream)
+    return affected
+
+def make_stage_settings_hash(settings: ProjectConfiguration, stage: PreprocessingStage) -> str:
+    # Hash of the settings the output of a stage depends on, i.e., those read by the stage and by every stage upstream of it.
+    stages, fields = {stage}, set()
+    while len(stages) > 0:
+        current = stages.pop()
+        fields |= SETTINGS_STAGE_DEPENDENCIES[current]
+        stages |= set([upstream for upstream, downstream in DOWNSTREAM_STAGES.items() if current in downstream])
+    return json.dumps(settings.model_dump(include=fields), sort_keys=True)
 
 
 class InputLyricLine(BaseModel):
@@ -14,6 +71,8 @@ class InputLyricLine(BaseModel):
     lyric: str
 
 class BasePipelineInput(BaseModel):
+    # The fields here are the same for every line batch of a song, and the lines of a batch are added after them by the subclasses.
+    # The prompts of the batches then share their prefix up to the lines, which the provider can serve from its prompt cache.
     song_title: str
     song_description: str
     user_settings: ProjectConfiguration
@@ -43,9 +102,11 @@ class GlossGenerationResult(BaseModel):
 class InspectionPipelineInputArgs(BaseModel):
     lyric_lines: list[LineInfo]
     song_info: SongInfo
-    configuration: ProjectConfiguration
+    # The inspector reads only the inspection settings of a full configuration.
+    configuration: ProjectConfiguration | InspectionSettings
 
 class BaseGlossGenerationPipelineInputArgs(InspectionPipelineInputArgs):
+    configuration: ProjectConfiguration
     inspection_result: InspectionResult
 
 class InputLyricLineWithGloss(InputLyricLine):
@@ -88,9 +149,20 @@ class GlossOptionElement(BaseModel):
 class GlossOptionGenerationResult(BaseModel):
     options: list[GlossOptionElement]
 
-class TranslatedLyricsPipelineBase(Generic[OutputType], ChainMapper[TranslatedLyricsPipelineInputArgs, OutputType], ABC):
+class TranslatedLyricsPipelineBase(Generic[OutputType, ElementType], LineLevelChainMapper[TranslatedLyricsPipelineInputArgs, OutputType, ElementType], ABC):
 
-    
+    @classmethod
+    def _get_input_lines(cls, input: TranslatedLyricsPipelineInputArgs) -> list[LineInfo]:
+        return input.lyric_lines
+
+    @classmethod
+    def _make_partial_input(cls, input: TranslatedLyricsPipelineInputArgs, line_ids: set[str]) -> TranslatedLyricsPipelineInputArgs:
+        return TranslatedLyricsPipelineInputArgs(
+            song_info=input.song_info,
+            configuration=input.configuration,
+            lyric_lines=[line for line in input.lyric_lines if line.id in line_ids],
+            gloss_generations=GlossGenerationResult(translations=[t for t in input.gloss_generations.translations if t.line_id in line_ids])
+        )
 
     @classmethod
     def _input_to_str(cls, input: TranslatedLyricsPipelineInputArgs, config: RunnableConfig) -> str:
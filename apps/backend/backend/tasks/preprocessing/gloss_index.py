@@ -0,0 +1,377 @@
+import asyncio
+import json
+import os
+import re
+import zlib
+from os import path
+
+import numpy as np
+from pydantic import BaseModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.database.crud.project import count_accepted_line_glosses, fetch_accepted_line_glosses
+from backend.database.models import Line, ProjectConfiguration
+from .common import GlossLine, PreprocessingStage, make_stage_settings_hash
+
+
+EMBEDDING_DIMENSIONS = 512
+
+def normalize_lyric(lyric: str) -> str:
+    # Repeated lines often differ only in case, punctuation and spacing, e.g., "'Cause I, I" and "cause I I".
+    return " ".join(re.sub(r"[^\w\s]", " ", lyric.lower()).split())
+
+def embed_lyrics(lyrics: list[str], dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    # Character trigrams of the normalized lyrics hashed into a fixed number of dimensions. Near-duplicate lines share most of their trigrams.
+    # The vectors are L2-normalized, so that their dot product is the cosine similarity. crc32 keeps them the same across processes.
+    vectors = np.zeros((len(lyrics), dimensions), dtype=np.float32)
+    for i, lyric in enumerate(lyrics):
+        text = f" {normalize_lyric(lyric)} "
+        for j in range(len(text) - 2):
+            vectors[i, zlib.crc32(text[j:j + 3].encode()) % dimensions] += 1
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def make_gloss_settings_hash(settings: ProjectConfiguration) -> str:
+    # Glosses are reused only between projects whose settings lead to the same base glosses.
+    return make_stage_settings_hash(settings, PreprocessingStage.BaseGloss)
+
+
+class LineGlossEntry(BaseModel):
+    project_id: str
+    line_id: str
+    lyric: str
+    gloss: str
+    settings_hash: str
+
+class LineGlossMatch(BaseModel):
+    entry: LineGlossEntry
+    similarity: float
+    exact: bool
+
+
+class LineGlossIndex:
+    # Accepted glosses, i.e., the translations saved by users, searchable by the similarity of the lyrics of their lines.
+    # A flat search compares a query with every vector. Past ivf_min_entries, the vectors are clustered (IVF) and only the lists of the
+    # nearest centroids are searched. Updates are appended to a log on disk and folded into the snapshot once the log grows.
+    # The index is updated in memory right away; the files are written off the event loop by persist() and save().
+
+    SNAPSHOT_FILENAME = "index.npz"
+    ENTRIES_FILENAME = "entries.json"
+    LOG_FILENAME = "updates.jsonl"
+
+    def __init__(self, dir_path: str | None = None, min_similarity: float = 0.9, ivf_min_entries: int = 2048, probes: int = 8,
+                 dimensions: int = EMBEDDING_DIMENSIONS, min_log_updates_before_compaction: int = 256):
+        self.dir_path = dir_path # Kept in memory only when None.
+        self.min_similarity = min_similarity
+        self.ivf_min_entries = ivf_min_entries
+        self.probes = probes
+        self.dimensions = dimensions
+        self.min_log_updates_before_compaction = min_log_updates_before_compaction
+        self._io_lock = asyncio.Lock()
+        self.clear()
+
+    def clear(self):
+        self._size = 0
+        self._vectors = np.zeros((64, self.dimensions), dtype=np.float32)
+        self._alive = np.zeros(64, dtype=bool)
+        self._settings_ids = np.zeros(64, dtype=np.int32)
+        self._lists = np.zeros(64, dtype=np.int32)
+        self._entries: list[LineGlossEntry | None] = [] # None once removed. The row is reclaimed on the next save.
+        self._versions: list[int] = [] # Order of the last update of each row.
+        self._rows: dict[tuple[str, str], int] = {} # (project_id, line_id) -> row
+        self._exact_rows: dict[tuple[str, str], set[int]] = {} # (settings_hash, normalized lyric) -> rows
+        self._settings_hash_ids: dict[str, int] = {}
+        self._centroids: np.ndarray | None = None
+        self._trained_size = 0
+        self._version = 0
+        self._pending_log: list[dict] = []
+        self._log_length = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def row_count(self) -> int:
+        # Rows held in memory, including removed ones not reclaimed yet.
+        return self._size
+
+    @property
+    def is_clustered(self) -> bool:
+        return self._centroids is not None
+
+    def _allocate(self, capacity: int):
+        vectors, alive, settings_ids, lists = self._vectors, self._alive, self._settings_ids, self._lists
+        self._vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._settings_ids = np.zeros(capacity, dtype=np.int32)
+        self._lists = np.zeros(capacity, dtype=np.int32)
+        self._vectors[:self._size], self._alive[:self._size] = vectors[:self._size], alive[:self._size]
+        self._settings_ids[:self._size], self._lists[:self._size] = settings_ids[:self._size], lists[:self._size]
+
+    def _get_settings_id(self, settings_hash: str) -> int:
+        if settings_hash not in self._settings_hash_ids:
+            self._settings_hash_ids[settings_hash] = len(self._settings_hash_ids)
+        return self._settings_hash_ids[settings_hash]
+
+    def _set_row(self, row: int, entry: LineGlossEntry, vector: np.ndarray):
+        self._vectors[row] = vector
+        self._alive[row] = True
+        self._settings_ids[row] = self._get_settings_id(entry.settings_hash)
+        self._entries[row] = entry
+        self._version += 1
+        self._versions[row] = self._version
+        self._rows[(entry.project_id, entry.line_id)] = row
+        self._exact_rows.setdefault((entry.settings_hash, normalize_lyric(entry.lyric)), set()).add(row)
+        if self._centroids is not None:
+            self._lists[row] = np.argmax(self._centroids @ vector)
+
+    def upsert(self, entry: LineGlossEntry, log: bool = True):
+        # A line saved again takes over its row, so repeated edits of a gloss do not add rows.
+        row = self._rows.get((entry.project_id, entry.line_id))
+        if row is not None:
+            previous = self._entries[row]
+            self._exact_rows[(previous.settings_hash, normalize_lyric(previous.lyric))].discard(row)
+        else:
+            if self._size == len(self._alive):
+                self._allocate(2 * len(self._alive))
+            row = self._size
+            self._size += 1
+            self._entries.append(None)
+            self._versions.append(0)
+
+        self._set_row(row, entry, embed_lyrics([entry.lyric], self.dimensions)[0])
+        if len(self) >= self.ivf_min_entries and len(self) >= 2 * self._trained_size:
+            self.train()
+
+        if log:
+            self._append_log({"op": "upsert", "entry": entry.model_dump()})
+
+    def remove(self, project_id: str, line_id: str, log: bool = True):
+        row = self._rows.pop((project_id, line_id), None)
+        if row is None:
+            return
+        entry = self._entries[row]
+        self._exact_rows[(entry.settings_hash, normalize_lyric(entry.lyric))].discard(row)
+        self._entries[row] = None
+        self._alive[row] = False
+        if log:
+            self._append_log({"op": "remove", "project_id": project_id, "line_id": line_id})
+
+    def compact(self):
+        # Reclaims the rows of removed entries.
+        rows = np.flatnonzero(self._alive[:self._size])
+        if len(rows) == self._size:
+            return
+        entries, versions = [self._entries[row] for row in rows], [self._versions[row] for row in rows]
+        vectors, settings_ids, lists = self._vectors[rows], self._settings_ids[rows], self._lists[rows]
+
+        self._size = len(rows)
+        self._allocate(max(64, 1 << max(0, self._size - 1).bit_length()))
+        self._vectors[:self._size], self._alive[:self._size] = vectors, True
+        self._settings_ids[:self._size], self._lists[:self._size] = settings_ids, lists
+        self._entries, self._versions = entries, versions
+        self._rows = {(entry.project_id, entry.line_id): row for row, entry in enumerate(entries)}
+        self._exact_rows = {}
+        for row, entry in enumerate(entries):
+            self._exact_rows.setdefault((entry.settings_hash, normalize_lyric(entry.lyric)), set()).add(row)
+
+    def update_project_settings(self, project_id: str, settings_hash: str):
+        # The saved translations of a project stay accepted after its settings change.
+        for entry in [self._entries[row] for (pid, _), row in list(self._rows.items()) if pid == project_id]:
+            if entry.settings_hash != settings_hash:
+                self.upsert(entry.model_copy(update={"settings_hash": settings_hash}))
+
+    def train(self, iterations: int = 10):
+        # Spherical k-means over the live vectors, with about sqrt(n) lists.
+        rows = np.flatnonzero(self._alive[:self._size])
+        if len(rows) == 0:
+            return
+        vectors = self._vectors[rows]
+        list_count = max(1, int(np.sqrt(len(rows))))
+        centroids = vectors[np.random.default_rng(0).choice(len(rows), list_count, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Lists left empty keep their centroid.
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        self._centroids = centroids
+        self._lists[:self._size] = np.argmax(self._vectors[:self._size] @ centroids.T, axis=1)
+        self._trained_size = len(rows)
+
+    def search(self, lyrics: list[str], settings_hash: str, min_similarity: float | None = None) -> list[LineGlossMatch | None]:
+        # The most similar accepted gloss for each lyric, made with the same settings, if it is similar enough.
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        settings_id = self._settings_hash_ids.get(settings_hash)
+        queries = embed_lyrics(lyrics, self.dimensions)
+
+        matches: list[LineGlossMatch | None] = []
+        for lyric, query in zip(lyrics, queries):
+            match = None if settings_id is None else (self._find_exact(lyric, settings_hash) or self._find_nearest(query, settings_id, min_similarity))
+            if match is None:
+                self.misses += 1
+            elif match.exact:
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+            matches.append(match)
+        return matches
+
+    def _find_exact(self, lyric: str, settings_hash: str) -> LineGlossMatch | None:
+        rows = self._exact_rows.get((settings_hash, normalize_lyric(lyric)))
+        if rows is None or len(rows) == 0:
+            return None
+        # The most recently saved one.
+        return LineGlossMatch(entry=self._entries[max(rows, key=lambda row: self._versions[row])], similarity=1, exact=True)
+
+    def _find_nearest(self, query: np.ndarray, settings_id: int, min_similarity: float) -> LineGlossMatch | None:
+        candidates = self._alive[:self._size] & (self._settings_ids[:self._size] == settings_id)
+        if self._centroids is not None:
+            probed_lists = np.argsort(-(self._centroids @ query))[:self.probes]
+            candidates &= np.isin(self._lists[:self._size], probed_lists)
+
+        rows = np.flatnonzero(candidates)
+        if len(rows) == 0:
+            return None
+        similarities = self._vectors[rows] @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_similarity:
+            return None
+        return LineGlossMatch(entry=self._entries[rows[best]], similarity=float(similarities[best]), exact=False)
+
+    def _append_log(self, update: dict):
+        if self.dir_path is not None:
+            self._pending_log.append(update)
+
+    async def persist(self):
+        # Appends the updates made since the last call to the log, and folds the log into the snapshot once it has grown.
+        async with self._io_lock:
+            if len(self._pending_log) == 0:
+                return
+            updates, self._pending_log = self._pending_log, []
+            await asyncio.to_thread(self._write_log, updates)
+            self._log_length += len(updates)
+            if self._log_length >= max(self.min_log_updates_before_compaction, len(self) // 4):
+                await self._save()
+
+    async def save(self):
+        # Writes a snapshot of the live rows and empties the log.
+        async with self._io_lock:
+            await self._save()
+
+    async def _save(self):
+        self.compact()
+        if self.dir_path is None:
+            return
+        # Copied on the event loop, so that updates made while the files are written do not change the snapshot. They stay pending for the log.
+        vectors = self._vectors[:self._size].copy()
+        centroids = self._centroids.copy() if self._centroids is not None else np.zeros((0, self.dimensions), dtype=np.float32)
+        entries = [entry.model_dump() for entry in self._entries]
+        self._pending_log = []
+        await asyncio.to_thread(self._write_snapshot, vectors, centroids, entries)
+        self._log_length = 0
+
+    def _write_log(self, updates: list[dict]):
+        os.makedirs(self.dir_path, exist_ok=True)
+        with open(path.join(self.dir_path, self.LOG_FILENAME), "a") as f:
+            f.writelines([json.dumps(update) + "\n" for update in updates])
+
+    def _write_snapshot(self, vectors: np.ndarray, centroids: np.ndarray, entries: list[dict]):
+        os.makedirs(self.dir_path, exist_ok=True)
+        snapshot_path = path.join(self.dir_path, self.SNAPSHOT_FILENAME)
+        with open(snapshot_path + ".tmp", "wb") as f:
+            np.savez(f, vectors=vectors, centroids=centroids)
+        entries_path = path.join(self.dir_path, self.ENTRIES_FILENAME)
+        with open(entries_path + ".tmp", "w") as f:
+            json.dump(entries, f)
+
+        os.replace(snapshot_path + ".tmp", snapshot_path)
+        os.replace(entries_path + ".tmp", entries_path)
+        open(path.join(self.dir_path, self.LOG_FILENAME), "w").close()
+
+    def load(self) -> bool:
+        # Restores the snapshot and replays the log written after it. False with neither on disk.
+        self.clear()
+        if self.dir_path is None:
+            return False
+        log_path = path.join(self.dir_path, self.LOG_FILENAME)
+        if path.exists(path.join(self.dir_path, self.ENTRIES_FILENAME)):
+            self._load_snapshot()
+        elif not path.exists(log_path):
+            return False
+
+        if path.exists(log_path):
+            with open(log_path) as f:
+                for line in f:
+                    update = json.loads(line)
+                    if update["op"] == "upsert":
+                        self.upsert(LineGlossEntry.model_validate(update["entry"]), log=False)
+                    else:
+                        self.remove(update["project_id"], update["line_id"], log=False)
+                    self._log_length += 1
+        return True
+
+    def _load_snapshot(self):
+        with open(path.join(self.dir_path, self.ENTRIES_FILENAME)) as f:
+            entries = [LineGlossEntry.model_validate(entry) for entry in json.load(f)]
+        with np.load(path.join(self.dir_path, self.SNAPSHOT_FILENAME)) as snapshot:
+            vectors, centroids = snapshot["vectors"], snapshot["centroids"]
+
+        self._allocate(max(64, 1 << max(0, len(entries) - 1).bit_length()))
+        if len(centroids) > 0:
+            self._centroids = centroids
+            self._trained_size = len(entries)
+        self._size = len(entries)
+        self._entries, self._versions = [None] * len(entries), [0] * len(entries)
+        for row, entry in enumerate(entries):
+            self._set_row(row, entry, vectors[row])
+
+
+line_gloss_index = LineGlossIndex()
+
+
+def is_accepted_gloss(gloss: str | None) -> bool:
+    return gloss is not None and len(gloss.strip()) > 0
+
+def make_line_gloss_entry(project_id: str, line_id: str, lyric: str, gloss: str, settings: ProjectConfiguration) -> LineGlossEntry:
+    return LineGlossEntry(project_id=project_id, line_id=line_id, lyric=lyric, gloss=gloss, settings_hash=make_gloss_settings_hash(settings))
+
+
+async def index_accepted_gloss(project_id: str, line: Line, gloss: str | None, settings: ProjectConfiguration):
+    # Called once a translation is written. A cleared gloss is no longer reused.
+    if is_accepted_gloss(gloss):
+        line_gloss_index.upsert(make_line_gloss_entry(project_id, line.id, line.lyric, gloss, settings))
+    else:
+        line_gloss_index.remove(project_id, line.id)
+    await line_gloss_index.persist()
+
+
+async def load_line_gloss_index(db: AsyncSession, dir_path: str):
+    # The index on disk is rebuilt when it misses translations written without it, e.g., by another tool.
+    line_gloss_index.dir_path = dir_path
+    await asyncio.to_thread(line_gloss_index.load)
+    accepted_count = await count_accepted_line_glosses(db)
+    if accepted_count == len(line_gloss_index):
+        print(f"Loaded {len(line_gloss_index)} accepted glosses into the gloss index.")
+        return
+
+    line_gloss_index.clear()
+    for accepted in await fetch_accepted_line_glosses(db):
+        if is_accepted_gloss(accepted.gloss):
+            line_gloss_index.upsert(make_line_gloss_entry(accepted.project_id, accepted.line_id, accepted.lyric, accepted.gloss,
+                                                          ProjectConfiguration.model_validate(accepted.user_settings or {})), log=False)
+    await line_gloss_index.save()
+    print(f"Rebuilt the gloss index with {len(line_gloss_index)} accepted glosses.")
+
+
+def find_reusable_glosses(lines: list[Line], settings: ProjectConfiguration) -> dict[str, GlossLine]:
+    # Base glosses of lines which are the same as or nearly the same as lines with an accepted gloss, by line id.
+    matches = line_gloss_index.search([line.lyric for line in lines], make_gloss_settings_hash(settings))
+    return {line.id: GlossLine(line_id=line.id, gloss=match.entry.gloss,
+                               description=f"Accepted translation of {'the same' if match.exact else 'a similar'} line \"{match.entry.lyric}\".")
+            for line, match in zip(lines, matches) if match is not None}
@@ -1,10 +1,11 @@
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.runnables import RunnableConfig
 
-from backend.tasks.preprocessing.common import GlossOptionGenerationResult, TranslatedLyricsPipelineBase
+from backend.tasks.preprocessing.common import GlossOptionElement, GlossOptionGenerationResult, TranslatedLyricsPipelineBase
 
 
-class GlossOptionGenerationPipeline(TranslatedLyricsPipelineBase[GlossOptionGenerationResult]):
-    def __init__(self) -> None:
+class GlossOptionGenerationPipeline(TranslatedLyricsPipelineBase[GlossOptionGenerationResult, GlossOptionElement]):
+    def __init__(self, model: BaseChatModel | None = None) -> None:
         super().__init__("GlossOptionGeneration", GlossOptionGenerationResult, '''You are a helpful assistant that helps user to translate ENG lyrics into sign language.
 Your goal is to figure out how to sign the line in multiple ways considering the user preference.
 Given the lyrics and translation, provide 2 more options how to sign it differently from the given gloss (shorter gloss, longer gloss).
@@ -33,18 +34,19 @@ Given the lyrics and translation, provide 2 more options how to sign it differen
         "gloss_description_short_ver": string // The description on the short version of gloss. Do NOT mention it is shorter or longer version. Explain the gloss as if it is stand-alone.
         "gloss_long_ver": string // An alternative of the gloss translation for the line of lyrics, longer than the reference glosses.
         "gloss_description_long_ver": string // The description on the long version of gloss. Do NOT mention it is shorter or longer version. Explain the gloss as if it is stand-alone.
-    }}>''')
+    }}>''', model)
 
 
     @classmethod
     def _postprocess_output(cls, output: GlossOptionGenerationResult, config: RunnableConfig) -> GlossOptionGenerationResult:
-        original_lyrics = config["metadata"]["lyric_lines"]
-        for option in output.options:
-            option.line_id = original_lyrics[int(option.line_id)].id # Replace number index into unique id.
-        
+        output.options = cls._map_line_indices(output.options, config["metadata"]["lyric_lines"])
+        return output
 
-        assert len(original_lyrics) == len(output.options)
-        assert all(l.id == g.line_id for l, g in zip(original_lyrics, output.options))
+    @classmethod
+    def _get_output_elements(cls, output: GlossOptionGenerationResult) -> list[GlossOptionElement]:
+        return output.options
 
-        return output
+    @classmethod
+    def _make_output(cls, elements: list[GlossOptionElement]) -> GlossOptionGenerationResult:
+        return GlossOptionGenerationResult(options=elements)
 
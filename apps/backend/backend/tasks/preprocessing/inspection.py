@@ -1,16 +1,19 @@
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.runnables import RunnableConfig
 
+from backend.database.models import InspectionSettings, ProjectConfiguration
 from backend.tasks.chain_mapper import ChainMapper
 from backend.tasks.preprocessing.common import BasePipelineInput, InspectionPipelineInputArgs, InputLyricLine, InspectionResult
 
 
 class InspectionPromptInputArgs(BasePipelineInput):
+    user_settings: InspectionSettings
     lyrics:list[InputLyricLine]
 
 
 class InspectionPipeline(ChainMapper[InspectionPipelineInputArgs, InspectionResult]):
 
-    def __init__(self) -> None:
+    def __init__(self, model: BaseChatModel | None = None) -> None:
 
         super().__init__("Inspection", InspectionResult, '''You are a helpful assistant that helps user to translate ENG lyrics into sign language.
   Your goal is to figure out noteworthy part where the user might need to think how to interpret the lines.
@@ -46,7 +49,7 @@ class InspectionPipeline(ChainMapper[InspectionPipelineInputArgs, InspectionResu
     }}>
   }}  
 
-  ''')
+  ''', model)
 
     @classmethod
     def _input_to_str(cls, input: InspectionPipelineInputArgs, config: RunnableConfig) -> str:
@@ -54,7 +57,7 @@ class InspectionPipeline(ChainMapper[InspectionPipelineInputArgs, InspectionResu
                 song_title=input.song_info.title,
                 song_description=input.song_info.description,
                 lyrics=[InputLyricLine(lyric=line.lyric, id=str(line_index)) for line_index, line in enumerate(input.lyric_lines)],
-                user_settings=input.configuration
+                user_settings=InspectionSettings.model_validate(input.configuration.model_dump(include=ProjectConfiguration.INSPECTION_FIELDS))
             ).model_dump_json(indent=2)
 
     @classmethod
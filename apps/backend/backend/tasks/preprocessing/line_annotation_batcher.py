@@ -0,0 +1,85 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from backend.database.models import Line, LineAnnotation, Project, ProjectConfiguration
+
+# Runs the annotation chains for lines of a project with the glosses given by the user, returning annotations in the order of the lines.
+LineAnnotationBatchRunner = Callable[[Project, list[Line], list[str], ProjectConfiguration], Awaitable[list[LineAnnotation]]]
+
+
+class PendingLineAnnotationBatch:
+
+    def __init__(self, project: Project, user_settings: ProjectConfiguration):
+        self.project = project
+        self.user_settings = user_settings
+        self.requests: dict[str, tuple[Line, str, asyncio.Future[LineAnnotation]]] = {}
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class LineAnnotationBatcher:
+    # Per-line annotation requests of a project arriving within a short window, e.g., as the user edits glosses of several lines,
+    # are sent to the chains as one multi-line batch. The song context is then sent once instead of once per line.
+
+    def __init__(self, run_batch: LineAnnotationBatchRunner, window_seconds: float = 0.1, max_lines: int = 16):
+        self.run_batch = run_batch
+        self.window_seconds = window_seconds
+        self.max_lines = max_lines
+        self._batches: dict[tuple[str, str], PendingLineAnnotationBatch] = {}
+        self._running: set[asyncio.Task] = set() # Referenced until done, so that a running batch is not garbage-collected.
+        self.dispatched_batches = 0
+        self.dispatched_lines = 0
+
+    async def request(self, project: Project, line: Line, user_translation: str, user_settings: ProjectConfiguration) -> LineAnnotation:
+        key = (project.id, user_settings.make_hash())
+        batch = self._batches.get(key)
+        if batch is not None and line.id in batch.requests:
+            _, pending_translation, future = batch.requests[line.id]
+            if pending_translation == user_translation:
+                return await asyncio.shield(future)
+            # A line appears once in a batch, so a request with another gloss goes to the next one.
+            self._dispatch(key, batch)
+            batch = None
+
+        if batch is None:
+            batch = PendingLineAnnotationBatch(project, user_settings)
+            batch.timer = asyncio.get_running_loop().call_later(self.window_seconds, self._dispatch, key, batch)
+            self._batches[key] = batch
+
+        future = asyncio.get_running_loop().create_future()
+        batch.requests[line.id] = (line, user_translation, future)
+        if len(batch.requests) >= self.max_lines:
+            self._dispatch(key, batch)
+
+        return await asyncio.shield(future)
+
+    def _dispatch(self, key: tuple[str, str], batch: PendingLineAnnotationBatch):
+        if self._batches.get(key) is not batch:
+            return
+        self._batches.pop(key)
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: PendingLineAnnotationBatch):
+        requests = list(batch.requests.values())
+        self.dispatched_batches += 1
+        self.dispatched_lines += len(requests)
+        print(f"Annotate {len(requests)} lines of project {batch.project.id} in a batch.")
+        try:
+            # Lines without timestamps go last, in their line order.
+            requests.sort(key=lambda request: (request[0].start_millis is None, request[0].start_millis or 0, request[0].line_number))
+            annotations = {annotation.line_id: annotation for annotation in
+                           await self.run_batch(batch.project, [line for line, _, _ in requests], [translation for _, translation, _ in requests], batch.user_settings)}
+            for line, _, future in requests:
+                if future.done():
+                    continue
+                if line.id in annotations:
+                    future.set_result(annotations[line.id])
+                else:
+                    future.set_exception(KeyError(f"No annotation generated for line {line.id}."))
+        except Exception as ex:
+            for _, _, future in requests:
+                if not future.done():
+                    future.set_exception(ex)
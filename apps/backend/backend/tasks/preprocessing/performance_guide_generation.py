@@ -1,10 +1,11 @@
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.runnables import RunnableConfig
 
-from backend.tasks.preprocessing.common import PerformanceGuideGenerationResult, TranslatedLyricsPipelineBase, TranslatedLyricsPipelineInputArgs
+from backend.tasks.preprocessing.common import PerformanceGuideElement, PerformanceGuideGenerationResult, TranslatedLyricsPipelineBase, TranslatedLyricsPipelineInputArgs
 
 
-class PerformanceGuideGenerationPipeline(TranslatedLyricsPipelineBase[PerformanceGuideGenerationResult]):
-    def __init__(self) -> None:
+class PerformanceGuideGenerationPipeline(TranslatedLyricsPipelineBase[PerformanceGuideGenerationResult, PerformanceGuideElement]):
+    def __init__(self, model: BaseChatModel | None = None) -> None:
         super().__init__("PerformanceGuideGeneration", PerformanceGuideGenerationResult, 
                          """You are a helpful assistant that helps user to translate ENG lyrics into sign language.
 Your goal is to figure out how to express each line considering the mood of the song.
@@ -34,16 +35,17 @@ Given the lyrics, mark lines with emotion and how to interpret with facial expre
             "body_gesture": string // how to express the mood of the lines using bodily gestures. Use Markdown to emphasize noteworthy keywords.
             "emotion_description": string // description on you rationale of why you chose these expressions. This will be given to the users to support the results.  Use Markdown to emphasize noteworthy keywords.
         }}> // Provide guides for ALL lines.
-    }}""")
+    }}""", model)
 
     @classmethod
     def _postprocess_output(cls, output: PerformanceGuideGenerationResult, config: RunnableConfig) -> PerformanceGuideGenerationResult:
-        original_lyrics = config["metadata"]["lyric_lines"]
-        for guide in output.guides:
-            guide.line_id = original_lyrics[int(guide.line_id)].id # Replace number index into unique id.
-        
+        output.guides = cls._map_line_indices(output.guides, config["metadata"]["lyric_lines"])
+        return output
 
-        assert len(original_lyrics) == len(output.guides)
-        assert all(l.id == g.line_id for l, g in zip(original_lyrics, output.guides))
+    @classmethod
+    def _get_output_elements(cls, output: PerformanceGuideGenerationResult) -> list[PerformanceGuideElement]:
+        return output.guides
 
-        return output
+    @classmethod
+    def _make_output(cls, elements: list[PerformanceGuideElement]) -> PerformanceGuideGenerationResult:
+        return PerformanceGuideGenerationResult(guides=elements)
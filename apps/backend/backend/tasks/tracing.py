@@ -0,0 +1,142 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from backend.database.engine import db_sessionmaker
+from backend.database.models import PipelineTraceSpan, TraceSpanKind
+from backend.tasks.chain_mapper import chain_mapper_stats
+
+
+# Innermost open span of the current task. Tasks created inside a span inherit it as their parent.
+_current_span: ContextVar[PipelineTraceSpan | None] = ContextVar("current_trace_span", default=None)
+
+
+class PipelineTracer:
+    # Collects spans of a preprocessing run. Spans are kept in memory and stored together after the run, whether it succeeded or not.
+
+    def __init__(self, processing_id: str, project_id: str | None = None) -> None:
+        self.processing_id = processing_id
+        self.project_id = project_id
+        self.spans: list[PipelineTraceSpan] = []
+
+    def _create_span(self, kind: TraceSpanKind, name: str, parent: PipelineTraceSpan | None, batch_id: int | None, metadata: dict | None) -> PipelineTraceSpan:
+        span = PipelineTraceSpan(processing_id=self.processing_id, project_id=self.project_id,
+                                 parent_id=parent.id if parent is not None else None,
+                                 kind=kind, name=name, batch_id=batch_id, metadata_json=metadata)
+        self.spans.append(span)
+        return span
+
+    @asynccontextmanager
+    async def span(self, name: str, parent: PipelineTraceSpan | None = None, batch_id: int | None = None, **metadata):
+        span = self._create_span(TraceSpanKind.Stage, name, parent or _current_span.get(), batch_id, metadata if len(metadata) > 0 else None)
+        token = _current_span.set(span)
+        ts = perf_counter()
+        try:
+            yield span
+        except Exception as ex:
+            span.error = f"{type(ex).__name__}: {ex}"
+            raise
+        finally:
+            span.duration_seconds = perf_counter() - ts
+            _current_span.reset(token)
+
+    def make_callback_handler(self, parent: PipelineTraceSpan | None = None, batch_id: int | None = None) -> "ChainTracingCallbackHandler":
+        return ChainTracingCallbackHandler(self, parent, batch_id)
+
+    def cached_token_ratio(self) -> float:
+        chain_spans = [s for s in self.spans if s.kind == TraceSpanKind.Chain]
+        prompt_tokens = sum([s.prompt_tokens for s in chain_spans])
+        return sum([s.cached_prompt_tokens for s in chain_spans]) / prompt_tokens if prompt_tokens > 0 else 0
+
+    def summarize(self) -> str:
+        chain_spans = [s for s in self.spans if s.kind == TraceSpanKind.Chain]
+        return (f"{len(chain_spans)} chain calls, {sum([s.prompt_tokens for s in chain_spans])} prompt / {sum([s.completion_tokens for s in chain_spans])} completion tokens, "
+                f"{self.cached_token_ratio():.0%} of prompt tokens cached, {sum([s.retries for s in chain_spans])} retries")
+
+    async def store(self):
+        # Stored on a session of their own, so that the spans of a failed run, with their errors, are kept when its results are rolled back.
+        async with db_sessionmaker() as db:
+            db.add_all(self.spans)
+            await db.commit()
+
+
+class ChainTracingCallbackHandler(BaseCallbackHandler):
+    # Records a span for each ChainMapper invocation, including those run inside RunnableParallel, with the token usage and retries of its LLM calls.
+
+    run_inline = True
+
+    def __init__(self, tracer: PipelineTracer, parent: PipelineTraceSpan | None, batch_id: int | None) -> None:
+        super().__init__()
+        self.tracer = tracer
+        self.parent = parent
+        self.batch_id = batch_id
+
+        self._parent_run_ids: dict[UUID, UUID | None] = {}
+        self._open_spans: dict[UUID, tuple[PipelineTraceSpan, float]] = {}
+        self._llm_calls: dict[UUID, int] = {}
+
+    def _find_open_span(self, run_id: UUID | None) -> UUID | None:
+        while run_id is not None:
+            if run_id in self._open_spans:
+                return run_id
+            run_id = self._parent_run_ids.get(run_id)
+        return None
+
+    def on_chain_start(self, serialized: dict[str, Any], inputs: dict[str, Any], *, run_id: UUID, parent_run_id: UUID | None = None, **kwargs: Any) -> Any:
+        self._parent_run_ids[run_id] = parent_run_id
+        name = kwargs.get("name")
+        if name in chain_mapper_stats:
+            # Partial requests for missing lines show up as separate spans with fewer lines.
+            lyric_lines = getattr(inputs, "lyric_lines", None)
+            span = self.tracer._create_span(TraceSpanKind.Chain, name, self.parent, self.batch_id,
+                                            {"lines": len(lyric_lines)} if lyric_lines is not None else None)
+            self._open_spans[run_id] = (span, perf_counter())
+            self._llm_calls[run_id] = 0
+
+    def on_chain_end(self, outputs: dict[str, Any], *, run_id: UUID, **kwargs: Any) -> Any:
+        self._close_span(run_id, None)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        self._close_span(run_id, error)
+
+    def _close_span(self, run_id: UUID, error: BaseException | None):
+        self._parent_run_ids.pop(run_id, None)
+        if run_id in self._open_spans:
+            span, ts = self._open_spans.pop(run_id)
+            span.duration_seconds = perf_counter() - ts
+            span.retries = max(0, self._llm_calls.pop(run_id) - 1)
+            if error is not None:
+                span.error = f"{type(error).__name__}: {error}"
+
+    def on_chat_model_start(self, serialized: dict[str, Any], messages: list[list[BaseMessage]], *, run_id: UUID, parent_run_id: UUID | None = None, **kwargs: Any) -> Any:
+        self._parent_run_ids[run_id] = parent_run_id
+        span_run_id = self._find_open_span(run_id)
+        if span_run_id is not None:
+            self._llm_calls[span_run_id] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
+        span_run_id = self._find_open_span(run_id)
+        self._parent_run_ids.pop(run_id, None)
+        if span_run_id is None:
+            return
+
+        span, _ = self._open_spans[span_run_id]
+        token_usage = (response.llm_output or {}).get("token_usage")
+        if token_usage is not None:
+            span.prompt_tokens += token_usage.get("prompt_tokens", 0)
+            span.cached_prompt_tokens += (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            span.completion_tokens += token_usage.get("completion_tokens", 0)
+        else:
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if usage is not None:
+                        span.prompt_tokens += usage.get("input_tokens", 0)
+                        span.cached_prompt_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+                        span.completion_tokens += usage.get("output_tokens", 0)
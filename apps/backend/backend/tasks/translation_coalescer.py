@@ -0,0 +1,187 @@
+import asyncio
+import json
+from time import perf_counter
+import traceback
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.database.crud.project import fetch_line_translation_by_line, store_interaction_log
+from backend.database.engine import db_sessionmaker
+from backend.database.models import InteractionType, Line, LineTranslation, LineTranslationInfo, Project
+from backend.tasks.chat.chat_context import chat_context_cache
+from backend.tasks.preprocessing import prefetch_alt_glosses
+from backend.tasks.preprocessing.gloss_index import index_accepted_gloss
+
+
+# Translations are upserted as the user types a gloss. Updates of a line arriving within a short window are merged in memory
+# and written once, with a single EnterGloss log from the gloss before the burst to the gloss after it.
+
+TranslationKey = tuple[str, str] # (project_id, line_id)
+
+
+class PendingTranslationUpdate:
+
+    def __init__(self, user_id: str, translation: LineTranslationInfo, exists: bool):
+        self.user_id = user_id
+        self.translation = translation # Latest state, returned to the clients before it is written.
+        self.exists = exists
+        self.gloss_before = translation.gloss if exists else None
+        self.changed_fields: set[str] = set()
+        self.update_count = 0
+        self.failed_writes = 0
+        self.first_update_at = perf_counter()
+        self.flush_timer: asyncio.Task | None = None
+
+
+class TranslationUpsertCoalescer:
+
+    def __init__(self, window_seconds: float = 1.0, max_delay_seconds: float = 5.0, prefetch_alt_glosses: bool = True,
+                 max_write_attempts: int = 3, retry_delay_seconds: float = 1.0):
+        # The write is postponed while updates keep coming within the window, but no longer than the max delay after the first one.
+        self.window_seconds = window_seconds
+        self.max_delay_seconds = max_delay_seconds
+        # A failed write is retried with the updates arriving meanwhile, after a delay growing with the attempts.
+        self.max_write_attempts = max_write_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.prefetch_alt_glosses = prefetch_alt_glosses
+        self._pending: dict[TranslationKey, PendingTranslationUpdate] = {}
+        self._writing: dict[TranslationKey, asyncio.Task] = {}
+
+    async def upsert(self, db: AsyncSession, user_id: str, project_id: str, line_id: str, changes: dict[str, str | None]) -> LineTranslationInfo:
+        key = (project_id, line_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            # A write of the previous burst may still be running; the new burst starts from its result.
+            writing = self._writing.get(key)
+            if writing is not None:
+                await asyncio.shield(writing)
+
+            translation = await fetch_line_translation_by_line(db, project_id, line_id)
+
+            pending = self._pending.get(key)
+            if pending is None:
+                if translation is not None:
+                    pending = PendingTranslationUpdate(user_id, LineTranslationInfo.model_validate(translation.model_dump()), exists=True)
+                else:
+                    pending = PendingTranslationUpdate(user_id, LineTranslationInfo(project_id=project_id, line_id=line_id), exists=False)
+                self._pending[key] = pending
+
+        for field, value in changes.items():
+            setattr(pending.translation, field, value if value is not None and len(value.strip()) > 0 else None)
+            pending.changed_fields.add(field)
+        pending.update_count += 1
+
+        self._schedule_flush(key, pending)
+        return pending.translation.model_copy()
+
+    def get_pending(self, project_id: str, line_id: str) -> LineTranslationInfo | None:
+        pending = self._pending.get((project_id, line_id))
+        return pending.translation.model_copy() if pending is not None else None
+
+    def merge_pending(self, project_id: str, translations: list[LineTranslationInfo]) -> list[LineTranslationInfo]:
+        # Overlays the states not written yet on translations read from the database.
+        pending_by_line = {line_id: pending for (pid, line_id), pending in self._pending.items() if pid == project_id}
+        if len(pending_by_line) == 0:
+            return translations
+
+        merged = [pending_by_line.pop(t.line_id).translation.model_copy() if t.line_id in pending_by_line else t for t in translations]
+        return merged + [pending.translation.model_copy() for pending in pending_by_line.values()]
+
+    def _schedule_flush(self, key: TranslationKey, pending: PendingTranslationUpdate):
+        if pending.flush_timer is not None:
+            pending.flush_timer.cancel()
+        delay = min(self.window_seconds, max(0, self.max_delay_seconds - (perf_counter() - pending.first_update_at)))
+        pending.flush_timer = asyncio.create_task(self._flush_after(key, delay))
+
+    async def _flush_after(self, key: TranslationKey, delay: float):
+        await asyncio.sleep(delay)
+        self._start_write(key)
+
+    def _start_write(self, key: TranslationKey) -> asyncio.Task | None:
+        # Runs without awaiting, so that no update can slip in between taking the pending state and registering its write.
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return None
+
+        task = asyncio.create_task(self._write(key, pending))
+        self._writing[key] = task
+
+        def on_done(t: asyncio.Task):
+            if self._writing.get(key) is t:
+                self._writing.pop(key)
+        task.add_done_callback(on_done)
+        return task
+
+    def _retry_write(self, key: TranslationKey, pending: PendingTranslationUpdate, error: Exception):
+        pending.failed_writes += 1
+        if pending.failed_writes >= self.max_write_attempts:
+            print(f"Gave up writing the translation of line {key[1]} - " + json.dumps({
+                "project_id": key[0], "line_id": key[1], "user_id": pending.user_id, "translation": pending.translation.model_dump(mode="json"),
+                "changed_fields": sorted(pending.changed_fields), "coalesced_updates": pending.update_count,
+                "attempts": pending.failed_writes, "error": f"{type(error).__name__}: {error}"
+            }))
+            return
+
+        # Updates arriving during the write wait for it before starting a burst, so the failed burst takes them in again.
+        self._pending[key] = pending
+        pending.flush_timer = asyncio.create_task(self._flush_after(key, self.retry_delay_seconds * pending.failed_writes))
+
+    async def _write(self, key: TranslationKey, pending: PendingTranslationUpdate):
+        project_id, line_id = key
+        written = False
+        try:
+            async with db_sessionmaker() as db:
+                translation = await fetch_line_translation_by_line(db, project_id, line_id)
+                if translation is None:
+                    translation = LineTranslation(id=pending.translation.id, project_id=project_id, line_id=line_id)
+
+                # Only the fields updated in this burst are written, so other writers of the row are not overwritten.
+                for field in pending.changed_fields:
+                    setattr(translation, field, getattr(pending.translation, field))
+
+                if "gloss" in pending.changed_fields and pending.gloss_before != translation.gloss:
+                    await store_interaction_log(db, pending.user_id, project_id, InteractionType.EnterGloss, {
+                        "initial": not pending.exists,
+                        "translation_id": translation.id,
+                        "before": pending.gloss_before,
+                        "after": translation.gloss,
+                        "coalesced_updates": pending.update_count
+                    })
+
+                db.add(translation)
+                await db.commit()
+                written = True
+                chat_context_cache.invalidate(project_id, line_id)
+                print(f"Wrote translation of line {line_id} coalesced from {pending.update_count} updates.")
+
+                if "gloss" in pending.changed_fields:
+                    project = await db.get(Project, project_id)
+                    await index_accepted_gloss(project_id, await db.get(Line, line_id), translation.gloss, project.safe_user_settings)
+
+                    # The gloss has settled, so the alt glosses the editor asks for next are likely to be for it.
+                    if self.prefetch_alt_glosses and translation.gloss is not None:
+                        prefetch_alt_glosses(project_id, line_id, translation.gloss, project.safe_user_settings.make_hash())
+        except Exception as ex:
+            print(f"Failed to write the translation of line {line_id}.")
+            traceback.print_exc()
+            if not written:
+                self._retry_write(key, pending, ex)
+
+    async def flush(self, project_id: str | None = None):
+        # Writes the pending updates right away, of a project or of every project, e.g., before bulk writes or on shutdown.
+        # Failed writes are retried right away too, until they are written or given up.
+        while True:
+            keys = [key for key in self._pending.keys() if project_id is None or key[0] == project_id]
+            for key in keys:
+                pending = self._pending.get(key)
+                if pending is not None and pending.flush_timer is not None:
+                    pending.flush_timer.cancel()
+                self._start_write(key)
+
+            writing = [task for key, task in self._writing.items() if project_id is None or key[0] == project_id]
+            if len(writing) == 0:
+                return
+            await asyncio.gather(*writing)
+
+
+translation_coalescer = TranslationUpsertCoalescer()
@@ -1,5 +1,5 @@
+import asyncio
 from backend.tasks.media_preparation.media import MediaManager
 
 if __name__ == "__main__":
-    MediaManager.retrieve_video_from_youtube("test_song_dir", "video.mp4", "gdZLi9oWNZg")
-    
\ No newline at end of file
+    asyncio.run(MediaManager.retrieve_media_from_youtube("test_song_dir", "audio.mp3", "video.mp4", "gdZLi9oWNZg"))
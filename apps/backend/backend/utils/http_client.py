@@ -0,0 +1,75 @@
+import asyncio
+from importlib.util import find_spec
+import hashlib
+import json
+from os import path, makedirs
+import time
+
+import httpx
+
+from backend.config import ElmiConfig
+
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client, _client_loop
+
+    # Pooled connections are bound to the event loop which opened them.
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            http2=find_spec("h2") is not None,
+            follow_redirects=True,
+            timeout=httpx.Timeout(20.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+        )
+        _client_loop = loop
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+class ResponseCache:
+
+    def __init__(self, name: str, ttl_seconds: float) -> None:
+        self.dir_path = path.join(ElmiConfig.DIR_HTTP_CACHE, name)
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def make_key(url: str, params: dict | None = None) -> str:
+        return hashlib.sha256(json.dumps([url, params], sort_keys=True).encode()).hexdigest()
+
+    def __get_file_path(self, key: str) -> str:
+        return path.join(self.dir_path, f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        file_path = self.__get_file_path(key)
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                entry = json.load(f)
+            if time.time() - entry["stored_at"] < self.ttl_seconds:
+                return entry["text"]
+        return None
+
+    def set(self, key: str, text: str):
+        if not path.exists(self.dir_path):
+            makedirs(self.dir_path)
+        with open(self.__get_file_path(key), 'w') as f:
+            json.dump({"stored_at": time.time(), "text": text}, f)
+
+    async def fetch_text(self, url: str, params: dict | None = None, headers: dict | None = None) -> str:
+        key = self.make_key(url, params)
+        text = self.get(key)
+        if text is not None:
+            print(f"Response cache hit - {url}")
+            return text
+
+        response = await get_http_client().get(url, params=params, headers=headers)
+        response.raise_for_status()
+        self.set(key, response.text)
+        return response.text
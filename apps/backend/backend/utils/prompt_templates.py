@@ -0,0 +1,32 @@
+from jinja2 import Template
+from jinja2.sandbox import SandboxedEnvironment
+
+
+class PromptTemplateRegistry:
+    # Prompt templates compiled once when registered, instead of being parsed and compiled by jinja2_formatter on every render.
+    # Rendering uses the same sandboxed environment as jinja2_formatter, so the output does not change.
+
+    def __init__(self) -> None:
+        self._environment = SandboxedEnvironment()
+        self._sources: dict[str, str] = {}
+        self._templates: dict[str, Template] = {}
+
+    def register(self, name: str, source: str) -> str:
+        if name in self._sources and self._sources[name] != source:
+            raise ValueError(f"Another prompt template is registered as {name}.")
+        if name not in self._templates:
+            self._sources[name] = source
+            self._templates[name] = self._environment.from_string(source)
+        return name
+
+    def render(self, name: str, /, **kwargs) -> str:
+        return self._templates[name].render(**kwargs)
+
+    def get_source(self, name: str) -> str:
+        return self._sources[name]
+
+    def names(self) -> list[str]:
+        return list(self._templates.keys())
+
+
+prompt_templates = PromptTemplateRegistry()
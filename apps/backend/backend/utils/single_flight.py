@@ -0,0 +1,43 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    # Runs one piece of work per key at a time. Callers asking for a key already being worked on await the same result,
+    # instead of starting the same LLM call or ffmpeg job again and racing to store its cache entry.
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._tasks: dict[Hashable, asyncio.Task[T]] = {}
+        self.started = 0
+        self.joined = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    def start(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> asyncio.Task[T]:
+        # The work should not depend on the session of the caller, since it may outlive the request that started it.
+        task = self._tasks.get(key)
+        if task is not None:
+            self.joined += 1
+            return task
+
+        task = asyncio.create_task(work())
+        self._tasks[key] = task
+        self.started += 1
+
+        def on_done(t: asyncio.Task[T]):
+            if self._tasks.get(key) is t:
+                self._tasks.pop(key)
+        task.add_done_callback(on_done)
+        return task
+
+    async def join(self):
+        # Waits for the work in flight, e.g., background work on shutdown. Failures are left to the callers of the work.
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        # Shielded, so that a caller being cancelled, e.g., a client leaving, does not cancel the work shared with the others.
+        return await asyncio.shield(self.start(key, work))
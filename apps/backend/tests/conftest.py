@@ -1,3 +1,35 @@
 """Unit tests configuration module."""
 
+import pytest
+
+from backend.benchmark.fakes import FakeChatModel, LatencyDistribution, LatencyModel
+from backend.benchmark.synthetic import use_benchmark_database
+from backend.tasks import preprocessing
+from backend.tasks.chat import chatbot
+
 pytest_plugins = []
+
+
+@pytest.fixture
+def anyio_backend():
+    """Async tests run on asyncio, like the server."""
+    return "asyncio"
+
+
+@pytest.fixture
+async def benchmark_database(anyio_backend, tmp_path):
+    """Database of its own for the test, used by every session from the shared session maker."""
+    engine = await use_benchmark_database(str(tmp_path / "database.db"))
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def fake_chat_model():
+    """Offline chat model answering without latency, used by the preprocessing chains and the chatbot until the test ends."""
+    model = FakeChatModel(latency=LatencyModel(distribution=LatencyDistribution.Constant, median_seconds=0))
+    preprocessing.use_chat_model(model)
+    chatbot.use_chat_model(model)
+    yield model
+    preprocessing.use_chat_model(None)
+    chatbot.use_chat_model(None)
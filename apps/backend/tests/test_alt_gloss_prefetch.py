@@ -0,0 +1,38 @@
+"""Speculative alt gloss generation unit test module."""
+
+import asyncio
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.fakes import LatencyDistribution, LatencyModel
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.engine import db_sessionmaker
+from backend.database.models import AltGlossesInfo, CachedAltGlossGenerationResult, Line
+from backend.tasks.preprocessing import generate_alt_glosses_with_user_translation, prefetch_alt_glosses
+
+
+@pytest.mark.anyio
+async def test_request_attaches_to_prefetched_generation(benchmark_database, fake_chat_model):
+    """A request arriving during a prefetch awaits it instead of calling the model again, and later requests hit the cache."""
+    fake_chat_model.latency = LatencyModel(distribution=LatencyDistribution.Constant, median_seconds=0.1)
+
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=2)
+        project = (await seed_synthetic_projects(db, songs, 1))[0]
+        line = (await db.exec(select(Line))).first()
+
+    async def request() -> AltGlossesInfo | None:
+        async with db_sessionmaker() as db:
+            return await generate_alt_glosses_with_user_translation(project.id, db, line.id, "HELLO")
+
+    prefetch_alt_glosses(project.id, line.id, "HELLO", project.safe_user_settings.make_hash())
+    results = await asyncio.gather(*[request() for _ in range(3)])
+    assert fake_chat_model.stats.calls == 1
+    assert all(result.alt_glosses == results[0].alt_glosses for result in results)
+
+    async with db_sessionmaker() as db:
+        cached = await generate_alt_glosses_with_user_translation(project.id, db, line.id, "HELLO")
+        assert len((await db.exec(select(CachedAltGlossGenerationResult))).all()) == 1
+    assert cached.alt_glosses == results[0].alt_glosses
+    assert fake_chat_model.stats.calls == 1
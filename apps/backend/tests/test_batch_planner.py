@@ -0,0 +1,40 @@
+"""Line batch planner unit test module."""
+
+from backend.database.models import Line
+from backend.tasks.preprocessing.batch_planner import BatchPlannerConfig, LineBatchPlanner
+
+
+def make_verse(verse_index: int, line_count: int) -> list[Line]:
+    return [Line(id=f"v{verse_index}-l{i}", verse_id=f"v{verse_index}", song_id="song", line_number=i, lyric="Shining through the city with a little funk and soul")
+            for i in range(line_count)]
+
+
+def test_small_verses_are_packed_together():
+    """Short verses share a batch instead of each becoming a separate LLM call."""
+    verses = [make_verse(i, 2) for i in range(4)]
+    batches, plan = LineBatchPlanner().plan(verses)
+
+    assert len(batches) == 1
+    assert [line.id for line in batches[0]] == [line.id for verse in verses for line in verse]
+    assert plan.batches[0].verse_count == 4
+
+
+def test_verse_boundaries_are_kept_when_packing():
+    """A verse is not split only to fill up the previous batch."""
+    config = BatchPlannerConfig(target_completion_tokens=1000, max_completion_tokens=1500)
+    verses = [make_verse(0, 6), make_verse(1, 6)]
+    batches, plan = LineBatchPlanner(config).plan(verses)
+
+    assert [len(batch) for batch in batches] == [6, 6]
+    assert all(b.completion_tokens <= config.max_completion_tokens for b in plan.batches)
+
+
+def test_long_verse_is_split_into_even_chunks():
+    """Verses exceeding the completion budget are split into near-equal chunks within the limit."""
+    config = BatchPlannerConfig(target_completion_tokens=1000, max_completion_tokens=1500)
+    verses = [make_verse(0, 30)]
+    batches, plan = LineBatchPlanner(config).plan(verses)
+
+    assert sum(len(batch) for batch in batches) == 30
+    assert max(len(batch) for batch in batches) - min(len(batch) for batch in batches) <= 1
+    assert all(b.completion_tokens <= config.max_completion_tokens for b in plan.batches)
@@ -0,0 +1,49 @@
+"""Bulk translation update endpoint unit test module."""
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.engine import db_sessionmaker
+from backend.database.models import InteractionLog, InteractionType, Line, LineTranslation, User
+from backend.router.app.project import BulkTranslationUpdateArgs, update_line_translations
+
+
+@pytest.mark.anyio
+async def test_bulk_update_applies_many_lines_at_once(benchmark_database):
+    """Created and updated rows are written in one transaction with one log per changed gloss; unchanged lines are left out."""
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 2, verse_count=1, lines_per_verse=4)
+        project = (await seed_synthetic_projects(db, songs, 1))[0]
+        lines = (await db.exec(select(Line).where(Line.song_id == project.song_id).order_by(Line.start_millis))).all()
+        other_line = (await db.exec(select(Line).where(Line.song_id != project.song_id))).first()
+        db.add(LineTranslation(project_id=project.id, line_id=lines[0].id, gloss="OLD", memo="Keep"))
+        db.add(LineTranslation(project_id=project.id, line_id=lines[3].id, gloss="SAME"))
+        await db.commit()
+
+    args = BulkTranslationUpdateArgs.model_validate({"translations": [
+        {"line_id": lines[0].id, "gloss": "NEW"},
+        {"line_id": lines[1].id, "gloss": "FIRST", "memo": "Memo"},
+        {"line_id": lines[2].id, "memo": "Only memo"},
+        {"line_id": lines[3].id, "gloss": "SAME"},
+    ]})
+    async with db_sessionmaker() as db:
+        user = await db.get(User, project.user_id)
+        changed = await update_line_translations(args, project.id, user, db)
+
+    assert [(t.line_id, t.gloss, t.memo) for t in changed] == [
+        (lines[0].id, "NEW", "Keep"), (lines[1].id, "FIRST", "Memo"), (lines[2].id, None, "Only memo")]
+    assert all(t.updated_at is not None for t in changed)
+
+    async with db_sessionmaker() as db:
+        assert len((await db.exec(select(LineTranslation))).all()) == 4
+        logs = (await db.exec(select(InteractionLog).where(InteractionLog.type == InteractionType.EnterGloss))).all()
+    assert sorted([(log.metadata_json["before"], log.metadata_json["after"], log.metadata_json["initial"]) for log in logs], key=str) == \
+        sorted([("OLD", "NEW", False), (None, "FIRST", True)], key=str)
+
+    async with db_sessionmaker() as db:
+        user = await db.get(User, project.user_id)
+        with pytest.raises(HTTPException):
+            await update_line_translations(BulkTranslationUpdateArgs.model_validate({"translations": [{"line_id": other_line.id, "gloss": "X"}]}),
+                                           project.id, user, db)
@@ -0,0 +1,66 @@
+"""Chat context query and per-thread cache unit test module."""
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.crud.project import fetch_line_annotation_by_line, fetch_line_inspection_by_line
+from backend.database.engine import db_sessionmaker
+from backend.database.models import GlossDescription, Line, LineTranslation, Project, Thread, User
+from backend.tasks.chat.chat_context import ChatContextCache, chat_context_cache, get_chat_context
+from backend.tasks.preprocessing import preprocess_song
+
+
+@pytest.mark.anyio
+async def test_chat_context_matches_the_rows_and_is_cached_per_thread(benchmark_database, fake_chat_model):
+    """The context built in one query matches the rows, is reused for the thread, and is rebuilt once invalidated."""
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=3)
+        project_id = (await seed_synthetic_projects(db, songs, 1))[0].id
+
+    async with db_sessionmaker() as db:
+        await preprocess_song(project_id, db, force=True)
+
+    chat_context_cache.clear()
+    async with db_sessionmaker() as db:
+        project = await db.get(Project, project_id)
+        user = await db.get(User, project.user_id)
+        line = (await db.exec(select(Line).order_by(Line.start_millis))).first()
+        thread = Thread(project_id=project_id, line_id=line.id)
+
+        context = await get_chat_context(db, thread)
+        inspection = await fetch_line_inspection_by_line(db, project_id, line.id)
+        annotation = await fetch_line_annotation_by_line(db, project_id, line.id)
+
+        assert (context.song_title, context.lyric) == (project.song.title, line.lyric)
+        assert context.user_name == (user.callable_name or user.alias)
+        assert context.sign_language == project.safe_user_settings.main_language
+        assert context.inspection.description == inspection.description
+        assert context.annotation.gloss == annotation.gloss and context.annotation.model_dump()["gloss_alts"] == [GlossDescription.model_validate(alt).model_dump() for alt in annotation.gloss_alts]
+        assert context.user_translation is None
+
+        db.add(LineTranslation(project_id=project_id, line_id=line.id, gloss="HELLO"))
+        await db.commit()
+
+        misses = chat_context_cache.misses
+        assert (await get_chat_context(db, thread)).user_translation is None
+        assert chat_context_cache.misses == misses
+
+        chat_context_cache.invalidate(project_id, line.id)
+        assert (await get_chat_context(db, thread)).user_translation == "HELLO"
+        assert chat_context_cache.misses == misses + 1
+
+        assert await get_chat_context(db, Thread(project_id=project_id, line_id="no-such-line")) is None
+
+
+
+def test_cache_evicts_least_recent_threads():
+    """Beyond its capacity, the cache drops the threads used least recently."""
+    cache = ChatContextCache(max_threads=2)
+    contexts = {thread_id: object() for thread_id in ["a", "b", "c"]}
+    cache.put("a", contexts["a"])
+    cache.put("b", contexts["b"])
+    assert cache.get("a") is contexts["a"]
+    cache.put("c", contexts["c"])
+    assert cache.get("b") is None
+    assert cache.get("a") is contexts["a"] and cache.get("c") is contexts["c"]
@@ -0,0 +1,115 @@
+"""Chat history budget and rolling summary unit test module."""
+
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from sqlmodel import select
+
+from backend.benchmark.fakes import RecordedChatResponse
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.engine import create_database_engine, create_db_and_tables, db_sessionmaker
+from backend.database.models import Line, MessageRole, Thread, ThreadMessage
+from backend.tasks.chat.memory import ChatMemoryConfig, ChatMemoryManager
+
+
+def make_thread(message_count: int, length: int = 10) -> Thread:
+    thread = Thread(project_id="project", line_id="line")
+    thread.messages = [ThreadMessage(thread_id=thread.id, project_id="project", role=MessageRole.User if i % 2 == 0 else MessageRole.Assistant,
+                                     message=f"{i} " + "word " * length) for i in range(message_count)]
+    return thread
+
+
+def test_history_keeps_the_last_turns_within_the_budget():
+    """Only the last turns within the budget are replayed after the summary; the ones before them are left to the summary."""
+    memory = ChatMemoryManager(ChatMemoryConfig(recent_turns=4, summarize_every_turns=2, history_token_budget=100))
+
+    short_thread = make_thread(4)
+    assert [message.content.split()[0] for message in memory.build_history(short_thread)] == ["0", "1", "2", "3"]
+
+    # Turns before the last four are summarized once there are two of them, but are not replayed meanwhile.
+    assert memory._summarizable_count(make_thread(10, length=1)) == 0
+    assert [message.content.split()[0] for message in memory.build_history(make_thread(10, length=1))] == [str(i) for i in range(2, 10)]
+    assert memory._summarizable_count(make_thread(12, length=1)) == 4
+
+    # Over the budget, only the last turn stays in the window and the rest is summarized right away.
+    long_thread = make_thread(8, length=200)
+    history = memory.build_history(long_thread)
+    assert [message.content.split()[0] for message in history] == ["6", "7"]
+    assert [type(message) for message in history] == [HumanMessage, AIMessage]
+    assert memory._summarizable_count(long_thread) == 6
+
+    long_thread.summary, long_thread.summarized_message_count = "They talked.", 6
+    history = memory.build_history(long_thread)
+    assert isinstance(history[0], SystemMessage) and "They talked." in history[0].content
+    assert [message.content.split()[0] for message in history[1:]] == ["6", "7"]
+    assert memory._summarizable_count(long_thread) == 0
+
+
+@pytest.mark.anyio
+async def test_older_turns_are_summarized_in_the_background(benchmark_database, fake_chat_model):
+    """Once enough turns fall out of the recent window, they are folded into the stored summary and no longer replayed."""
+    prompts: list[str] = []
+
+    def respond(messages, tools):
+        prompts.append(messages[-1].content)
+        return RecordedChatResponse(content=f"summary {len(prompts)}")
+
+    fake_chat_model.responder = respond
+    memory = ChatMemoryManager(ChatMemoryConfig(recent_turns=2, summarize_every_turns=2))
+
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=1)
+        project = (await seed_synthetic_projects(db, songs, 1))[0]
+        line = (await db.exec(select(Line))).first()
+        thread = Thread(project_id=project.id, line_id=line.id)
+        db.add(thread)
+        await db.commit()
+
+    async def add_turns(start: int, count: int):
+        async with db_sessionmaker() as db:
+            db.add_all([ThreadMessage(thread_id=thread.id, project_id=project.id, role=MessageRole.User if i % 2 == 0 else MessageRole.Assistant,
+                                      message=f"message {i}") for i in range(start, start + 2 * count)])
+            await db.commit()
+        memory.schedule_summary(thread.id, fake_chat_model)
+        await memory.drain()
+
+    async def load_thread() -> Thread:
+        async with db_sessionmaker() as db:
+            return await db.get(Thread, thread.id)
+
+    # Three turns leave one outside the window, fewer than a summary covers.
+    await add_turns(0, 3)
+    assert (await load_thread()).summary is None and len(prompts) == 0
+
+    await add_turns(6, 1)
+    stored = await load_thread()
+    assert (stored.summary, stored.summarized_message_count) == ("summary 1", 4)
+    assert "message 3" in prompts[0] and "message 4" not in prompts[0]
+    assert [message.content for message in memory.build_history(stored)[1:]] == [f"message {i}" for i in range(4, 8)]
+
+    # The next summary builds on the previous one.
+    await add_turns(8, 2)
+    stored = await load_thread()
+    assert (stored.summary, stored.summarized_message_count) == ("summary 2", 8)
+    assert "summary 1" in prompts[1] and "message 4" in prompts[1] and "message 3" not in prompts[1]
+
+
+def test_summary_columns_are_added_to_an_existing_thread_table(tmp_path):
+    """A database created before the thread summaries gets their columns, once, and its threads read as unsummarized."""
+
+    async def run():
+        engine = create_database_engine(str(tmp_path / "database.db"))
+        async with engine.begin() as conn:
+            await conn.exec_driver_sql("CREATE TABLE thread (id VARCHAR NOT NULL PRIMARY KEY, created_at DATETIME, updated_at DATETIME, "
+                                       "project_id VARCHAR NOT NULL, line_id VARCHAR NOT NULL)")
+            await conn.exec_driver_sql("INSERT INTO thread (id, project_id, line_id) VALUES ('thread', 'project', 'line')")
+
+        await create_db_and_tables(engine)
+        await create_db_and_tables(engine)
+
+        async with engine.connect() as conn:
+            assert (await conn.exec_driver_sql("SELECT summary, summarized_message_count FROM thread")).fetchall() == [(None, 0)]
+        await engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,95 @@
+"""Offline chat model stand-in unit test module."""
+
+import asyncio
+import json
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+
+from backend.benchmark.fakes import (ChatResponseRecording, FailureInjection, FakeChatModel, LatencyDistribution, LatencyModel,
+                                     RecordedChatResponse)
+from backend.tasks.chain_mapper import LineLevelChainMapper
+
+
+class LyricLine(BaseModel):
+    id: str
+    lyric: str
+
+class LyricsInput(BaseModel):
+    lyric_lines: list[LyricLine]
+
+class GlossElement(BaseModel):
+    line_id: str
+    gloss: str
+
+class GlossResult(BaseModel):
+    glosses: list[GlossElement]
+
+
+class GlossPipeline(LineLevelChainMapper[LyricsInput, GlossResult, GlossElement]):
+
+    def __init__(self, model: FakeChatModel) -> None:
+        super().__init__("FakeGloss", GlossResult, "Gloss the lines.", model)
+
+    @classmethod
+    def _input_to_str(cls, input: LyricsInput, config: RunnableConfig) -> str:
+        return json.dumps({"lyrics": [{"id": str(i), "lyric": line.lyric} for i, line in enumerate(input.lyric_lines)]})
+
+    @classmethod
+    def _postprocess_output(cls, output: GlossResult, config: RunnableConfig) -> GlossResult:
+        output.glosses = cls._map_line_indices(output.glosses, config["metadata"]["lyric_lines"])
+        return output
+
+    @classmethod
+    def _get_input_lines(cls, input: LyricsInput) -> list[LyricLine]:
+        return input.lyric_lines
+
+    @classmethod
+    def _make_partial_input(cls, input: LyricsInput, line_ids: set[str]) -> LyricsInput:
+        return LyricsInput(lyric_lines=[line for line in input.lyric_lines if line.id in line_ids])
+
+    @classmethod
+    def _get_output_elements(cls, output: GlossResult) -> list[GlossElement]:
+        return output.glosses
+
+    @classmethod
+    def _make_output(cls, elements: list[GlossElement]) -> GlossResult:
+        return GlossResult(glosses=elements)
+
+
+NO_LATENCY = LatencyModel(distribution=LatencyDistribution.Constant, median_seconds=0)
+
+
+def test_synthesized_structured_output_is_repaired():
+    """Synthesized outputs follow the tool schema, and dropped lines are recovered by the line-level repair."""
+    model = FakeChatModel(latency=NO_LATENCY, failures=FailureInjection(drop_line_rate=0.3), seed=1)
+    pipeline = GlossPipeline(model)
+    lines = [LyricLine(id=f"line-{i}", lyric=f"lyric {i}") for i in range(8)]
+
+    result = asyncio.run(pipeline.run(LyricsInput(lyric_lines=lines)))
+
+    assert [g.line_id for g in result.glosses] == [line.id for line in lines]
+    assert model.stats.dropped_elements > 0
+    assert model.stats.calls > 1
+
+
+def test_recorded_responses_are_replayed_in_order():
+    """Repeated requests replay the recorded responses in order, and the run is deterministic for a seed."""
+    messages = [HumanMessage(content="Hello")]
+    recording = ChatResponseRecording()
+    key = ChatResponseRecording.make_key(messages, None)
+    recording.add(key, RecordedChatResponse(content="first"))
+    recording.add(key, RecordedChatResponse(content="second"))
+
+    model = FakeChatModel(recording=recording, latency=NO_LATENCY)
+    assert [model.invoke(messages).content for _ in range(3)] == ["first", "second", "first"]
+    assert model.stats.replayed == 3
+
+    latency = LatencyModel(median_seconds=0.01, spread=0.5)
+    runs = []
+    for _ in range(2):
+        model = FakeChatModel(latency=latency, seed=7)
+        model.invoke(messages)
+        runs.append(model.stats.simulated_latency_seconds)
+    assert runs[0] == runs[1]
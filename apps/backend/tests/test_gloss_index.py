@@ -0,0 +1,118 @@
+"""Accepted gloss index and gloss reuse in preprocessing unit test module."""
+
+import asyncio
+import json
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.crud.project import count_accepted_line_glosses, fetch_line_annotations_by_project
+from backend.database.engine import db_sessionmaker
+from backend.database.models import Line, ProjectConfiguration, SignLanguageType
+from backend.tasks.preprocessing import preprocess_song
+from backend.tasks.preprocessing.gloss_index import LineGlossEntry, LineGlossIndex, line_gloss_index, make_gloss_settings_hash
+from backend.tasks.translation_coalescer import TranslationUpsertCoalescer
+
+
+def make_entry(i: int, lyric: str, settings_hash: str = "asl") -> LineGlossEntry:
+    return LineGlossEntry(project_id="project", line_id=f"line-{i}", lyric=lyric, gloss=f"GLOSS-{i}", settings_hash=settings_hash)
+
+
+def test_repeated_lines_find_the_accepted_gloss(tmp_path):
+    """Exact and near-duplicate lines of the same settings match, others do not, and the index survives a restart through its log."""
+    index = LineGlossIndex(str(tmp_path), min_similarity=0.8)
+    index.upsert(make_entry(0, "Cause I, I, I'm in the stars tonight"))
+    index.upsert(make_entry(1, "So watch me bring the fire and set the night alight"))
+    index.upsert(make_entry(2, "Shining through the city with a little funk and soul", settings_hash="bsl"))
+
+    exact, near, other, other_settings = index.search(["'cause I I I'm in the stars TONIGHT!", "So watch me bring the fire, set the night alight",
+                                                       "Shining through the city with a little funk and soul", "Light it up like dynamite"], "asl")
+    assert (exact.entry.gloss, exact.exact) == ("GLOSS-0", True)
+    assert (near.entry.gloss, near.exact) == ("GLOSS-1", False) and 0.8 <= near.similarity < 1
+    assert other is None and other_settings is None
+    assert (index.exact_hits, index.near_hits, index.misses) == (1, 1, 2)
+
+    index.upsert(make_entry(0, "Cause I, I, I'm in the stars tonight").model_copy(update={"gloss": "STAR ME"}))
+    index.remove("project", "line-1")
+    asyncio.run(index.persist())
+
+    restarted = LineGlossIndex(str(tmp_path), min_similarity=0.8)
+    assert restarted.load() and len(restarted) == 2
+    # Compacted into a snapshot and an empty log.
+    asyncio.run(restarted.save())
+    assert restarted.row_count == 2 and (tmp_path / LineGlossIndex.LOG_FILENAME).read_text() == ""
+    assert restarted.load() and len(restarted) == 2
+    assert [match.entry.gloss if match is not None else None for match in restarted.search(["Cause I, I, I'm in the stars tonight", "So watch me bring the fire and set the night alight"], "asl")] == ["STAR ME", None]
+
+
+def test_saving_a_line_again_reuses_its_row():
+    """Repeated edits of a gloss overwrite the row of the line, and the rows of removed lines are reclaimed on save."""
+    index = LineGlossIndex(min_similarity=0.8)
+    for i in range(1000):
+        index.upsert(make_entry(0, "Cause I, I, I'm in the stars tonight").model_copy(update={"gloss": f"STAR {i}"}))
+    assert (len(index), index.row_count) == (1, 1)
+    assert index.search(["Cause I, I, I'm in the stars tonight"], "asl")[0].entry.gloss == "STAR 999"
+
+    for i in range(1, 100):
+        index.upsert(make_entry(i, f"line number {i}"))
+    for i in range(1, 100, 2):
+        index.remove("project", f"line-{i}")
+    asyncio.run(index.save())
+    assert (len(index), index.row_count) == (50, 50)
+    assert [m.entry.line_id if m is not None else None for m in index.search(["line number 2", "line number 3"], "asl", min_similarity=1)] == ["line-2", None]
+
+
+def test_clustered_search_matches_the_flat_search():
+    """Once the index is clustered, near-duplicates are still found by probing the nearest lists."""
+    lyrics = [f"line {i} of song {i % 37} with words {i * 7 % 101} and {i * 13 % 89}" for i in range(600)]
+    flat = LineGlossIndex(min_similarity=0.85, ivf_min_entries=10_000)
+    clustered = LineGlossIndex(min_similarity=0.85, ivf_min_entries=256)
+    for i, lyric in enumerate(lyrics):
+        flat.upsert(make_entry(i, lyric))
+        clustered.upsert(make_entry(i, lyric))
+    assert clustered.is_clustered and not flat.is_clustered
+
+    queries = [lyric.replace(" and ", " & ") for lyric in lyrics[::20]]
+    assert [m.entry.line_id for m in clustered.search(queries, "asl")] == [m.entry.line_id for m in flat.search(queries, "asl")]
+
+
+@pytest.mark.anyio
+async def test_preprocessing_reuses_glosses_saved_in_another_project(benchmark_database, fake_chat_model):
+    """Glosses saved in one project are indexed on write, and a project with the same gloss settings sends only the other lines to the LLM."""
+    gloss_lines: list[int] = []
+
+    def respond(messages, tools):
+        if tools[0]["function"]["name"].startswith("GlossGeneration"):
+            gloss_lines.append(len(json.loads(messages[-1].content)["lyrics"]))
+        return None
+
+    fake_chat_model.responder = respond
+
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=2, lines_per_verse=4)
+        source, target = await seed_synthetic_projects(db, songs, 2, distinct_settings=False)
+        lines = (await db.exec(select(Line).order_by(Line.start_millis))).all()
+
+    coalescer = TranslationUpsertCoalescer(window_seconds=0, prefetch_alt_glosses=False)
+    async with db_sessionmaker() as db:
+        for line in lines[:5]:
+            await coalescer.upsert(db, source.user_id, source.id, line.id, {"gloss": f"ACCEPTED {line.lyric.upper()}"})
+        await coalescer.upsert(db, source.user_id, source.id, lines[5].id, {"gloss": "  "})
+    await coalescer.flush()
+    assert len(line_gloss_index) == 5
+
+    # A blank gloss is not counted either, so the index on disk matches the database and is not rebuilt.
+    async with db_sessionmaker() as db:
+        assert await count_accepted_line_glosses(db) == 5
+
+    async with db_sessionmaker() as db:
+        await preprocess_song(target.id, db, force=True)
+        annotations = {a.line_id: a for a in await fetch_line_annotations_by_project(db, target.id, None)}
+
+    assert sum(gloss_lines) == len(lines) - 5
+    assert [annotations[line.id].gloss for line in lines[:5]] == [f"ACCEPTED {line.lyric.upper()}" for line in lines[:5]]
+
+    # Other gloss settings do not share the accepted glosses.
+    other_settings = make_gloss_settings_hash(ProjectConfiguration(main_language=SignLanguageType.PSE))
+    assert all(match is None for match in line_gloss_index.search([line.lyric for line in lines], other_settings))
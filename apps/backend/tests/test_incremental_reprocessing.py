@@ -0,0 +1,145 @@
+"""Incremental reprocessing on settings changes unit test module."""
+
+import asyncio
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.crud.project import fetch_line_annotations_by_project, fetch_line_inspections_by_project
+from backend.database.engine import db_sessionmaker
+from backend.database.models import AgeGroup, BodyLanguage, LineAnnotation, LineInspection, Project, ProjectConfiguration, SignLanguageType, SigningSpeed
+from backend.tasks.preprocessing import join_reprocessings, make_line_batches, preprocess_song, project_reprocessings, reprocess_song, start_reprocess_song
+from backend.tasks.preprocessing.common import PreprocessingStage, get_affected_stages
+
+
+def test_affected_stages_follow_the_dependencies():
+    """A changed setting affects the stages reading it and every stage downstream of them."""
+    settings = ProjectConfiguration()
+
+    assert get_affected_stages(settings, settings) == set()
+    assert get_affected_stages(settings, settings.model_copy(update={"body_language": BodyLanguage.Rich})) == {PreprocessingStage.PerformanceGuide}
+    assert get_affected_stages(settings, settings.model_copy(update={"signing_speed": SigningSpeed.Fast})) == {PreprocessingStage.GlossOptions}
+    assert get_affected_stages(settings, settings.model_copy(update={"age_group": AgeGroup.Children})) == \
+        {PreprocessingStage.BaseGloss, PreprocessingStage.PerformanceGuide, PreprocessingStage.GlossOptions}
+    assert get_affected_stages(settings, settings.model_copy(update={"main_language": SignLanguageType.PSE})) == set(PreprocessingStage)
+
+
+def test_latest_inspections_of_a_processing_without_challenges_are_empty():
+    """A current version without inspections has none; only projects from before the versions fall back to every inspection."""
+    def make_project(last_processing_id: str | None) -> Project:
+        project = Project(user_id="user", song_id="song", last_processing_id=last_processing_id)
+        project.annotations = [LineAnnotation(project_id=project.id, processing_id="second", line_id="line", gloss="GLOSS", gloss_description=None,
+                                              facial_expression="", body_gesture="", emotion_description="")]
+        project.inspections = [LineInspection(project_id=project.id, processing_id="first", line_id="line", challenges=[], description="")]
+        return project
+
+    assert make_project("second").latest_inspections == []
+    assert len(make_project(None).latest_inspections) == 1
+
+
+@pytest.mark.anyio
+async def test_reprocessing_reruns_only_affected_stages(benchmark_database, fake_chat_model):
+    """A signing speed change runs only the gloss options again; the other outputs are carried over to a new version and earlier versions are kept."""
+    called_tools: list[str] = []
+
+    def respond(messages, tools):
+        called_tools.append(tools[0]["function"]["name"])
+        return None
+
+    fake_chat_model.responder = respond
+
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=2, lines_per_verse=3)
+        project_id = (await seed_synthetic_projects(db, songs, 1, distinct_settings=False))[0].id
+
+    async with db_sessionmaker() as db:
+        await preprocess_song(project_id, db, force=True)
+        project = await db.get(Project, project_id)
+        first_processing_id = project.last_processing_id
+        before = {a.line_id: a for a in await fetch_line_annotations_by_project(db, project_id, None)}
+        inspections_before = [(i.line_id, i.challenges, i.description) for i in await fetch_line_inspections_by_project(db, project_id, None)]
+        batch_count = len(make_line_batches(project.song))
+
+    calls_before = fake_chat_model.stats.calls
+    async with db_sessionmaker() as db:
+        project = await db.get(Project, project_id)
+        previous_settings = project.safe_user_settings
+        project.user_settings = previous_settings.model_copy(update={"signing_speed": SigningSpeed.Fast}).model_dump()
+        db.add(project)
+        await db.commit()
+        stages = await reprocess_song(project_id, db, previous_settings)
+
+    assert stages == {PreprocessingStage.GlossOptions}
+    assert fake_chat_model.stats.calls - calls_before == batch_count
+    assert all(tool.startswith("GlossOption") for tool in called_tools[-batch_count:])
+
+    async with db_sessionmaker() as db:
+        project = await db.get(Project, project_id)
+        assert project.last_processing_id != first_processing_id
+        after = {a.line_id: a for a in await fetch_line_annotations_by_project(db, project_id, None)}
+        all_annotations = (await db.exec(select(LineAnnotation).where(LineAnnotation.project_id == project_id))).all()
+        inspections_after = [(i.line_id, i.challenges, i.description) for i in await fetch_line_inspections_by_project(db, project_id, None)]
+
+    assert after.keys() == before.keys()
+    assert all((after[line_id].gloss, after[line_id].facial_expression) == (before[line_id].gloss, before[line_id].facial_expression) for line_id in after)
+    assert inspections_after == inspections_before
+    assert all(a.processing_id == project.last_processing_id for a in after.values())
+    assert len(all_annotations) == 2 * len(after)
+
+    # No affected stage, no new version.
+    async with db_sessionmaker() as db:
+        assert await reprocess_song(project_id, db, project.safe_user_settings) == set()
+    assert fake_chat_model.stats.calls - calls_before == batch_count
+
+    # Versions before the previous one are deleted.
+    second_processing_id = project.last_processing_id
+    async with db_sessionmaker() as db:
+        project = await db.get(Project, project_id)
+        previous_settings = project.safe_user_settings
+        project.user_settings = previous_settings.model_copy(update={"body_language": BodyLanguage.Rich}).model_dump()
+        db.add(project)
+        await db.commit()
+        assert await reprocess_song(project_id, db, previous_settings) == {PreprocessingStage.PerformanceGuide}
+
+    async with db_sessionmaker() as db:
+        project = await db.get(Project, project_id)
+        assert set(a.processing_id for a in project.annotations) == {second_processing_id, project.last_processing_id}
+        assert len(project.annotations) == 2 * len(after)
+        assert set(i.processing_id for i in project.inspections) <= {second_processing_id, project.last_processing_id}
+
+
+@pytest.mark.anyio
+async def test_background_reprocessings_of_a_project_run_in_order(benchmark_database, fake_chat_model):
+    """A change made during a reprocessing runs after it, and also covers the changes of a reprocessing that failed."""
+    failing = True
+
+    def respond(messages, tools):
+        if failing and tools[0]["function"]["name"].startswith("GlossOption"):
+            raise RuntimeError("Gloss options unavailable")
+        return None
+
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=2)
+        project_id = (await seed_synthetic_projects(db, songs, 1, distinct_settings=False))[0].id
+        await preprocess_song(project_id, db, force=True)
+
+    async def change_settings(**update) -> asyncio.Task:
+        async with db_sessionmaker() as db:
+            project = await db.get(Project, project_id)
+            previous_settings = project.safe_user_settings
+            project.user_settings = previous_settings.model_copy(update=update).model_dump()
+            db.add(project)
+            await db.commit()
+        return start_reprocess_song(project_id, previous_settings)
+
+    fake_chat_model.responder = respond
+    first = await change_settings(signing_speed=SigningSpeed.Fast)
+    second = await change_settings(body_language=BodyLanguage.Rich)
+    await asyncio.wait([first])
+    failing = False
+    await join_reprocessings()
+
+    assert first.exception() is not None
+    assert second.result() == {PreprocessingStage.GlossOptions, PreprocessingStage.PerformanceGuide}
+    assert project_id not in project_reprocessings
@@ -0,0 +1,56 @@
+"""Local intent classification fast path unit test module."""
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.fakes import RecordedChatResponse
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.engine import db_sessionmaker
+from backend.database.models import ChatIntent, Line, MessageRole, Thread, ThreadMessage
+from backend.tasks.chat import chatbot
+from backend.tasks.chat.intent_fast_path import IntentSource, LocalIntentClassifier, load_logged_intent_examples
+
+
+@pytest.mark.anyio
+async def test_confident_messages_skip_the_llm(monkeypatch, fake_chat_model):
+    """Messages the local classifier is sure about are classified without the LLM; the others are learned from the LLM's answer."""
+
+    def respond(messages, tools):
+        return RecordedChatResponse(tool_calls=[{"name": tools[0]["function"]["name"], "args": {"intent": "emoting"}}])
+
+    fake_chat_model.responder = respond
+    monkeypatch.setattr(chatbot, "local_intent_classifier", LocalIntentClassifier())
+
+    assert await chatbot.resolve_user_intent("What is the deeper meaning of this line?") == (ChatIntent.Meaning, IntentSource.Local)
+    assert fake_chat_model.stats.calls == 0
+
+    message = "Should I frown or smile while signing the chorus?"
+    assert await chatbot.resolve_user_intent(message) == (ChatIntent.Emoting, IntentSource.LLM)
+    assert fake_chat_model.stats.calls == 1
+
+    for _ in range(3):
+        chatbot.local_intent_classifier.add_example(message, ChatIntent.Emoting)
+    assert await chatbot.resolve_user_intent(message) == (ChatIntent.Emoting, IntentSource.Local)
+    assert fake_chat_model.stats.calls == 1
+
+
+@pytest.mark.anyio
+async def test_training_uses_only_llm_labeled_messages(benchmark_database):
+    """Messages labeled by the local classifier itself, and unlabeled ones, are not training examples."""
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=1)
+        project = (await seed_synthetic_projects(db, songs, 1))[0]
+        line = (await db.exec(select(Line))).first()
+        thread = Thread(project_id=project.id, line_id=line.id)
+        db.add(thread)
+        db.add_all([
+            ThreadMessage(thread_id=thread.id, project_id=project.id, role=MessageRole.User, message="from llm", intent=ChatIntent.Timing,
+                          message_metadata={"intent_source": IntentSource.LLM}),
+            ThreadMessage(thread_id=thread.id, project_id=project.id, role=MessageRole.User, message="from local", intent=ChatIntent.Meaning,
+                          message_metadata={"intent_source": IntentSource.Local}),
+            ThreadMessage(thread_id=thread.id, project_id=project.id, role=MessageRole.User, message="unlabeled"),
+            ThreadMessage(thread_id=thread.id, project_id=project.id, role=MessageRole.Assistant, message="reply", intent=ChatIntent.Timing),
+        ])
+        await db.commit()
+
+        assert await load_logged_intent_examples(db) == [("from llm", ChatIntent.Timing)]
@@ -0,0 +1,89 @@
+"""Per-line annotation micro-batching unit test module."""
+
+import asyncio
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.engine import db_sessionmaker
+from backend.database.models import Line, LineAnnotation, LineTranslation, Project, ProjectConfiguration
+from backend.tasks.preprocessing import generate_line_annotation_with_user_translation, line_annotation_batcher
+from backend.tasks.preprocessing.line_annotation_batcher import LineAnnotationBatcher
+
+
+def make_line(i: int) -> Line:
+    return Line(id=f"line-{i}", song_id="song", verse_id="verse", line_number=i, lyric=f"lyric {i}", tokens=[], start_millis=i * 1000, end_millis=(i + 1) * 1000)
+
+
+def test_requests_within_window_share_a_batch():
+    """Lines requested within the window go out as one batch in line order; a line with a new gloss goes to the next batch."""
+    batches: list[list[tuple[str, str]]] = []
+
+    async def run_batch(project, lines, user_translations, user_settings):
+        batches.append([(line.id, translation) for line, translation in zip(lines, user_translations)])
+        await asyncio.sleep(0.01)
+        return [LineAnnotation(project_id=project.id, line_id=line.id, gloss=translation, gloss_description=None,
+                               facial_expression="", body_gesture="", emotion_description="") for line, translation in zip(lines, user_translations)]
+
+    async def run():
+        batcher = LineAnnotationBatcher(run_batch, window_seconds=0.05)
+        project, settings = Project(id="project", user_id="user", song_id="song"), ProjectConfiguration()
+        lines = [make_line(i) for i in range(3)]
+
+        annotations = await asyncio.gather(batcher.request(project, lines[2], "C", settings),
+                                           batcher.request(project, lines[0], "A", settings),
+                                           batcher.request(project, lines[0], "A", settings),
+                                           batcher.request(project, lines[1], "B", settings))
+        assert [annotation.gloss for annotation in annotations] == ["C", "A", "A", "B"]
+        assert batches == [[("line-0", "A"), ("line-1", "B"), ("line-2", "C")]]
+
+        await asyncio.gather(batcher.request(project, lines[0], "A", settings), batcher.request(project, lines[0], "AA", settings))
+        assert batches[1:] == [[("line-0", "A")], [("line-0", "AA")]]
+        assert (batcher.dispatched_batches, batcher.dispatched_lines) == (3, 5)
+
+    asyncio.run(run())
+
+
+def test_untimed_lines_are_batched_after_timed_ones():
+    """Lines without timestamps go after the timed lines of a batch, and a failing batch fails every waiter."""
+    batches: list[list[str]] = []
+
+    async def run_batch(project, lines, user_translations, user_settings):
+        batches.append([line.id for line in lines])
+        raise ValueError("Chain failed.")
+
+    async def run():
+        batcher = LineAnnotationBatcher(run_batch, window_seconds=0.01)
+        project, settings = Project(id="project", user_id="user", song_id="song"), ProjectConfiguration()
+        untimed = make_line(0).model_copy(update={"start_millis": None, "end_millis": None})
+
+        results = await asyncio.wait_for(asyncio.gather(batcher.request(project, untimed, "A", settings), batcher.request(project, make_line(1), "B", settings),
+                                                        return_exceptions=True), timeout=1)
+        assert batches == [["line-1", "line-0"]]
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(run())
+
+
+@pytest.mark.anyio
+async def test_line_annotations_are_generated_in_one_call_per_chain(benchmark_database, fake_chat_model):
+    """Concurrent annotation requests for several lines of a project call each chain once."""
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=4)
+        project = (await seed_synthetic_projects(db, songs, 1))[0]
+        lines = (await db.exec(select(Line).order_by(Line.start_millis))).all()
+        db.add_all([LineTranslation(project_id=project.id, line_id=line.id, gloss=line.lyric.upper()) for line in lines])
+        await db.commit()
+
+    async def request(line: Line) -> LineAnnotation | None:
+        async with db_sessionmaker() as db:
+            return await generate_line_annotation_with_user_translation(project.id, db, line.id)
+
+    dispatched_batches = line_annotation_batcher.dispatched_batches
+    annotations = await asyncio.gather(*[request(line) for line in lines])
+
+    assert [annotation.line_id for annotation in annotations] == [line.id for line in lines]
+    assert [annotation.gloss for annotation in annotations] == [line.lyric.upper() for line in lines]
+    assert line_annotation_batcher.dispatched_batches - dispatched_batches == 1
+    assert fake_chat_model.stats.calls == 2
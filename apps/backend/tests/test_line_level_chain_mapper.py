@@ -0,0 +1,76 @@
+"""Line-level chain mapper unit test module."""
+
+import asyncio
+import json
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+
+from backend.tasks.chain_mapper import LineLevelChainMapper
+
+
+class EchoLine(BaseModel):
+    id: str
+    lyric: str
+
+class EchoInput(BaseModel):
+    lyric_lines: list[EchoLine]
+
+class EchoElement(BaseModel):
+    line_id: str
+    text: str
+
+class EchoResult(BaseModel):
+    elements: list[EchoElement]
+
+
+class EchoPipeline(LineLevelChainMapper[EchoInput, EchoResult, EchoElement]):
+
+    def __init__(self, responses: list[str]) -> None:
+        self.model = FakeListChatModel(responses=responses)
+        super().__init__("Echo", EchoResult, "Echo the lines.", self.model)
+
+    @classmethod
+    def _input_to_str(cls, input: EchoInput, config: RunnableConfig) -> str:
+        return json.dumps([line.lyric for line in input.lyric_lines])
+
+    @classmethod
+    def _postprocess_output(cls, output: EchoResult, config: RunnableConfig) -> EchoResult:
+        output.elements = cls._map_line_indices(output.elements, config["metadata"]["lyric_lines"])
+        return output
+
+    @classmethod
+    def _get_input_lines(cls, input: EchoInput) -> list[EchoLine]:
+        return input.lyric_lines
+
+    @classmethod
+    def _make_partial_input(cls, input: EchoInput, line_ids: set[str]) -> EchoInput:
+        return EchoInput(lyric_lines=[line for line in input.lyric_lines if line.id in line_ids])
+
+    @classmethod
+    def _get_output_elements(cls, output: EchoResult) -> list[EchoElement]:
+        return output.elements
+
+    @classmethod
+    def _make_output(cls, elements: list[EchoElement]) -> EchoResult:
+        return EchoResult(elements=elements)
+
+
+def make_response(*elements: tuple[str, str]) -> str:
+    return json.dumps({"elements": [{"line_id": line_id, "text": text} for line_id, text in elements]})
+
+
+def test_missing_lines_are_requested_again():
+    """Only the lines missing from the first response are re-requested, and the results are merged in the input order."""
+    lines = [EchoLine(id=f"line-{i}", lyric=f"lyric {i}") for i in range(4)]
+    pipeline = EchoPipeline([
+        make_response(("0", "a"), ("2", "c"), ("9", "out of range")),
+        # The partial request only contains the missing lines, so indices restart from 0.
+        make_response(("1", "d"), ("0", "b")),
+    ])
+
+    result = asyncio.run(pipeline.run(EchoInput(lyric_lines=lines)))
+
+    assert [(e.line_id, e.text) for e in result.elements] == [("line-0", "a"), ("line-1", "b"), ("line-2", "c"), ("line-3", "d")]
+    assert pipeline.model.i == 0 # Both responses were consumed, and no more.
@@ -0,0 +1,116 @@
+"""Media download manager unit test module."""
+
+import asyncio
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+from threading import Thread
+
+import pytest
+
+from backend.database.models import MediaType
+from backend.tasks.media_preparation.media import DownloadProgressEvent, MediaDownloadManager
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves fixture files with support for the Range header, like a media CDN does."""
+
+    requested_ranges: list[str] = []
+
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        if range_header is None:
+            return super().send_head()
+
+        self.requested_ranges.append(range_header)
+        file_path = self.translate_path(self.path)
+        size = os.path.getsize(file_path)
+        start = int(re.match(r"bytes=(\d+)-", range_header).group(1))
+
+        f = open(file_path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        return f
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def media_server(tmp_path):
+    """Local HTTP stand-in serving an audio and a video fixture file."""
+    serve_dir = tmp_path / "serve"
+    serve_dir.mkdir()
+    fixtures = {
+        "audio.m4a": os.urandom(256 * 1024),
+        "video.mp4": os.urandom(512 * 1024),
+    }
+    for name, content in fixtures.items():
+        (serve_dir / name).write_bytes(content)
+
+    RangeRequestHandler.requested_ranges = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeRequestHandler, directory=str(serve_dir)))
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    info = {
+        "id": "fixture",
+        "title": "fixture",
+        "extractor": "generic",
+        "extractor_key": "Generic",
+        "webpage_url": base_url,
+        "formats": [
+            {"format_id": "audio", "url": f"{base_url}/audio.m4a", "ext": "m4a", "acodec": "mp4a.40.2", "vcodec": "none"},
+            {"format_id": "video", "url": f"{base_url}/video.mp4", "ext": "mp4", "acodec": "none", "vcodec": "avc1.4d401f"},
+        ],
+    }
+
+    yield info, fixtures
+
+    server.shutdown()
+
+
+def test_download_audio_and_video_from_shared_info(media_server, tmp_path):
+    """Audio and video streams are fetched concurrently from a single info extraction."""
+    info, fixtures = media_server
+    events: list[DownloadProgressEvent] = []
+    manager = MediaDownloadManager(on_progress=events.append, convert=False)
+
+    audio_path = str(tmp_path / "audio")
+    video_path = str(tmp_path / "video.mp4")
+
+    async def download():
+        await asyncio.gather(manager.download_audio(info, audio_path), manager.download_video(info, video_path))
+
+    asyncio.run(download())
+
+    with open(audio_path, "rb") as f:
+        assert f.read() == fixtures["audio.m4a"]
+    with open(video_path, "rb") as f:
+        assert f.read() == fixtures["video.mp4"]
+
+    finished = {e.media_type for e in events if e.status == "finished"}
+    assert finished == {MediaType.Audio, MediaType.Video}
+
+
+def test_resume_partial_download(media_server, tmp_path):
+    """An interrupted download continues from its .part file instead of starting over."""
+    info, fixtures = media_server
+    manager = MediaDownloadManager(convert=False)
+
+    video_path = str(tmp_path / "video.mp4")
+    partial_size = len(fixtures["video.mp4"]) // 2
+    with open(video_path + ".part", "wb") as f:
+        f.write(fixtures["video.mp4"][:partial_size])
+
+    asyncio.run(manager.download_video(info, video_path))
+
+    with open(video_path, "rb") as f:
+        assert f.read() == fixtures["video.mp4"]
+    assert f"bytes={partial_size}-" in RangeRequestHandler.requested_ranges
@@ -0,0 +1,57 @@
+"""Model tier routing and escalation unit test module."""
+
+import asyncio
+
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+
+from backend.benchmark.fakes import FakeChatModel, LatencyDistribution, LatencyModel, RecordedChatResponse
+from backend.tasks.chain_mapper import ChainMapper
+from backend.tasks.model_routing import ModelTier, get_model_route
+
+
+class Choice(BaseModel):
+    index: int
+
+
+class ChoiceMapper(ChainMapper[int, Choice]):
+
+    @classmethod
+    def _input_to_str(cls, input: int, config: RunnableConfig) -> str:
+        return f"Choose one of {input} options."
+
+    @classmethod
+    def _postprocess_output(cls, output: Choice, config: RunnableConfig) -> Choice:
+        assert 0 <= output.index < 2, "The index is out of range."
+        return output
+
+
+def make_model(index: int) -> FakeChatModel:
+    return FakeChatModel(responder=lambda messages, tools: RecordedChatResponse(tool_calls=[{"name": tools[0]["function"]["name"], "args": {"index": index}}]),
+                         latency=LatencyModel(distribution=LatencyDistribution.Constant, median_seconds=0))
+
+
+def test_simple_choices_route_to_the_fast_model():
+    """Intent classification and best-match selection run on the fast model and escalate to the standard one; other pipelines stay on the standard model."""
+    for name in ["intent_classifier", "best_match"]:
+        route = get_model_route(name)
+        assert (route.primary, route.fallback) == (ModelTier.Fast, ModelTier.Standard)
+
+    route = get_model_route("Inspection")
+    assert (route.primary, route.fallback) == (ModelTier.Standard, None)
+
+
+def test_invalid_outputs_escalate_to_the_fallback_model():
+    """Outputs failing validation on the primary model are retried a few times, then requested from the fallback model."""
+    primary, fallback = make_model(7), make_model(1)
+    mapper = ChoiceMapper("choice", Choice, "Choose an option.", model=primary, fallback_model=fallback)
+
+    assert asyncio.run(mapper.run(2)).index == 1
+    assert (primary.stats.calls, fallback.stats.calls) == (ChoiceMapper.PRIMARY_ATTEMPTS_BEFORE_ESCALATION, 1)
+    assert (mapper.stats.attempts, mapper.stats.escalated_attempts, mapper.stats.failures) == (ChoiceMapper.PRIMARY_ATTEMPTS_BEFORE_ESCALATION + 1, 1, 0)
+
+    # Valid outputs of the primary model never reach the fallback model.
+    primary = make_model(0)
+    mapper = ChoiceMapper("choice", Choice, "Choose an option.", model=primary, fallback_model=fallback)
+    assert asyncio.run(mapper.run(2)).index == 0
+    assert (primary.stats.calls, fallback.stats.calls, mapper.stats.escalated_attempts) == (1, 1, 0)
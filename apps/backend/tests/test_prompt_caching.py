@@ -0,0 +1,73 @@
+"""Prompt prefix layout and cached token accounting unit test module."""
+
+from collections import defaultdict
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.engine import db_sessionmaker
+from backend.database.models import PipelineTraceSpan, Project, TraceSpanKind
+from backend.tasks.preprocessing import preprocess_song
+
+
+@pytest.mark.anyio
+async def test_batches_of_a_song_share_the_prompt_prefix(benchmark_database, fake_chat_model):
+    """Each chain sends the same prefix for every batch of a song, and later runs are served partly from the prompt cache."""
+    prompts: dict[str, list[str]] = defaultdict(list)
+
+    def respond(messages, tools):
+        prompts[tools[0]["function"]["name"]].append(messages[-1].content)
+        return None
+
+    fake_chat_model.responder, fake_chat_model.prompt_cache_min_tokens = respond, 64
+
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=3, lines_per_verse=6)
+        project_id = (await seed_synthetic_projects(db, songs, 1))[0].id
+
+    async with db_sessionmaker() as db:
+        await preprocess_song(project_id, db, force=True)
+
+    assert len(prompts) == 4
+    for chain_prompts in prompts.values():
+        prefixes = {prompt[:prompt.index('"lyrics"')] for prompt in chain_prompts}
+        assert len(prefixes) == 1 and '"user_settings"' in prefixes.pop()
+
+    # Retries of the first run may already hit the cache, so only the tokens of the second run are compared.
+    cached_before = fake_chat_model.stats.cached_prompt_tokens
+    async with db_sessionmaker() as db:
+        await preprocess_song(project_id, db, force=True)
+        processing_id = (await db.get(Project, project_id)).last_processing_id
+        spans = (await db.exec(select(PipelineTraceSpan).where(PipelineTraceSpan.processing_id == processing_id)
+                               .where(PipelineTraceSpan.kind == TraceSpanKind.Chain))).all()
+
+    assert sum(span.cached_prompt_tokens for span in spans) == fake_chat_model.stats.cached_prompt_tokens - cached_before > 0
+    assert all(span.cached_prompt_tokens <= span.prompt_tokens for span in spans)
+
+
+@pytest.mark.anyio
+async def test_spans_of_a_failed_preprocessing_are_stored(benchmark_database, fake_chat_model):
+    """The results of a failed run are rolled back, but its spans are stored with the error."""
+    def respond(messages, tools):
+        if tools[0]["function"]["name"].startswith("GlossOption"):
+            raise RuntimeError("Gloss options unavailable")
+        return None
+
+    fake_chat_model.responder = respond
+
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=2)
+        project_id = (await seed_synthetic_projects(db, songs, 1))[0].id
+
+    async with db_sessionmaker() as db:
+        with pytest.raises(RuntimeError):
+            await preprocess_song(project_id, db, force=True)
+        assert (await db.get(Project, project_id)).last_processing_id is None
+
+    async with db_sessionmaker() as db:
+        spans = (await db.exec(select(PipelineTraceSpan).where(PipelineTraceSpan.project_id == project_id))).all()
+
+    root = next(span for span in spans if span.name == "preprocessing")
+    assert "Gloss options unavailable" in root.error
+    assert any(span.kind == TraceSpanKind.Chain and span.error is not None for span in spans)
@@ -0,0 +1,25 @@
+"""Precompiled prompt template registry unit test module."""
+
+import pytest
+from langchain_core.prompts.string import jinja2_formatter
+
+from backend.tasks.chat.prompts import MEANING_TEMPLATE
+from backend.utils.prompt_templates import PromptTemplateRegistry, prompt_templates
+
+
+def test_registry_renders_like_jinja2_formatter():
+    """Compiled templates render the same text as formatting their source on every call."""
+    variables = dict(title="Stars", artist="Synthetic", lyric_line="I'm in the stars tonight", user_name="Alex", sign_language="ASL")
+    for line_inspection_results in [None, '{"description": "A dream."}']:
+        assert prompt_templates.render(MEANING_TEMPLATE, line_inspection_results=line_inspection_results, **variables) == \
+            jinja2_formatter(template=prompt_templates.get_source(MEANING_TEMPLATE), line_inspection_results=line_inspection_results, **variables)
+
+
+def test_registering_another_source_under_a_name_fails():
+    """A name stands for one template; registering the same source again is allowed."""
+    registry = PromptTemplateRegistry()
+    assert registry.register("greeting", "Hello {{name}}") == "greeting"
+    assert registry.register("greeting", "Hello {{name}}") == "greeting"
+    with pytest.raises(ValueError):
+        registry.register("greeting", "Bye {{name}}")
+    assert registry.render("greeting", name="ELMI") == "Hello ELMI"
@@ -0,0 +1,117 @@
+"""Single-flight request coalescing unit test module."""
+
+import asyncio
+import json
+from os import path
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_songs, use_benchmark_data_dir
+from backend.database.engine import db_sessionmaker
+from backend.database.models import BodyLanguage, CachedSongInspectionResult, LineInfo, MediaType, ProjectConfiguration, SignLanguageType, SigningSpeed, Song, SongInfo, TrimmedMedia
+from backend.router.app.media import _get_or_trim_media, media_trims
+from backend.tasks.preprocessing import inspect_song, make_song_lyrics_hash, song_inspections
+from backend.tasks.preprocessing.common import InspectionPipelineInputArgs
+from backend.tasks.preprocessing.inspection import InspectionPipeline
+from backend.tasks.tracing import PipelineTracer
+from backend.utils.single_flight import SingleFlight
+
+
+def test_concurrent_duplicates_share_one_run():
+    """Callers with the same key await one run, a cancelled caller leaves it running, and failures reach every caller."""
+
+    async def run():
+        flight: SingleFlight[str] = SingleFlight("test")
+        calls: list[str] = []
+
+        async def work(value: str) -> str:
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            if value == "fail":
+                raise ValueError(value)
+            return value.upper()
+
+        leaving = asyncio.create_task(flight.run("a", lambda: work("a")))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        results = await asyncio.gather(*[flight.run("a", lambda: work("a")) for _ in range(3)], flight.run("b", lambda: work("b")))
+        assert results == ["A", "A", "A", "B"]
+        assert sorted(calls) == ["a", "b"]
+        assert (flight.started, flight.joined) == (2, 3)
+        assert not flight.in_flight("a")
+
+        failures = await asyncio.gather(*[flight.run("c", lambda: work("fail")) for _ in range(2)], return_exceptions=True)
+        assert all(isinstance(failure, ValueError) for failure in failures)
+        assert not flight.in_flight("c")
+
+        # Once done, the key runs again.
+        assert await flight.run("a", lambda: work("a")) == "A"
+        assert calls.count("a") == 2
+
+    asyncio.run(run())
+
+
+@pytest.mark.anyio
+async def test_concurrent_trims_store_one_cache_entry(benchmark_database, tmp_path):
+    """Concurrent requests for the same media range run one export and store one cache entry, which later requests reuse."""
+    exports: list[str] = []
+
+    def export(trimmed_file_path: str):
+        exports.append(trimmed_file_path)
+        with open(trimmed_file_path, "wb") as f:
+            f.write(b"trimmed")
+
+    use_benchmark_data_dir(str(tmp_path))
+    async with db_sessionmaker() as db:
+        song = (await seed_synthetic_songs(db, 1))[0]
+
+    key = (song.id, MediaType.Audio, "audio.mp3", 0, 3000)
+    def trim():
+        return _get_or_trim_media(song.id, MediaType.Audio, "audio.mp3", 0, 3000, "trimmed.mp3", export)
+
+    paths = await asyncio.gather(*[media_trims.run(key, trim) for _ in range(4)])
+    assert len(set(paths)) == 1 and path.exists(paths[0])
+    assert await media_trims.run(key, trim) == paths[0]
+    assert len(exports) == 1
+
+    async with db_sessionmaker() as db:
+        assert len((await db.exec(select(TrimmedMedia))).all()) == 1
+
+
+
+@pytest.mark.anyio
+async def test_song_inspection_started_before_the_first_commit_is_stored_once(benchmark_database, fake_chat_model):
+    """A project inspecting the song after the inspection of another one ended, but before its commit, does not fail on the cache entry."""
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=2, lines_per_verse=4)
+    started = song_inspections.started
+
+    async with db_sessionmaker() as first_db, db_sessionmaker() as second_db:
+        song = await first_db.get(Song, songs[0].id)
+        tracer = PipelineTracer("processing", "project")
+        inspections = await inspect_song(song, ProjectConfiguration(), first_db, tracer)
+        assert not song_inspections.in_flight((song.id, make_song_lyrics_hash(song), ProjectConfiguration().to_inspection_settings().make_hash()))
+
+        # The second inserts its entry once the first commits.
+        second_run = asyncio.create_task(inspect_song(await second_db.get(Song, song.id), ProjectConfiguration(), second_db, tracer))
+        await asyncio.sleep(0.1)
+        await first_db.commit()
+        assert await second_run == inspections
+        await second_db.commit()
+
+    async with db_sessionmaker() as db:
+        assert len((await db.exec(select(CachedSongInspectionResult))).all()) == 1
+        assert len(await inspect_song(await db.get(Song, song.id), ProjectConfiguration(), db, tracer)) == len(inspections)
+    assert song_inspections.started - started == 2
+
+
+def test_song_inspection_reads_only_the_inspection_settings():
+    """The inspector is prompted with the inspection settings alone, so projects differing in other settings share its cache entry."""
+    settings = ProjectConfiguration(main_language=SignLanguageType.PSE, signing_speed=SigningSpeed.Fast, body_language=BodyLanguage.Rich)
+    song = SongInfo(id="song", title="Stars", artist="Synthetic", duration_seconds=180, reference_video_id="video", description="A song.")
+    lines = [LineInfo(id="line", song_id="song", verse_id="verse", line_number=0, lyric="I'm in the stars tonight", start_millis=0, end_millis=1000)]
+
+    prompt = json.loads(InspectionPipeline._input_to_str(InspectionPipelineInputArgs(lyric_lines=lines, song_info=song, configuration=settings), {}))
+    assert prompt["user_settings"] == {"main_audience": "deaf", "main_language": "PSE", "language_proficiency": "moderate"}
+    assert settings.to_inspection_settings().make_hash() == settings.model_copy(update={"signing_speed": SigningSpeed.Slow}).to_inspection_settings().make_hash()
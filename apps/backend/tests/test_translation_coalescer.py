@@ -0,0 +1,97 @@
+"""Translation upsert coalescing unit test module."""
+
+import asyncio
+
+import pytest
+from sqlmodel import select
+
+from backend.benchmark.synthetic import seed_synthetic_projects, seed_synthetic_songs
+from backend.database.engine import db_sessionmaker
+from backend.database.models import InteractionLog, InteractionType, Line, LineTranslation
+from backend.tasks import translation_coalescer
+from backend.tasks.translation_coalescer import TranslationUpsertCoalescer
+
+
+@pytest.mark.anyio
+async def test_rapid_updates_are_written_once(benchmark_database):
+    """A burst of updates returns the latest state right away and results in one row write and one EnterGloss log."""
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=2)
+        project = (await seed_synthetic_projects(db, songs, 1))[0]
+        line = (await db.exec(select(Line))).first()
+
+    coalescer = TranslationUpsertCoalescer(window_seconds=0.05, prefetch_alt_glosses=False)
+    async with db_sessionmaker() as db:
+        states = [await coalescer.upsert(db, project.user_id, project.id, line.id, {"gloss": gloss})
+                  for gloss in ["H", "HE", "HELLO", ""]]
+        states.append(await coalescer.upsert(db, project.user_id, project.id, line.id, {"gloss": "HELLO WORLD", "memo": "Wave"}))
+
+    assert [state.gloss for state in states] == ["H", "HE", "HELLO", None, "HELLO WORLD"]
+    assert len(set(state.id for state in states)) == 1
+    assert coalescer.merge_pending(project.id, [])[0].memo == "Wave"
+
+    await asyncio.sleep(0.2)
+    assert coalescer.get_pending(project.id, line.id) is None
+
+    async with db_sessionmaker() as db:
+        translations = (await db.exec(select(LineTranslation))).all()
+        logs = (await db.exec(select(InteractionLog).where(InteractionLog.type == InteractionType.EnterGloss))).all()
+
+    assert [(t.id, t.gloss, t.memo) for t in translations] == [(states[-1].id, "HELLO WORLD", "Wave")]
+    assert len(logs) == 1
+    assert logs[0].metadata_json["initial"] is True
+    assert logs[0].metadata_json["before"] is None and logs[0].metadata_json["after"] == "HELLO WORLD"
+    assert logs[0].metadata_json["coalesced_updates"] == 5
+
+    # A later burst starts from the written state.
+    async with db_sessionmaker() as db:
+        await coalescer.upsert(db, project.user_id, project.id, line.id, {"memo": "Wave twice"})
+    await coalescer.flush(project.id)
+
+    async with db_sessionmaker() as db:
+        translation = (await db.exec(select(LineTranslation))).one()
+        logs = (await db.exec(select(InteractionLog).where(InteractionLog.type == InteractionType.EnterGloss))).all()
+    assert (translation.gloss, translation.memo) == ("HELLO WORLD", "Wave twice")
+    assert len(logs) == 1
+
+
+@pytest.mark.anyio
+async def test_failed_writes_are_retried(benchmark_database, monkeypatch):
+    """A burst whose write fails stays pending and is written by a later attempt, until the attempts run out."""
+    async with db_sessionmaker() as db:
+        songs = await seed_synthetic_songs(db, 1, verse_count=1, lines_per_verse=2)
+        project = (await seed_synthetic_projects(db, songs, 1))[0]
+        lines = (await db.exec(select(Line))).all()
+
+    failures = {"left": 1}
+    store = translation_coalescer.store_interaction_log
+
+    async def store_interaction_log(*args, **kwargs):
+        if failures["left"] > 0:
+            failures["left"] -= 1
+            raise RuntimeError("Database unavailable")
+        return await store(*args, **kwargs)
+
+    monkeypatch.setattr(translation_coalescer, "store_interaction_log", store_interaction_log)
+    coalescer = TranslationUpsertCoalescer(window_seconds=0.01, retry_delay_seconds=0.05, prefetch_alt_glosses=False)
+
+    async with db_sessionmaker() as db:
+        await coalescer.upsert(db, project.user_id, project.id, lines[0].id, {"gloss": "HELLO"})
+    await asyncio.sleep(0.03)
+    assert coalescer.get_pending(project.id, lines[0].id).gloss == "HELLO"
+
+    await asyncio.sleep(0.1)
+    assert coalescer.get_pending(project.id, lines[0].id) is None
+    async with db_sessionmaker() as db:
+        assert [t.gloss for t in (await db.exec(select(LineTranslation))).all()] == ["HELLO"]
+        logs = (await db.exec(select(InteractionLog).where(InteractionLog.type == InteractionType.EnterGloss))).all()
+    assert [(log.metadata_json["before"], log.metadata_json["after"]) for log in logs] == [(None, "HELLO")]
+
+    # Flushing retries right away and gives up after the last attempt.
+    failures["left"] = coalescer.max_write_attempts
+    async with db_sessionmaker() as db:
+        await coalescer.upsert(db, project.user_id, project.id, lines[1].id, {"gloss": "WORLD"})
+    await coalescer.flush(project.id)
+    assert coalescer.get_pending(project.id, lines[1].id) is None and failures["left"] == 0
+    async with db_sessionmaker() as db:
+        assert [t.gloss for t in (await db.exec(select(LineTranslation))).all()] == ["HELLO"]